@@ -0,0 +1,10 @@
+export async function GET(request: Request) {
+  try {
+    const { search } = new URL(request.url)
+    const response = await fetch(`http://localhost:8000/logs${search}`)
+    const data = await response.json()
+    return Response.json(data)
+  } catch (error) {
+    return Response.json({ error: "Falha ao conectar com o backend" }, { status: 500 })
+  }
+}
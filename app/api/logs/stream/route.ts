@@ -0,0 +1,22 @@
+export const dynamic = "force-dynamic"
+
+export async function GET(request: Request) {
+  try {
+    const { search } = new URL(request.url)
+    const lastEventId = request.headers.get("last-event-id")
+    const response = await fetch(`http://localhost:8000/logs/stream${search}`, {
+      headers: lastEventId ? { "Last-Event-ID": lastEventId } : {},
+      signal: request.signal,
+    })
+    // Repassa o corpo SSE sem bufferizar
+    return new Response(response.body, {
+      headers: {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        Connection: "keep-alive",
+      },
+    })
+  } catch (error) {
+    return Response.json({ error: "Falha ao conectar com o backend" }, { status: 500 })
+  }
+}
@@ -0,0 +1,119 @@
+"""
+Benchmark de vazão do backend com uma Binance lenta simulada.
+
+Compara o comportamento anterior (chamada síncrona da python-binance dentro do
+endpoint async, bloqueando o event loop) com o atual (chamada no executor limitado,
+com as requisições simultâneas servidas por um único snapshot da conta).
+Uso: python -m backend.benchmark_latency --requests 50 --concurrency 25 --latency 0.2
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import threading
+import time
+
+import aiohttp
+import uvicorn
+
+from backend import main as backend
+
+
+class SlowBinanceClient:
+    """Cliente falso: responde futures_account e futures_position_information após `latency` segundos, como uma Binance lenta."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def futures_account(self, **params):
+        time.sleep(self.latency)
+        self.calls += 1
+        return {
+            'assets': [{'asset': 'USDT'}], 'totalWalletBalance': '100', 'totalUnrealizedProfit': '0',
+            'totalMarginBalance': '100', 'availableBalance': '100', 'totalMaintMargin': '0',
+        }
+
+    def futures_position_information(self, **params):
+        time.sleep(self.latency)
+        self.calls += 1
+        return [{
+            'symbol': 'BTCUSDT', 'positionAmt': '0', 'entryPrice': '0', 'markPrice': '0',
+            'unRealizedProfit': '0', 'leverage': '15', 'initialMargin': '0',
+        }]
+
+
+@backend.app.get("/benchmark/blocking-positions")
+async def blocking_positions():
+    # Reproduz o endpoint /positions anterior: chamada síncrona direto no event loop
+    return {"positions": backend.build_open_positions(backend.fetch_account_state()["positions"])}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    server = uvicorn.Server(uvicorn.Config(backend.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def measure(url, total_requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(session):
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.get(url) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(session) for _ in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "throughput": total_requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def report(label, result):
+    print(f"  {label:<38} {result['throughput']:7.1f} req/s | total {result['elapsed']:.2f}s | p50 {result['p50'] * 1000:.0f} ms | p95 {result['p95'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vazão de requisições concorrentes antes/depois do executor.")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--latency", type=float, default=0.2, help="Latência simulada da Binance (s)")
+    args = parser.parse_args()
+
+    port = free_port()
+    server, thread = start_server(port)
+    slow_client = SlowBinanceClient(args.latency)
+    backend.client = slow_client
+
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"{args.requests} requisições, {args.concurrency} simultâneas, Binance com {args.latency * 1000:.0f} ms de latência")
+    before = asyncio.run(measure(f"{base_url}/benchmark/blocking-positions", args.requests, args.concurrency))
+    report("Antes (chamada no event loop):", before)
+    calls_before = slow_client.calls
+    after = asyncio.run(measure(f"{base_url}/positions", args.requests, args.concurrency))
+    report("Depois (executor + snapshot da conta):", after)
+    print(f"  Ganho de vazão: {after['throughput'] / before['throughput']:.1f}x")
+    print(f"  Chamadas à Binance: {calls_before} antes, {slow_client.calls - calls_before} depois")
+
+    server.should_exit = True
+    thread.join(timeout=5)
@@ -1,11 +1,15 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import json
 import os
+import sys
 import asyncio
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Dict, List, Optional
 import logging
 from datetime import datetime
@@ -14,8 +18,18 @@ from datetime import datetime
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from requests.exceptions import ConnectionError
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+# Módulos compartilhados com o bot (scripts/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from binance_scheduler import BinanceRequestScheduler, ScheduledClient, PRIORITY_DASHBOARD
+from market_stream import MarketDataTable, MarketStream
+from log_pipeline import BACKEND_LOG_FILE, BOT_LOG_FILE, LOG_DIR, LogFollower, format_log_record, record_matches, setup_logging
+from metrics import REGISTRY as METRICS_REGISTRY, gauge_snapshot, load_snapshot as load_metrics_snapshot, render_prometheus
+from user_stream import UserDataStream
+from watchlist import load_snapshot as load_watchlist_snapshot
+
 app = FastAPI(title="Binance Trading Bot API", version="1.0.0")
 
 # CORS para permitir frontend
@@ -35,6 +49,24 @@ API_SECRET = os.getenv("BINANCE_API_SECRET")
 # Cliente Binance global
 client = None
 
+# Executor limitado para as chamadas síncronas da python-binance: os endpoints async não bloqueiam o event loop
+BINANCE_EXECUTOR_MAX_WORKERS = 8
+binance_executor = ThreadPoolExecutor(max_workers=BINANCE_EXECUTOR_MAX_WORKERS, thread_name_prefix="binance")
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(binance_executor, partial(func, *args, **kwargs))
+
+# Agendador de peso das requisições REST (mantido entre reinicializações do cliente)
+request_scheduler = BinanceRequestScheduler()
+
+# Preços de marcação via websocket para os símbolos com posição aberta
+market_data = MarketDataTable()
+mark_price_stream = None
+
+# User data stream: eventos de conta invalidam o snapshot de saldo/posições
+user_stream = None
+
 # Estado global do bot
 bot_state = {
     "running": False,
@@ -44,17 +76,15 @@ bot_state = {
     "logs": []
 }
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/bot_activity.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Configuração de logging: mesmo pipeline assíncrono do bot, num arquivo próprio (cada processo rotaciona o seu)
+setup_logging(BACKEND_LOG_FILE)
 logger = logging.getLogger(__name__)
 
+# Log do bot acompanhado em memória: /logs lê do buffer e /logs/stream recebe as linhas novas
+LOG_STREAM_HEARTBEAT_SECONDS = 15 # Comentário SSE enviado sem novos registros (mantém proxies com a conexão aberta)
+LOG_STREAM_QUEUE_SIZE = 1000 # Registros pendentes por cliente antes de descartar (cliente lento)
+bot_log_follower = LogFollower(os.path.join(LOG_DIR, BOT_LOG_FILE))
+
 # Função para inicializar o cliente Binance
 def initialize_binance_client():
     global client
@@ -63,7 +93,10 @@ def initialize_binance_client():
         return False
 
     try:
-        temp_client = Client(API_KEY, API_SECRET)
+        temp_client = ScheduledClient(API_KEY, API_SECRET, scheduler=request_scheduler)
+        # Sessão HTTP compartilhada com um pool de conexões do tamanho do executor
+        adapter = HTTPAdapter(pool_connections=BINANCE_EXECUTOR_MAX_WORKERS, pool_maxsize=BINANCE_EXECUTOR_MAX_WORKERS)
+        temp_client.session.mount("https://", adapter)
         temp_client.futures_ping()  # Testa a conexão
         client = temp_client
         logger.info("Cliente Binance Futures inicializado com sucesso.")
@@ -73,93 +106,168 @@ def initialize_binance_client():
         client = None
         return False
 
-# Função para obter saldo
-def get_binance_balance():
+# Função para baixar o estado da conta: uma chamada de conta e uma de posições servem todos os endpoints
+def fetch_account_state():
     global client
     if client is None:
         if not initialize_binance_client():
-            return None
-    
-    try:
-        # Obter saldo da conta Futures
+            raise RuntimeError("Cliente Binance não inicializado")
+
+    # Leitura do painel: prioridade abaixo de ordens e varredura
+    with request_scheduler.priority(PRIORITY_DASHBOARD):
         account_info = client.futures_account()
-        balance_info = client.futures_account_balance()
-        
-        # Encontrar saldo USDT
-        usdt_balance = None
-        for asset in balance_info:
-            if asset["asset"] == "USDT":
-                usdt_balance = asset
-                break
-        
-        if not usdt_balance:
+        positions = client.futures_position_information()
+    return {"account": account_info, "positions": positions}
+
+# Função para obter saldo a partir do futures_account
+def build_balance(account_info):
+    # Encontrar saldo USDT
+    if not any(asset["asset"] == "USDT" for asset in account_info.get("assets", [])):
+        return None
+
+    # Obter informações da conta
+    total_wallet_balance = float(account_info['totalWalletBalance'])
+    total_unrealized_pnl = float(account_info['totalUnrealizedProfit'])
+    total_margin_balance = float(account_info['totalMarginBalance'])
+    available_balance = float(account_info['availableBalance'])
+
+    # Calcular saldo em uso
+    used_balance = total_margin_balance - available_balance
+
+    return {
+        "total_balance": total_margin_balance,
+        "available_balance": available_balance,
+        "used_balance": max(0, used_balance),
+        "unrealized_pnl": total_unrealized_pnl,
+        "total_wallet_balance": total_wallet_balance,
+        "currency": "USDT",
+        "margin_ratio": float(account_info.get('totalMaintMargin', 0)) / total_margin_balance * 100 if total_margin_balance > 0 else 0
+    }
+
+# Função para acompanhar via websocket o preço de marcação dos símbolos com posição aberta
+def watch_mark_prices(symbols):
+    global mark_price_stream
+    if mark_price_stream is None:
+        if not symbols:
+            return
+        mark_price_stream = MarketStream(symbols, market_data)
+        mark_price_stream.start()
+    else:
+        mark_price_stream.update_symbols(symbols)
+
+# Função para obter posições abertas a partir do futures_position_information
+def build_open_positions(positions):
+    open_positions = []
+
+    for position in positions:
+        position_amt = float(position['positionAmt'])
+        if position_amt != 0:
+            entry_price = float(position['entryPrice'])
+            mark_price = float(position['markPrice'])
+            unrealized_pnl = float(position['unRealizedProfit'])
+
+            # Preço de marcação do websocket é mais recente que o da resposta REST
+            streamed_mark_price = market_data.get_mark_price(position['symbol'])
+            if streamed_mark_price is not None:
+                mark_price = streamed_mark_price
+                unrealized_pnl = (mark_price - entry_price) * position_amt
+
+            pnl_percent = 0
+            if entry_price > 0:
+                pnl_percent = ((mark_price - entry_price) / entry_price) * 100
+                if position_amt < 0:
+                    pnl_percent = -pnl_percent
+
+            open_positions.append({
+                "symbol": position['symbol'],
+                "side": "LONG" if position_amt > 0 else "SHORT",
+                "size": abs(position_amt),
+                "entry_price": entry_price,
+                "current_price": mark_price,
+                "pnl": unrealized_pnl,
+                "pnl_percent": pnl_percent,
+                "status": "OPEN",
+                "leverage": float(position['leverage']),
+                "margin": float(position['initialMargin'])
+            })
+
+    watch_mark_prices([p["symbol"] for p in open_positions])
+    return open_positions
+
+# Cache compartilhado do estado da conta
+class AccountSnapshotCache:
+    """
+    Snapshot único de conta e posições servido a /balance, /positions e /status.
+
+    A Binance é consultada no máximo uma vez por `interval_seconds`; requisições que chegam
+    enquanto uma atualização está em andamento aguardam essa mesma atualização em vez de
+    disparar outra. `invalidate()` força a próxima leitura a buscar dados novos (ex.: após
+    fechar uma posição ou ao receber um evento de conta do user data stream).
+    """
+
+    def __init__(self, fetch, interval_seconds):
+        self.fetch = fetch
+        self.interval_seconds = interval_seconds
+        self.fetched_at = None
+        self._snapshot = None
+        self._inflight = None
+        self._stale = False
+        self.refresh_count = 0
+        self.coalesced_count = 0
+
+    def age_seconds(self):
+        if self.fetched_at is None:
             return None
-        
-        # Obter informações da conta
-        total_wallet_balance = float(account_info['totalWalletBalance'])
-        total_unrealized_pnl = float(account_info['totalUnrealizedProfit'])
-        total_margin_balance = float(account_info['totalMarginBalance'])
-        available_balance = float(account_info['availableBalance'])
-        
-        # Calcular saldo em uso
-        used_balance = total_margin_balance - available_balance
-        
+        return time.time() - self.fetched_at
+
+    def invalidate(self):
+        self._stale = True
+
+    async def get(self, max_age_seconds=None):
+        if max_age_seconds is None:
+            max_age_seconds = self.interval_seconds
+        age = self.age_seconds()
+        if self._snapshot is not None and not self._stale and age <= max_age_seconds:
+            return self._snapshot
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        else:
+            self.coalesced_count += 1
+        # shield: o cancelamento de um cliente não cancela a atualização aguardada pelos demais
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self):
+        try:
+            self._stale = False
+            snapshot = await run_blocking(self.fetch)
+            self._snapshot = snapshot
+            self.fetched_at = time.time()
+            self.refresh_count += 1
+            return snapshot
+        finally:
+            self._inflight = None
+
+    def get_status(self):
         return {
-            "total_balance": total_margin_balance,
-            "available_balance": available_balance,
-            "used_balance": max(0, used_balance),
-            "unrealized_pnl": total_unrealized_pnl,
-            "total_wallet_balance": total_wallet_balance,
-            "currency": "USDT",
-            "margin_ratio": float(account_info.get('totalMaintMargin', 0)) / total_margin_balance * 100 if total_margin_balance > 0 else 0
+            "snapshot_age_seconds": self.age_seconds(),
+            "interval_seconds": self.interval_seconds,
+            "refresh_count": self.refresh_count,
+            "coalesced_count": self.coalesced_count,
         }
-        
-    except Exception as e:
-        logger.error(f"Falha ao obter saldo: {e}")
-        return None
 
-# Função para obter posições abertas
-def get_open_positions():
-    global client
+ACCOUNT_SNAPSHOT_INTERVAL_SECONDS = 3 # O painel consulta a cada 5s; todas as abas e cards compartilham o mesmo snapshot
+account_snapshot = AccountSnapshotCache(fetch_account_state, ACCOUNT_SNAPSHOT_INTERVAL_SECONDS)
+
+# Função para (re)iniciar o user data stream com o cliente atual
+def start_user_stream():
+    global user_stream
+    if user_stream is not None:
+        user_stream.stop()
+        user_stream = None
     if client is None:
-        if not initialize_binance_client():
-            return []
-    
-    try:
-        positions = client.futures_position_information()
-        open_positions = []
-        
-        for position in positions:
-            position_amt = float(position['positionAmt'])
-            if position_amt != 0:
-                entry_price = float(position['entryPrice'])
-                mark_price = float(position['markPrice'])
-                unrealized_pnl = float(position['unRealizedProfit'])
-                
-                pnl_percent = 0
-                if entry_price > 0:
-                    pnl_percent = ((mark_price - entry_price) / entry_price) * 100
-                    if position_amt < 0:
-                        pnl_percent = -pnl_percent
-                
-                open_positions.append({
-                    "symbol": position['symbol'],
-                    "side": "LONG" if position_amt > 0 else "SHORT",
-                    "size": abs(position_amt),
-                    "entry_price": entry_price,
-                    "current_price": mark_price,
-                    "pnl": unrealized_pnl,
-                    "pnl_percent": pnl_percent,
-                    "status": "OPEN",
-                    "leverage": float(position['leverage']),
-                    "margin": float(position['initialMargin'])
-                })
-        
-        return open_positions
-        
-    except Exception as e:
-        logger.error(f"Falha ao obter posições: {e}")
-        return []
+        return
+    user_stream = UserDataStream(client, on_account_update=lambda event: account_snapshot.invalidate())
+    user_stream.start()
 
 # Inicializar na startup
 @app.on_event("startup")
@@ -167,9 +275,11 @@ async def startup_event():
     # Criar diretórios necessários
     os.makedirs("logs", exist_ok=True)
     os.makedirs("config", exist_ok=True)
+    bot_log_follower.start()
     
     # Inicializar cliente Binance
-    initialize_binance_client()
+    if await run_blocking(initialize_binance_client):
+        start_user_stream()
     
     logger.info("🚀 Bot API iniciado no Railway!")
 
@@ -187,6 +297,13 @@ class BotConfig(BaseModel):
     min_atr_multiplier_for_entry: float = 1.5
     max_symbols_to_monitor: int = 5
     risk_reward_ratio: float = 2.0
+    margin_type: Optional[str] = None # "ISOLATED" ou "CROSSED"; None mantém o tipo de margem da conta
+    watchlist_rescan_minutes: int = 60 # Intervalo das novas varreduras de símbolos (0 desativa)
+    # Pré-filtro da varredura pelas estatísticas de 24h (0 desativa cada limite)
+    scan_min_quote_volume_usdt: float = 10_000_000
+    scan_max_price_change_percent: float = 30.0
+    scan_max_spread_percent: float = 0.1
+    scan_prefilter_top_k: int = 60
 
 class APICredentials(BaseModel):
     api_key: str
@@ -198,6 +315,7 @@ class BotStatus(BaseModel):
     uptime: Optional[str]
     positions_count: int
     test_mode: bool
+    snapshot_age_seconds: Optional[float] = None
 
 # Endpoints
 @app.get("/")
@@ -218,6 +336,33 @@ async def health_check():
         "binance_connected": client is not None
     }
 
+@app.get("/rate-limit")
+async def get_rate_limit_status():
+    return request_scheduler.get_status()
+
+@app.get("/account/snapshot")
+async def get_account_snapshot_status():
+    return account_snapshot.get_status()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Métricas deste processo e o último snapshot gravado pelo bot, no formato de texto do Prometheus
+    sources = [(METRICS_REGISTRY.snapshot(), {"process": "backend"})]
+    bot_snapshot = load_metrics_snapshot()
+    if bot_snapshot is not None:
+        sources.append((bot_snapshot["metrics"], {"process": "bot"}))
+        sources.append(({"bot_metrics_snapshot_age_seconds": gauge_snapshot(
+            "Idade do snapshot de métricas gravado pelo bot", time.time() - bot_snapshot["written_at"])}, {}))
+    return PlainTextResponse(render_prometheus(sources), media_type="text/plain; version=0.0.4")
+
+@app.get("/watchlist")
+async def get_watchlist():
+    # Lista de símbolos monitorados gravada pelo bot a cada varredura
+    snapshot = load_watchlist_snapshot()
+    if snapshot is None:
+        return {"symbols": [], "kept_for_open_positions": [], "last_scan_at": None, "next_scan_at": None, "snapshot_age_seconds": None}
+    return dict(snapshot, snapshot_age_seconds=time.time() - snapshot["written_at"])
+
 @app.get("/status", response_model=BotStatus)
 async def get_bot_status():
     uptime = None
@@ -234,13 +379,21 @@ async def get_bot_status():
             test_mode = config.get("test_mode", True)
     except:
         pass
+
+    positions_count = 0
+    try:
+        snapshot = await account_snapshot.get()
+        positions_count = len(build_open_positions(snapshot["positions"]))
+    except Exception as e:
+        logger.error(f"Falha ao obter posições: {e}")
     
     return BotStatus(
         running=bot_state["running"],
         start_time=bot_state.get("start_time"),
         uptime=uptime,
-        positions_count=len(get_open_positions()),
-        test_mode=test_mode
+        positions_count=positions_count,
+        test_mode=test_mode,
+        snapshot_age_seconds=account_snapshot.age_seconds()
     )
 
 @app.get("/config")
@@ -273,9 +426,11 @@ async def update_credentials(credentials: APICredentials):
         
         # Reinicializar cliente
         client = None
-        success = initialize_binance_client()
+        account_snapshot.invalidate()
+        success = await run_blocking(initialize_binance_client)
         
         if success:
+            await run_blocking(start_user_stream)
             logger.info("Credenciais atualizadas e cliente reinicializado com sucesso")
             return {"message": "Credenciais atualizadas com sucesso"}
         else:
@@ -308,22 +463,69 @@ async def stop_bot():
     return {"message": "Bot parado com sucesso"}
 
 @app.get("/logs")
-async def get_logs():
+async def get_logs(lines: int = 100, level: Optional[str] = None, symbol: Optional[str] = None):
     try:
-        logs = []
-        if os.path.exists("logs/bot_activity.log"):
-            with open("logs/bot_activity.log", "r", encoding="utf-8") as f:
-                lines = f.readlines()
-                logs = [line.strip() for line in lines[-100:]]
-        return {"logs": logs}
+        records = bot_log_follower.get_records(level, symbol, max(1, min(lines, bot_log_follower.buffer_size)))
+        # O bot grava JSON; o painel continua recebendo as linhas no formato de texto
+        return {"logs": [format_log_record(record) for record in records], "records": records}
     except Exception as e:
         return {"logs": [], "error": str(e)}
 
+def _offer_log_record(queue: asyncio.Queue, record: dict):
+    try:
+        queue.put_nowait(record)
+    except asyncio.QueueFull:
+        pass # Cliente lento: perde registros em vez de acumular memória
+
+def _sse_event(record: dict) -> str:
+    return f"id: {record['id']}\ndata: {json.dumps(dict(record, line=format_log_record(record)), ensure_ascii=False)}\n\n"
+
+@app.get("/logs/stream")
+async def stream_logs(request: Request, level: Optional[str] = None, symbol: Optional[str] = None, backlog: int = 100):
+    """Server-Sent Events com os registros do log do bot; reconexões (Last-Event-ID) retomam de onde pararam."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=LOG_STREAM_QUEUE_SIZE)
+
+    def on_record(record):
+        if record_matches(record, level, symbol):
+            loop.call_soon_threadsafe(_offer_log_record, queue, record)
+
+    last_event_id = request.headers.get("last-event-id")
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    async def events():
+        # O ouvinte é registrado antes de ler o buffer: nenhum registro cai entre os dois; repetidos são pulados pelo id
+        bot_log_follower.add_listener(on_record)
+        try:
+            sent_id = after_id or 0
+            for record in bot_log_follower.get_records(level, symbol, max(0, backlog), after_id):
+                yield _sse_event(record)
+                sent_id = record["id"]
+            while True:
+                try:
+                    record = await asyncio.wait_for(queue.get(), LOG_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if record["id"] > sent_id:
+                    yield _sse_event(record)
+                    sent_id = record["id"]
+        finally:
+            bot_log_follower.remove_listener(on_record)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/positions")
 async def get_positions():
     try:
-        positions = get_open_positions()
-        return {"positions": positions}
+        snapshot = await account_snapshot.get()
+        return {
+            "positions": build_open_positions(snapshot["positions"]),
+            "snapshot_age_seconds": account_snapshot.age_seconds()
+        }
     except Exception as e:
         logger.error(f"Erro ao obter posições: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -331,10 +533,12 @@ async def get_positions():
 @app.get("/balance")
 async def get_balance():
     try:
-        balance_data = get_binance_balance()
+        snapshot = await account_snapshot.get()
+        balance_data = build_balance(snapshot["account"])
         if balance_data is None:
             raise HTTPException(status_code=500, detail="Não foi possível obter saldo da Binance")
         
+        balance_data["snapshot_age_seconds"] = account_snapshot.age_seconds()
         return balance_data
     except Exception as e:
         logger.error(f"Erro ao obter saldo: {e}")
@@ -347,7 +551,7 @@ async def close_position(symbol: str):
         raise HTTPException(status_code=500, detail="Cliente Binance não inicializado")
     
     try:
-        positions = client.futures_position_information(symbol=symbol)
+        positions = await run_blocking(client.futures_position_information, symbol=symbol)
         position = None
         
         for pos in positions:
@@ -362,7 +566,8 @@ async def close_position(symbol: str):
         side = Client.SIDE_SELL if position_amt > 0 else Client.SIDE_BUY
         quantity = abs(position_amt)
         
-        order = client.futures_create_order(
+        order = await run_blocking(
+            client.futures_create_order,
             symbol=symbol,
             side=side,
             type=Client.ORDER_TYPE_MARKET,
@@ -370,6 +575,7 @@ async def close_position(symbol: str):
             reduceOnly=True
         )
         
+        account_snapshot.invalidate()
         logger.info(f"Posição {symbol} fechada com sucesso")
         return {"message": f"Posição {symbol} fechada com sucesso", "order_id": order['orderId']}
         
@@ -380,8 +586,10 @@ async def close_position(symbol: str):
 @app.post("/test-connection")
 async def test_connection():
     try:
-        if initialize_binance_client():
-            balance = get_binance_balance()
+        if await run_blocking(initialize_binance_client):
+            # Teste de conexão sempre consulta a Binance, ignorando o snapshot em cache
+            account_snapshot.invalidate()
+            balance = build_balance((await account_snapshot.get())["account"])
             if balance:
                 return {
                     "status": "success",
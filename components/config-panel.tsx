@@ -7,6 +7,7 @@ import { Input } from "@/components/ui/input"
 import { Label } from "@/components/ui/label"
 import { Switch } from "@/components/ui/switch"
 import { Separator } from "@/components/ui/separator"
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select"
 import { Save, AlertTriangle } from "lucide-react"
 import { useToast } from "@/hooks/use-toast"
 
@@ -23,6 +24,12 @@ interface Config {
   min_atr_multiplier_for_entry: number
   max_symbols_to_monitor: number
   risk_reward_ratio: number
+  margin_type: string | null
+  watchlist_rescan_minutes: number
+  scan_min_quote_volume_usdt: number
+  scan_max_price_change_percent: number
+  scan_max_spread_percent: number
+  scan_prefilter_top_k: number
 }
 
 export function ConfigPanel() {
@@ -39,6 +46,12 @@ export function ConfigPanel() {
     min_atr_multiplier_for_entry: 1.5,
     max_symbols_to_monitor: 5,
     risk_reward_ratio: 2.0,
+    margin_type: null,
+    watchlist_rescan_minutes: 60,
+    scan_min_quote_volume_usdt: 10000000,
+    scan_max_price_change_percent: 30.0,
+    scan_max_spread_percent: 0.1,
+    scan_prefilter_top_k: 60,
   })
 
   const [loading, setLoading] = useState(false)
@@ -63,6 +76,12 @@ export function ConfigPanel() {
         min_atr_multiplier_for_entry: data.min_atr_multiplier_for_entry ?? 1.5,
         max_symbols_to_monitor: data.max_symbols_to_monitor ?? 5,
         risk_reward_ratio: data.risk_reward_ratio ?? 2.0,
+        margin_type: data.margin_type ?? null,
+        watchlist_rescan_minutes: data.watchlist_rescan_minutes ?? 60,
+        scan_min_quote_volume_usdt: data.scan_min_quote_volume_usdt ?? 10000000,
+        scan_max_price_change_percent: data.scan_max_price_change_percent ?? 30.0,
+        scan_max_spread_percent: data.scan_max_spread_percent ?? 0.1,
+        scan_prefilter_top_k: data.scan_prefilter_top_k ?? 60,
       })
       setConfigLoaded(true)
     } catch (error) {
@@ -176,6 +195,23 @@ export function ConfigPanel() {
                   onChange={(e) => setConfig({ ...config, risk_reward_ratio: Number(e.target.value) || 0 })}
                 />
               </div>
+
+              <div className="space-y-2">
+                <Label htmlFor="margin_type">Tipo de Margem</Label>
+                <Select
+                  value={config.margin_type ?? "KEEP"}
+                  onValueChange={(value) => setConfig({ ...config, margin_type: value === "KEEP" ? null : value })}
+                >
+                  <SelectTrigger id="margin_type">
+                    <SelectValue />
+                  </SelectTrigger>
+                  <SelectContent>
+                    <SelectItem value="KEEP">Manter da conta</SelectItem>
+                    <SelectItem value="ISOLATED">Isolada</SelectItem>
+                    <SelectItem value="CROSSED">Cruzada</SelectItem>
+                  </SelectContent>
+                </Select>
+              </div>
             </div>
           </div>
 
@@ -264,6 +300,67 @@ export function ConfigPanel() {
                   onChange={(e) => setConfig({ ...config, min_atr_multiplier_for_entry: Number(e.target.value) || 0 })}
                 />
               </div>
+
+              <div className="space-y-2">
+                <Label htmlFor="rescan_minutes">Nova Varredura de Símbolos (min, 0 desativa)</Label>
+                <Input
+                  id="rescan_minutes"
+                  type="number"
+                  value={config.watchlist_rescan_minutes.toString()}
+                  onChange={(e) => setConfig({ ...config, watchlist_rescan_minutes: Number(e.target.value) || 0 })}
+                />
+              </div>
+            </div>
+          </div>
+
+          <Separator />
+
+          {/* Pré-filtro da Varredura */}
+          <div className="space-y-4">
+            <h3 className="text-lg font-semibold">Pré-filtro da Varredura (24h)</h3>
+
+            <div className="grid grid-cols-2 gap-4">
+              <div className="space-y-2">
+                <Label htmlFor="min_quote_volume">Volume Mínimo 24h (USDT)</Label>
+                <Input
+                  id="min_quote_volume"
+                  type="number"
+                  value={config.scan_min_quote_volume_usdt.toString()}
+                  onChange={(e) => setConfig({ ...config, scan_min_quote_volume_usdt: Number(e.target.value) || 0 })}
+                />
+              </div>
+
+              <div className="space-y-2">
+                <Label htmlFor="max_price_change">Variação Máxima 24h (%)</Label>
+                <Input
+                  id="max_price_change"
+                  type="number"
+                  step="1"
+                  value={config.scan_max_price_change_percent.toString()}
+                  onChange={(e) => setConfig({ ...config, scan_max_price_change_percent: Number(e.target.value) || 0 })}
+                />
+              </div>
+
+              <div className="space-y-2">
+                <Label htmlFor="max_spread">Spread Máximo (%)</Label>
+                <Input
+                  id="max_spread"
+                  type="number"
+                  step="0.01"
+                  value={config.scan_max_spread_percent.toString()}
+                  onChange={(e) => setConfig({ ...config, scan_max_spread_percent: Number(e.target.value) || 0 })}
+                />
+              </div>
+
+              <div className="space-y-2">
+                <Label htmlFor="prefilter_top_k">Pares Analisados (Top por Volume)</Label>
+                <Input
+                  id="prefilter_top_k"
+                  type="number"
+                  value={config.scan_prefilter_top_k.toString()}
+                  onChange={(e) => setConfig({ ...config, scan_prefilter_top_k: Number(e.target.value) || 0 })}
+                />
+              </div>
             </div>
           </div>
 
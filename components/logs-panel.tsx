@@ -6,6 +6,8 @@ import { Button } from "@/components/ui/button"
 import { ScrollArea } from "@/components/ui/scroll-area"
 import { RefreshCw, Download } from "lucide-react"
 
+const MAX_LOG_LINES = 100
+
 export function LogsPanel() {
   const [logs, setLogs] = useState<string[]>([])
   const [loading, setLoading] = useState(false)
@@ -13,7 +15,7 @@ export function LogsPanel() {
   const fetchLogs = async () => {
     setLoading(true)
     try {
-      const response = await fetch("/api/logs")
+      const response = await fetch(`/api/logs?lines=${MAX_LOG_LINES}`)
       const data = await response.json()
       setLogs(data.logs || [])
     } catch (error) {
@@ -35,9 +37,14 @@ export function LogsPanel() {
   }
 
   useEffect(() => {
-    fetchLogs()
-    const interval = setInterval(fetchLogs, 10000) // Atualiza a cada 10 segundos
-    return () => clearInterval(interval)
+    // O backend envia as linhas novas assim que são gravadas (SSE); a reconexão é automática
+    const source = new EventSource(`/api/logs/stream?backlog=${MAX_LOG_LINES}`)
+    source.onmessage = (event) => {
+      const record = JSON.parse(event.data)
+      setLogs((current) => [...current, record.line].slice(-MAX_LOG_LINES))
+    }
+    source.onerror = () => console.error("Conexão com o stream de logs interrompida, reconectando...")
+    return () => source.close()
   }, [])
 
   const getLogLevel = (log: string) => {
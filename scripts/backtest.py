@@ -0,0 +1,369 @@
+"""
+Backtest offline da estratégia de pullback sobre klines armazenados.
+
+Reproduz, candle a candle, o que o bot faz no fechamento de cada candle: os mesmos
+indicadores incrementais (EMA/ATR), evaluate_long_signal, calculate_atr_based_sl_tp e
+calcular_quantidade_ordem. Entrada a mercado na abertura do candle seguinte, SL/TP
+resolvidos dentro do candle, taxas e slippage. Cada símbolo é simulado numa conta
+independente e os símbolos rodam em processos separados.
+
+Uso (a partir de scripts/):
+  python backtest.py --download --days 365 --symbols BTCUSDT ETHUSDT
+  python backtest.py --all --workers 8 --intrabar nearest
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from binance_scheduler import BinanceRequestScheduler, ScheduledClient
+from indicators import atr_series, ema_series
+from kline_store import INTERVAL_MS, KLINE_FETCH_LIMIT, KLINE_RECORD_SIZE, KlineStore
+from strategy import (CONFIG_FILE_PATH, KLINE_INTERVAL_MAP, SIGNAL_LONG, calcular_quantidade_ordem,
+                      calculate_min_atr_threshold, evaluate_long_signal)
+from symbol_registry import SymbolRegistry
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_KLINE_DIR = os.path.join('data', 'backtest_klines') # Histórico longo para backtest (sem limite de linhas)
+BACKTEST_RESULTS_DIR = os.path.join('data', 'backtest') # Logs de trades e resumos
+BACKTEST_WORKERS = os.cpu_count() or 1
+SYMBOL_INFO = SymbolRegistry(None) # Filtros por símbolo lidos só do snapshot em disco (atualizado por download_history)
+
+# Mesmo layout dos registros do KlineStore, lido direto do arquivo via memmap
+KLINE_DTYPE = np.dtype([('open_time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                        ('close', '<f8'), ('volume', '<f8'), ('close_time', '<i8')])
+assert KLINE_DTYPE.itemsize == KLINE_RECORD_SIZE
+
+# Parâmetros da estratégia (mesmos padrões do bot) e da simulação
+BACKTEST_DEFAULTS = {
+    'leverage': 15,
+    'risk_per_trade_percent': 0.5,
+    'max_risk_usdt_per_trade': 1.0,
+    'kline_interval_minutes': 60,
+    'kline_trend_period': 50,
+    'kline_pullback_period': 10,
+    'kline_atr_period': 14,
+    'min_atr_multiplier_for_entry': 1.0,
+    'risk_reward_ratio': 2.0,
+    'initial_balance': 1000.0, # Saldo inicial de cada símbolo (USDT)
+    'taker_fee': 0.0005, # Taxa por lado (entrada e saída são ordens a mercado)
+    'slippage': 0.0002, # Slippage relativo aplicado a cada execução a mercado
+    'intrabar': 'conservative', # 'conservative': SL antes do TP no mesmo candle; 'nearest': o nível mais perto da abertura
+}
+
+FIRST_HIT_WINDOW = 256 # Tamanho inicial da janela vetorizada na busca do candle de saída
+
+
+# --- Dados ---
+def load_klines(symbol, interval, base_dir=BACKTEST_KLINE_DIR):
+    """Klines de um arquivo do KlineStore como array estruturado (memmap somente leitura; vazio se não existir)."""
+    path = os.path.join(base_dir, f"{symbol}_{interval}.bin")
+    if not os.path.exists(path) or os.path.getsize(path) < KLINE_DTYPE.itemsize:
+        return np.empty(0, dtype=KLINE_DTYPE)
+    count = os.path.getsize(path) // KLINE_DTYPE.itemsize
+    return np.memmap(path, dtype=KLINE_DTYPE, mode='r', shape=(count,))
+
+
+def stored_symbols(interval, base_dir=BACKTEST_KLINE_DIR):
+    suffix = f"_{interval}.bin"
+    if not os.path.isdir(base_dir):
+        return []
+    return sorted(name[:-len(suffix)] for name in os.listdir(base_dir) if name.endswith(suffix))
+
+
+def download_history(symbols, interval, days, base_dir=BACKTEST_KLINE_DIR):
+    """Baixa (ou completa) `days` dias de candles fechados por símbolo e atualiza o snapshot do exchange info."""
+    client = ScheduledClient(None, None, scheduler=BinanceRequestScheduler())
+    SymbolRegistry(client.futures_exchange_info).refresh()
+    SYMBOL_INFO.load_snapshot()
+
+    store = KlineStore(base_dir=base_dir, max_rows=None)
+    interval_ms = INTERVAL_MS[interval]
+    now_ms = int(time.time() * 1000)
+    for symbol in symbols:
+        last = store.get_last_kline(symbol, interval)
+        start_time = int(last[6]) + 1 if last else now_ms - days * 86_400_000
+        fetched = 0
+        while start_time < now_ms - interval_ms:
+            klines = client.futures_klines(symbol=symbol, interval=interval, limit=KLINE_FETCH_LIMIT, startTime=start_time)
+            # Apenas candles fechados: o histórico do backtest nunca é reescrito
+            klines = [kline for kline in klines if int(kline[6]) < now_ms]
+            if not klines:
+                break
+            fetched += store.merge_klines(symbol, interval, klines)
+            start_time = int(klines[-1][6]) + 1
+        logger.info("%s: %s candles novos (%s no total)", symbol, fetched, store.count(symbol, interval),
+                    extra={'symbol': symbol, 'event': 'history_downloaded'})
+
+
+# --- Simulação ---
+def _first_hit(low, high, start, sl_price, tp_price):
+    """Índice do primeiro candle a partir de `start` que toca o SL ou o TP (-1 se nenhum), em janelas crescentes."""
+    window = FIRST_HIT_WINDOW
+    while start < len(low):
+        end = min(start + window, len(low))
+        hits = (low[start:end] <= sl_price) | (high[start:end] >= tp_price)
+        if hits.any():
+            return start + int(hits.argmax())
+        start = end
+        window *= 4
+    return -1
+
+
+def _exit_fill(open_price, low, high, sl_price, tp_price, intrabar):
+    """(preço do gatilho, motivo) no candle de saída; aberturas além do nível executam na abertura."""
+    if open_price <= sl_price:
+        return open_price, 'SL'
+    if open_price >= tp_price:
+        return open_price, 'TP'
+    sl_hit = low <= sl_price
+    tp_hit = high >= tp_price
+    if sl_hit and tp_hit:
+        if intrabar == 'nearest' and tp_price - open_price < open_price - sl_price:
+            return tp_price, 'TP'
+        return sl_price, 'SL'
+    return (sl_price, 'SL') if sl_hit else (tp_price, 'TP')
+
+
+def compute_indicator_series(klines, trend_period, pullback_period, atr_period):
+    """(ema_trend, ema_pullback, atr) por candle, como o IndicatorEngine os veria no fechamento de cada candle."""
+    close = np.asarray(klines['close'])
+    ohlc = np.column_stack([np.asarray(klines['open']), np.asarray(klines['high']), np.asarray(klines['low']), close])
+    return ema_series(close, trend_period), ema_series(close, pullback_period), atr_series(ohlc, atr_period)
+
+
+def simulate_symbol(symbol, klines, params, indicator_series=None):
+    """
+    Simula a estratégia num símbolo. Retorna a lista de trades (dicionários) em ordem cronológica.
+
+    `indicator_series` permite reaproveitar séries já calculadas (ver compute_indicator_series).
+    """
+    filters = SYMBOL_INFO[symbol]
+    price_precision = filters['price_precision']
+    trend_period = params['kline_trend_period']
+    pullback_period = params['kline_pullback_period']
+    atr_period = params['kline_atr_period']
+    required_klines_count = max(trend_period, pullback_period, atr_period) + 2
+    if len(klines) < required_klines_count + 1:
+        return []
+
+    open_time = np.asarray(klines['open_time'])
+    open_ = np.asarray(klines['open'])
+    high = np.asarray(klines['high'])
+    low = np.asarray(klines['low'])
+    close = np.asarray(klines['close'])
+
+    if indicator_series is None:
+        indicator_series = compute_indicator_series(klines, trend_period, pullback_period, atr_period)
+    ema_trend, ema_pullback, atr = indicator_series
+    min_atr_threshold = calculate_min_atr_threshold(filters['step_size'], params['min_atr_multiplier_for_entry'])
+
+    # Pré-filtro vetorizado com condições necessárias do sinal (tendência, retomada e volatilidade);
+    # só os candidatos passam pela avaliação exata de evaluate_long_signal
+    with np.errstate(invalid='ignore'):
+        candidate_mask = (close > ema_trend) & (close > ema_pullback) & (atr >= min_atr_threshold)
+    candidate_mask[:required_klines_count - 1] = False
+    candidate_mask[-1] = False # Sem candle seguinte para a entrada
+    candidates = np.flatnonzero(candidate_mask).tolist()
+
+    fee = params['taker_fee']
+    slippage = params['slippage']
+    balance = params['initial_balance']
+    trades = []
+    next_allowed = 0
+    for t in candidates:
+        if t < next_allowed:
+            continue
+        if balance <= 0:
+            break
+        current_price = float(close[t])
+        signal, sl_price, tp_price = evaluate_long_signal(
+            current_price, float(low[t]), float(low[t - 1]), float(close[t - 1]),
+            float(ema_trend[t]), float(ema_pullback[t]), float(atr[t]),
+            min_atr_threshold, params['risk_reward_ratio'], price_precision
+        )
+        if signal != SIGNAL_LONG:
+            continue
+        quantity = calcular_quantidade_ordem(
+            round(current_price, price_precision), balance, sl_price, params['leverage'],
+            params['risk_per_trade_percent'], params['max_risk_usdt_per_trade'], symbol, filters
+        )
+        if not quantity:
+            continue
+
+        entry_index = t + 1
+        entry_price = float(open_[entry_index]) * (1 + slippage)
+        exit_index = _first_hit(low, high, entry_index, sl_price, tp_price)
+        if exit_index == -1:
+            exit_index = len(close) - 1
+            trigger_price, exit_reason = float(close[exit_index]), 'END'
+        else:
+            trigger_price, exit_reason = _exit_fill(float(open_[exit_index]), float(low[exit_index]),
+                                                    float(high[exit_index]), sl_price, tp_price, params['intrabar'])
+        exit_price = trigger_price * (1 - slippage)
+
+        fees = (entry_price + exit_price) * quantity * fee
+        pnl = (exit_price - entry_price) * quantity - fees
+        balance += pnl
+        trades.append({
+            'symbol': symbol,
+            'signal_time': int(open_time[t]),
+            'entry_time': int(open_time[entry_index]),
+            'exit_time': int(open_time[exit_index]),
+            'entry_price': entry_price,
+            'exit_price': exit_price,
+            'quantity': quantity,
+            'sl_price': sl_price,
+            'tp_price': tp_price,
+            'exit_reason': exit_reason,
+            'fees': fees,
+            'pnl': pnl,
+            'balance': balance,
+        })
+        # Como no bot: o símbolo volta a ser analisado no fechamento do candle em que a posição saiu
+        next_allowed = exit_index
+    return trades
+
+
+# --- Estatísticas ---
+def summarize(trades, initial_balance):
+    pnls = np.array([trade['pnl'] for trade in trades], dtype=np.float64)
+    equity = initial_balance + np.cumsum(pnls) if len(pnls) else np.array([initial_balance])
+    peaks = np.maximum.accumulate(np.concatenate([[initial_balance], equity]))
+    drawdowns = (peaks[1:] - equity) / peaks[1:] if len(pnls) else np.zeros(1)
+    gross_profit = float(pnls[pnls > 0].sum())
+    gross_loss = float(-pnls[pnls < 0].sum())
+    return {
+        'trades': len(pnls),
+        'win_rate': float((pnls > 0).mean() * 100) if len(pnls) else 0.0,
+        'net_pnl': float(pnls.sum()),
+        'return_pct': float(pnls.sum() / initial_balance * 100) if initial_balance else 0.0,
+        'profit_factor': gross_profit / gross_loss if gross_loss > 0 else (float('inf') if gross_profit > 0 else 0.0),
+        'avg_pnl': float(pnls.mean()) if len(pnls) else 0.0,
+        'max_drawdown_pct': float(drawdowns.max() * 100),
+        'fees': float(sum(trade['fees'] for trade in trades)),
+        'exits': {reason: sum(1 for trade in trades if trade['exit_reason'] == reason) for reason in ('TP', 'SL', 'END')},
+    }
+
+
+# --- Execução em vários processos ---
+def _init_worker(verbose):
+    # Os avisos de dimensionamento do bot seriam repetidos a cada trade simulado; com --verbose vão para o
+    # terminal (nunca para o log do bot, que o backend transmite como atividade ao vivo)
+    logging.basicConfig(format='%(processName)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.CRITICAL)
+    if not len(SYMBOL_INFO):
+        SYMBOL_INFO.load_snapshot()
+
+
+def backtest_symbol(symbol, params, base_dir=BACKTEST_KLINE_DIR):
+    interval = KLINE_INTERVAL_MAP[params['kline_interval_minutes']]
+    if symbol not in SYMBOL_INFO:
+        return symbol, [], None
+    klines = load_klines(symbol, interval, base_dir)
+    trades = simulate_symbol(symbol, klines, params)
+    return symbol, trades, summarize(trades, params['initial_balance'])
+
+
+def run_backtest(symbols, params, base_dir=BACKTEST_KLINE_DIR, workers=BACKTEST_WORKERS, verbose=False):
+    """Simula os símbolos em paralelo, um símbolo por tarefa. Retorna {símbolo: (trades, resumo)}."""
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(verbose,)) as executor:
+        futures = [executor.submit(backtest_symbol, symbol, params, base_dir) for symbol in symbols]
+        for future in futures:
+            symbol, trades, summary = future.result()
+            if summary is None:
+                logger.warning("[AVISO] %s sem filtros no snapshot do exchange info. Ignorado.", symbol,
+                               extra={'symbol': symbol, 'event': 'backtest_skipped'})
+                continue
+            results[symbol] = (trades, summary)
+    return results
+
+
+def write_trade_log(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fields = ['symbol', 'signal_time', 'entry_time', 'exit_time', 'entry_price', 'exit_price', 'quantity',
+              'sl_price', 'tp_price', 'exit_reason', 'fees', 'pnl', 'balance']
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for trades, _ in results.values():
+            writer.writerows(trades)
+
+
+def load_params(config_path=CONFIG_FILE_PATH):
+    params = dict(BACKTEST_DEFAULTS)
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        params.update({key: config[key] for key in BACKTEST_DEFAULTS if key in config})
+    return params
+
+
+def print_report(results, params, elapsed):
+    print(f"{'Símbolo':<14}{'Trades':>7}{'Acerto%':>9}{'PnL':>12}{'Retorno%':>10}{'PF':>7}{'MaxDD%':>8}")
+    for symbol, (_, summary) in sorted(results.items(), key=lambda item: -item[1][1]['net_pnl']):
+        print(f"{symbol:<14}{summary['trades']:>7}{summary['win_rate']:>9.1f}{summary['net_pnl']:>12.2f}"
+              f"{summary['return_pct']:>10.2f}{summary['profit_factor']:>7.2f}{summary['max_drawdown_pct']:>8.2f}")
+
+    # Carteira: soma das contas independentes, trades ordenados pela saída
+    all_trades = sorted((trade for trades, _ in results.values() for trade in trades), key=lambda trade: trade['exit_time'])
+    total = summarize(all_trades, params['initial_balance'] * max(len(results), 1))
+    print(f"\nTotal: {total['trades']} trades em {len(results)} símbolos | acerto {total['win_rate']:.1f}% | "
+          f"PnL {total['net_pnl']:.2f} USDT ({total['return_pct']:.2f}%) | PF {total['profit_factor']:.2f} | "
+          f"MaxDD {total['max_drawdown_pct']:.2f}% | taxas {total['fees']:.2f} | saídas {total['exits']}")
+    print(f"Tempo: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest da estratégia de pullback sobre klines armazenados.")
+    parser.add_argument("--symbols", nargs="+", help="Símbolos a simular (padrão: todos os armazenados)")
+    parser.add_argument("--all", action="store_true", help="Todos os perpétuos USDT do snapshot do exchange info")
+    parser.add_argument("--config", default=CONFIG_FILE_PATH, help="settings.json com os parâmetros da estratégia")
+    parser.add_argument("--data-dir", default=BACKTEST_KLINE_DIR)
+    parser.add_argument("--download", action="store_true", help="Baixa/completa o histórico antes de simular")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--initial-balance", type=float)
+    parser.add_argument("--fee", type=float, help="Taxa taker por lado (ex.: 0.0005)")
+    parser.add_argument("--slippage", type=float)
+    parser.add_argument("--intrabar", choices=["conservative", "nearest"])
+    parser.add_argument("--output", default=os.path.join(BACKTEST_RESULTS_DIR, "trades.csv"))
+    parser.add_argument("--verbose", action="store_true", help="Mantém os logs do bot durante a simulação")
+    args = parser.parse_args()
+
+    params = load_params(args.config)
+    for key, value in (('initial_balance', args.initial_balance), ('taker_fee', args.fee),
+                       ('slippage', args.slippage), ('intrabar', args.intrabar)):
+        if value is not None:
+            params[key] = value
+    interval = KLINE_INTERVAL_MAP[params['kline_interval_minutes']]
+
+    SYMBOL_INFO.load_snapshot()
+    if args.symbols:
+        symbols = args.symbols
+    elif args.all:
+        symbols = SYMBOL_INFO.usdt_perpetual_symbols()
+    else:
+        symbols = stored_symbols(interval, args.data_dir)
+
+    _init_worker(args.verbose)
+    logger.setLevel(logging.INFO) # O progresso do backtest aparece mesmo sem --verbose (que só controla os logs do bot)
+    if args.download:
+        logger.info("Baixando %s dias de candles %s para %s símbolos...", args.days, interval, len(symbols))
+        download_history(symbols, interval, args.days, args.data_dir)
+    if not symbols:
+        parser.error("nenhum símbolo: informe --symbols/--all ou baixe o histórico com --download")
+
+    start = time.perf_counter()
+    results = run_backtest(symbols, params, args.data_dir, args.workers, args.verbose)
+    elapsed = time.perf_counter() - start
+    write_trade_log(results, args.output)
+    print_report(results, params, elapsed)
+    print(f"Trades gravados em {args.output}")
@@ -0,0 +1,86 @@
+"""
+Tempo dos indicadores da varredura: cálculo escalar por símbolo contra o cálculo vetorizado em lote.
+
+A aceleração ponta a ponta inclui a conversão dos klines (klines_to_ohlc); o tempo só do cálculo
+aparece à parte. A equivalência dos resultados é conferida por check_indicators.py.
+Uso: python benchmark_indicators.py --symbols 300 --candles 52 500
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from indicators import batch_indicators, calculate_atr, calculate_ema, klines_to_ohlc
+
+
+def generate_klines(symbol_count, candle_count, seed=42):
+    """Klines sintéticos no formato servido pelo KlineStore (valores float), um random walk por símbolo."""
+    rng = random.Random(seed)
+    all_klines = []
+    for _ in range(symbol_count):
+        price = rng.uniform(0.01, 50000)
+        klines = []
+        for i in range(candle_count):
+            open_price = price
+            price *= 1 + rng.uniform(-0.01, 0.01)
+            high = max(open_price, price) * (1 + rng.uniform(0, 0.005))
+            low = min(open_price, price) * (1 - rng.uniform(0, 0.005))
+            klines.append([i * 60000, open_price, high, low, price, 100.0, i * 60000 + 59999])
+        all_klines.append(klines)
+    return all_klines
+
+
+def scalar_indicators(all_klines, trend_period, pullback_period, atr_period):
+    results = []
+    for klines in all_klines:
+        close_prices = [float(kline[4]) for kline in klines]
+        results.append((
+            calculate_ema(close_prices, trend_period),
+            calculate_ema(close_prices, pullback_period),
+            calculate_atr(klines, atr_period),
+        ))
+    return np.array(results, dtype=np.float64)
+
+
+def run_benchmark(symbol_count, candle_count, trend_period, pullback_period, atr_period, repeat):
+    all_klines = generate_klines(symbol_count, candle_count)
+
+    scalar_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scalar_indicators(all_klines, trend_period, pullback_period, atr_period)
+        scalar_times.append(time.perf_counter() - start)
+
+    batch_times = []
+    compute_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ohlc = klines_to_ohlc(all_klines)
+        compute_start = time.perf_counter()
+        batch_indicators(ohlc, trend_period, pullback_period, atr_period)
+        end = time.perf_counter()
+        batch_times.append(end - start)
+        compute_times.append(end - compute_start)
+
+    scalar_best = min(scalar_times)
+    batch_best = min(batch_times)
+    compute_best = min(compute_times)
+    print(f"{symbol_count} símbolos x {candle_count} candles (EMA {trend_period}/{pullback_period}, ATR {atr_period})")
+    print(f"  Escalar (calculate_ema/calculate_atr):           {scalar_best * 1000:.2f} ms")
+    print(f"  Vetorizado (klines_to_ohlc + batch_indicators): {batch_best * 1000:.2f} ms (só o cálculo: {compute_best * 1000:.2f} ms)")
+    print(f"  Aceleração ponta a ponta: {scalar_best / batch_best:.1f}x (só o cálculo: {scalar_best / compute_best:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara os indicadores escalares com o cálculo vetorizado em lote.")
+    parser.add_argument("--symbols", type=int, default=300)
+    parser.add_argument("--candles", type=int, nargs="+", default=[52, 500])
+    parser.add_argument("--trend-period", type=int, default=50)
+    parser.add_argument("--pullback-period", type=int, default=10)
+    parser.add_argument("--atr-period", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for candle_count in args.candles:
+        run_benchmark(args.symbols, candle_count, args.trend_period, args.pullback_period, args.atr_period, args.repeat)
@@ -0,0 +1,298 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from binance.client import Client
+from binance.exceptions import BinanceAPIException
+
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# --- Prioridades das requisições (menor valor = atendida primeiro) ---
+PRIORITY_ORDER = 0 # Criação, consulta e cancelamento de ordens
+PRIORITY_ACCOUNT = 1 # Posições, saldo, alavancagem e reconciliação
+PRIORITY_MARKET_DATA = 2 # Klines e preços usados na análise de sinal
+PRIORITY_SCAN = 3 # Varredura de mercado
+PRIORITY_DASHBOARD = 4 # Leituras do painel web
+
+# --- Limites de peso da Binance Futures ---
+WEIGHT_LIMIT_PER_MINUTE = 2400 # Limite de peso por IP por minuto (REQUEST_WEIGHT)
+WEIGHT_SAFETY_MARGIN = 0.9 # Fração do limite que o agendador se permite usar
+ORDER_RESERVED_WEIGHT = 100 # Peso sempre reservado para ordens; outras prioridades não podem consumi-lo
+DEFAULT_BAN_SECONDS = 60 # Espera usada em 429/418 quando a Binance não envia Retry-After
+USED_WEIGHT_HEADER = 'X-MBX-USED-WEIGHT-1M'
+
+# --- Métricas de latência das requisições ---
+REQUEST_DURATION = histogram('binance_request_duration_seconds', 'Duração das requisições REST à Binance, sem a espera na fila',
+                             ('endpoint', 'outcome'))
+SCHEDULER_WAIT = histogram('binance_scheduler_wait_seconds', 'Espera na fila do agendador de peso até a requisição ser liberada',
+                           ('priority',))
+
+
+def _klines_weight(params):
+    limit = int(params.get('limit', 500))
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def _depth_weight(params):
+    limit = int(params.get('limit', 500))
+    if limit <= 50:
+        return 2
+    if limit <= 100:
+        return 5
+    if limit <= 500:
+        return 10
+    return 20
+
+
+def _per_symbol_weight(single, all_symbols):
+    return lambda params: single if params.get('symbol') else all_symbols
+
+
+# Peso de cada endpoint, indexado por (método HTTP, caminho). Valores fixos ou funções dos parâmetros.
+ENDPOINT_WEIGHTS = {
+    ('get', 'ping'): 1,
+    ('get', 'time'): 1,
+    ('get', 'exchangeInfo'): 1,
+    ('get', 'klines'): _klines_weight,
+    ('get', 'depth'): _depth_weight,
+    ('get', 'ticker/price'): _per_symbol_weight(1, 2),
+    ('get', 'ticker/24hr'): _per_symbol_weight(1, 40),
+    ('get', 'ticker/bookTicker'): _per_symbol_weight(2, 5),
+    ('get', 'premiumIndex'): _per_symbol_weight(1, 10),
+    ('post', 'order'): 1,
+    ('get', 'order'): 1,
+    ('delete', 'order'): 1,
+    ('post', 'batchOrders'): 5,
+    ('delete', 'batchOrders'): 1,
+    ('delete', 'allOpenOrders'): 1,
+    ('get', 'openOrders'): _per_symbol_weight(1, 40),
+    ('get', 'allOrders'): 5,
+    ('get', 'positionRisk'): 5,
+    ('get', 'account'): 5,
+    ('get', 'balance'): 5,
+    ('post', 'leverage'): 1,
+    ('post', 'marginType'): 1,
+    ('get', 'leverageBracket'): 1,
+    ('post', 'listenKey'): 1,
+    ('put', 'listenKey'): 1,
+    ('delete', 'listenKey'): 1,
+}
+
+# Prioridade padrão de cada endpoint quando nenhuma é definida pelo chamador
+ENDPOINT_PRIORITIES = {
+    ('post', 'order'): PRIORITY_ORDER,
+    ('get', 'order'): PRIORITY_ORDER,
+    ('delete', 'order'): PRIORITY_ORDER,
+    ('post', 'batchOrders'): PRIORITY_ORDER,
+    ('delete', 'batchOrders'): PRIORITY_ORDER,
+    ('delete', 'allOpenOrders'): PRIORITY_ORDER,
+    ('get', 'openOrders'): PRIORITY_ACCOUNT,
+    ('get', 'allOrders'): PRIORITY_ACCOUNT,
+    ('get', 'positionRisk'): PRIORITY_ACCOUNT,
+    ('get', 'account'): PRIORITY_ACCOUNT,
+    ('get', 'balance'): PRIORITY_ACCOUNT,
+    ('post', 'leverage'): PRIORITY_ACCOUNT,
+    ('post', 'marginType'): PRIORITY_ACCOUNT,
+    ('post', 'listenKey'): PRIORITY_ACCOUNT,
+    ('put', 'listenKey'): PRIORITY_ACCOUNT,
+    ('delete', 'listenKey'): PRIORITY_ACCOUNT,
+}
+
+
+def get_endpoint_weight(method, path, params=None):
+    weight = ENDPOINT_WEIGHTS.get((method, path), 1)
+    if callable(weight):
+        weight = weight(params or {})
+    return weight
+
+
+def is_rate_limit_error(error):
+    """Indica se a exceção é um 429 (limite excedido) ou 418 (IP banido) da Binance."""
+    return isinstance(error, BinanceAPIException) and (error.status_code in (418, 429) or error.code == -1003)
+
+
+class BinanceRequestScheduler:
+    """
+    Token bucket central para as requisições REST da Binance Futures.
+
+    Cada requisição aguarda numa fila de prioridade até haver peso disponível no balde.
+    O balde é reabastecido continuamente (limite por minuto / 60 por segundo) e corrigido
+    com o cabeçalho X-MBX-USED-WEIGHT-1M devolvido pela Binance. Em 429/418 todas as
+    requisições ficam retidas até o fim do Retry-After.
+    """
+
+    def __init__(self, weight_limit_per_minute=WEIGHT_LIMIT_PER_MINUTE, safety_margin=WEIGHT_SAFETY_MARGIN,
+                 order_reserved_weight=ORDER_RESERVED_WEIGHT):
+        self.capacity = weight_limit_per_minute * safety_margin
+        self.refill_per_second = self.capacity / 60.0
+        self.order_reserved_weight = order_reserved_weight
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.used_weight_1m = 0 # Último valor informado pela Binance
+        self.blocked_until = 0.0 # Instante (monotonic) até o qual as requisições ficam retidas
+        self.total_requests = 0
+        self.total_weight = 0
+        self.rate_limit_hits = 0
+        self._condition = threading.Condition()
+        self._queue = [] # heap de (prioridade, sequência)
+        self._sequence = itertools.count()
+        self._local = threading.local()
+
+    # --- Prioridade definida pelo chamador ---
+    @contextmanager
+    def priority(self, priority):
+        """Define a prioridade das requisições feitas pela thread atual dentro do bloco."""
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _resolve_priority(self, method, path):
+        priority = getattr(self._local, 'priority', None)
+        if priority is not None:
+            return priority
+        return ENDPOINT_PRIORITIES.get((method, path), PRIORITY_MARKET_DATA)
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self.last_refill = now
+
+    def _required_tokens(self, weight, priority):
+        if priority == PRIORITY_ORDER:
+            return weight
+        return weight + self.order_reserved_weight
+
+    # --- Aquisição de peso ---
+    def acquire(self, weight, priority):
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self.blocked_until:
+                        wait_seconds = self.blocked_until - now
+                    elif self._queue[0] != entry:
+                        wait_seconds = None # Aguarda a vez das requisições mais prioritárias
+                    else:
+                        missing = self._required_tokens(weight, priority) - self.tokens
+                        if missing <= 0:
+                            self.tokens -= weight
+                            self.total_requests += 1
+                            self.total_weight += weight
+                            return
+                        wait_seconds = missing / self.refill_per_second
+                    self._condition.wait(wait_seconds)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+    # --- Retorno da Binance ---
+    def update_from_headers(self, headers):
+        used_weight = headers.get(USED_WEIGHT_HEADER) if headers is not None else None
+        if used_weight is None:
+            return
+        with self._condition:
+            self.used_weight_1m = int(used_weight)
+            # O peso informado pela Binance inclui requisições de outros processos no mesmo IP
+            self.tokens = min(self.tokens, self.capacity - self.used_weight_1m)
+            self._condition.notify_all()
+
+    def register_rate_limit(self, error):
+        retry_after = DEFAULT_BAN_SECONDS
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if headers and headers.get('Retry-After'):
+            try:
+                retry_after = int(headers.get('Retry-After'))
+            except ValueError:
+                pass
+        with self._condition:
+            self.rate_limit_hits += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.tokens = 0
+            self._condition.notify_all()
+        logger.warning("[RATE LIMIT] Binance retornou %s. Requisições retidas por %ss.", error.status_code, retry_after)
+
+    def execute(self, method, path, params, request_func):
+        weight = get_endpoint_weight(method, path, params)
+        priority = self._resolve_priority(method, path)
+        queued_at = time.perf_counter()
+        self.acquire(weight, priority)
+        started_at = time.perf_counter()
+        SCHEDULER_WAIT.observe(started_at - queued_at, str(priority))
+        outcome = 'network_error'
+        try:
+            response = request_func()
+            outcome = 'ok'
+            return response
+        except BinanceAPIException as e:
+            if is_rate_limit_error(e):
+                outcome = 'rate_limited'
+                self.register_rate_limit(e)
+            else:
+                outcome = 'api_error'
+            raise
+        finally:
+            REQUEST_DURATION.observe(time.perf_counter() - started_at, f"{method.upper()} {path}", outcome)
+
+    def get_retry_wait_seconds(self):
+        """Tempo restante até o fim de um bloqueio por 429/418 (0 se não houver bloqueio)."""
+        with self._condition:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+    def get_status(self):
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            queue_by_priority = {}
+            for priority, _ in self._queue:
+                queue_by_priority[priority] = queue_by_priority.get(priority, 0) + 1
+            return {
+                'available_weight': round(self.tokens, 2),
+                'capacity': self.capacity,
+                'used_weight_1m': self.used_weight_1m,
+                'queue_depth': len(self._queue),
+                'queue_by_priority': queue_by_priority,
+                'blocked_for_seconds': round(max(0.0, self.blocked_until - now), 2),
+                'total_requests': self.total_requests,
+                'total_weight': self.total_weight,
+                'rate_limit_hits': self.rate_limit_hits,
+            }
+
+
+class ScheduledClient(Client):
+    """Client da python-binance cujas requisições de Futuros passam pelo BinanceRequestScheduler."""
+
+    def __init__(self, api_key=None, api_secret=None, scheduler=None, **kwargs):
+        self.scheduler = scheduler or BinanceRequestScheduler()
+        super().__init__(api_key, api_secret, **kwargs)
+
+    def _request_futures_api(self, method, path, signed=False, version=1, **kwargs):
+        uri = self._create_futures_api_uri(path, version)
+
+        def send_request():
+            request_kwargs = self._get_request_kwargs(method, signed, True, **kwargs)
+            response = getattr(self.session, method)(uri, **request_kwargs)
+            self.response = response
+            self.scheduler.update_from_headers(response.headers)
+            return self._handle_response(response)
+
+        return self.scheduler.execute(method, path, kwargs.get('data') or {}, send_request)
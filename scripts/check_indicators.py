@@ -0,0 +1,64 @@
+"""
+Confere que os cálculos de EMA/ATR concordam com a referência escalar (calculate_ema/calculate_atr).
+
+Para várias combinações de símbolos, candles e períodos (incluindo janelas mais curtas que o
+período, em que a referência devolve None e o lote devolve NaN), compara o cálculo vetorizado
+em lote da varredura, os indicadores incrementais usados no sinal de entrada e as séries completas.
+Não importa `main`: nada é criado no diretório atual.
+Uso: python check_indicators.py
+"""
+import numpy as np
+
+from benchmark_indicators import generate_klines
+from indicators import (OHLC_CLOSE, IncrementalATR, IncrementalEMA, atr_series, batch_indicators, calculate_atr,
+                        calculate_ema, ema_series, klines_to_ohlc)
+
+RTOL = 1e-9 # Diferenças aceitas: só arredondamento de ponto flutuante
+
+CASES = [
+    # (símbolos, candles, EMA de tendência, EMA de pullback, ATR)
+    (50, 52, 50, 10, 14),
+    (20, 500, 50, 10, 14),
+    (5, 1000, 200, 21, 14),
+    (3, 14, 50, 10, 14), # Janela menor que o período da EMA de tendência
+    (3, 14, 5, 3, 14), # T == período do ATR: só T - 1 true ranges, ATR indefinido
+    (3, 15, 5, 3, 14), # Primeiro ATR definido
+]
+
+
+def reference(klines, trend_period, pullback_period, atr_period):
+    close_prices = [float(kline[4]) for kline in klines]
+    values = (calculate_ema(close_prices, trend_period), calculate_ema(close_prices, pullback_period), calculate_atr(klines, atr_period))
+    return [np.nan if value is None else value for value in values]
+
+
+def incremental(klines, trend_period, pullback_period, atr_period):
+    ema_trend, ema_pullback, atr = IncrementalEMA(trend_period), IncrementalEMA(pullback_period), IncrementalATR(atr_period)
+    for kline in klines:
+        ema_trend.update(kline[4])
+        ema_pullback.update(kline[4])
+        atr.update(kline[2], kline[3], kline[4])
+    return [np.nan if value is None else value for value in (ema_trend.value, ema_pullback.value, atr.value)]
+
+
+def check_case(symbol_count, candle_count, trend_period, pullback_period, atr_period):
+    all_klines = generate_klines(symbol_count, candle_count, seed=symbol_count * candle_count)
+    expected = np.array([reference(klines, trend_period, pullback_period, atr_period) for klines in all_klines])
+
+    ohlc = klines_to_ohlc(all_klines)
+    batch = batch_indicators(ohlc, trend_period, pullback_period, atr_period)
+    np.testing.assert_allclose(np.column_stack([batch['ema_trend'], batch['ema_pullback'], batch['atr']]), expected, rtol=RTOL, atol=0)
+
+    np.testing.assert_allclose([incremental(klines, trend_period, pullback_period, atr_period) for klines in all_klines],
+                               expected, rtol=RTOL, atol=0)
+
+    last_values = [[ema_series(ohlc[i, :, OHLC_CLOSE], trend_period)[-1], ema_series(ohlc[i, :, OHLC_CLOSE], pullback_period)[-1],
+                    atr_series(ohlc[i], atr_period)[-1]] for i in range(symbol_count)]
+    np.testing.assert_allclose(last_values, expected, rtol=RTOL, atol=0)
+
+
+if __name__ == "__main__":
+    for case in CASES:
+        check_case(*case)
+        print(f"{case[0]} símbolos x {case[1]} candles (EMA {case[2]}/{case[3]}, ATR {case[4]}): lote, incremental e séries = escalar")
+    print(f"Todos os casos iguais à referência escalar (rtol={RTOL}): OK")
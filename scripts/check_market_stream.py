@@ -0,0 +1,268 @@
+"""
+Verificação do MarketStream contra um servidor websocket local, sem rede.
+
+O servidor falso responde em /stream como os streams combinados da Binance Futures e segue
+um roteiro: na primeira conexão envia candles em sequência, um preço de marcação e um candle
+depois de uma lacuna, e então derruba a conexão; na segunda conexão envia o fechamento do
+último candle. O script confere a URL dos streams, a tabela de preços, a série gravada no
+KlineStore (sem buracos), o preenchimento via REST na conexão, na lacuna e na reconexão, e o
+`covers()` antes e depois de parar o stream.
+O roteiro roda duas vezes: com um preenchimento próprio do script e com o preenchimento de
+`main.start_market_stream`, que precisa consultar a exchange mesmo com o stream conectado; nessa
+segunda rodada o script confere também quando `main.get_klines_cached` dispensa o REST.
+`main` é importado dentro de um diretório temporário, onde ficam os logs e dados que ele cria.
+Uso: python check_market_stream.py
+"""
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import websockets
+
+from kline_store import INTERVAL_MS, KlineStore
+from market_stream import STREAM_RECONNECT_MIN_SECONDS, MarketDataTable, MarketStream
+
+SYMBOL = 'BTCUSDT'
+INTERVAL = '1m'
+INTERVAL_MILLIS = INTERVAL_MS[INTERVAL]
+BASE_OPEN_TIME = 1_700_000_040_000 # Múltiplo de 1 minuto
+STEP_TIMEOUT_SECONDS = 5 # Espera máxima por cada etapa do roteiro
+
+
+def candle(index, close, closed=True):
+    """Candle no formato REST [open_time, open, high, low, close, volume, close_time]."""
+    open_time = BASE_OPEN_TIME + index * INTERVAL_MILLIS
+    return [open_time, close - 1, close + 1, close - 2, close, 10.0 if closed else 1.0, open_time + INTERVAL_MILLIS - 1]
+
+
+def kline_frame(kline, closed):
+    return json.dumps({'stream': f"{SYMBOL.lower()}@kline_{INTERVAL}", 'data': {
+        'e': 'kline', 's': SYMBOL, 'k': {
+            't': kline[0], 'T': kline[6], 'i': INTERVAL, 'o': str(kline[1]), 'h': str(kline[2]),
+            'l': str(kline[3]), 'c': str(kline[4]), 'v': str(kline[5]), 'x': closed,
+        }}})
+
+
+def mark_price_frame(price):
+    return json.dumps({'stream': f"{SYMBOL.lower()}@markPrice@1s", 'data': {'e': 'markPriceUpdate', 's': SYMBOL, 'p': str(price)}})
+
+
+class FakeExchange:
+    """Histórico REST de klines e relógio da exchange, com um contador dos preenchimentos feitos pelo stream."""
+
+    def __init__(self, kline_store):
+        self.kline_store = kline_store
+        self.rest_klines = [candle(index, 100.0 + index) for index in range(5)]
+        self.now_ms = BASE_OPEN_TIME + 5 * INTERVAL_MILLIS + 1000 # Candle 5 em formação
+        self.backfill_calls = []
+        self._backfill_done = threading.Condition()
+
+    def fetch_klines(self, symbol, interval, limit, start_time):
+        klines = [kline for kline in self.rest_klines if start_time is None or kline[0] >= start_time]
+        return klines[-limit:] if start_time is None else klines[:limit]
+
+    def backfill(self, symbol):
+        self.kline_store.update(symbol, INTERVAL, 5, self.fetch_klines, now_ms=self.now_ms)
+        self.record_backfill(symbol)
+
+    def record_backfill(self, symbol):
+        with self._backfill_done:
+            self.backfill_calls.append(symbol)
+            self._backfill_done.notify_all()
+
+    def wait_backfills(self, count):
+        with self._backfill_done:
+            if not self._backfill_done.wait_for(lambda: len(self.backfill_calls) >= count, STEP_TIMEOUT_SECONDS):
+                raise AssertionError(f"esperava {count} preenchimentos, houve {len(self.backfill_calls)}")
+
+
+def make_handler(exchange, paths, finished):
+    """Handler do servidor falso; `paths` recebe o caminho pedido em cada conexão."""
+
+    async def handler(websocket):
+        request = getattr(websocket, 'request', None)
+        paths.append(request.path if request is not None else websocket.path) # websockets < 14: servidor legado
+        connection = len(paths)
+        await asyncio.to_thread(exchange.wait_backfills, connection if connection == 1 else 3)
+        if connection == 1:
+            await websocket.send(kline_frame(candle(5, 105.0, closed=False), False))
+            await websocket.send(mark_price_frame(105.5))
+            await websocket.send(kline_frame(candle(5, 105.0), True))
+            await websocket.send(kline_frame(candle(6, 106.0, closed=False), False))
+            # Lacuna: o candle 7 não chega pelo stream e precisa vir do REST
+            exchange.rest_klines += [candle(6, 106.0), candle(7, 107.0)]
+            exchange.now_ms = BASE_OPEN_TIME + 8 * INTERVAL_MILLIS + 1000
+            await websocket.send(kline_frame(candle(8, 108.0, closed=False), False))
+            await asyncio.to_thread(exchange.wait_backfills, 2)
+            await websocket.close() # Derruba a conexão para forçar a reconexão
+            return
+        await websocket.send(kline_frame(candle(8, 108.0), True))
+        await websocket.send(mark_price_frame(108.5))
+        await asyncio.to_thread(finished.wait, STEP_TIMEOUT_SECONDS * 2)
+
+    return handler
+
+
+def wait_until(condition, description):
+    deadline = time.time() + STEP_TIMEOUT_SECONDS + STREAM_RECONNECT_MIN_SECONDS
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError(f"tempo esgotado esperando: {description}")
+        time.sleep(0.02)
+
+
+class FakeClient:
+    """futures_klines servido pelo histórico da FakeExchange, com contagem das chamadas."""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.kline_calls = 0
+
+    def futures_klines(self, symbol, interval, limit, startTime=None):
+        self.kline_calls += 1
+        return self.exchange.fetch_klines(symbol, interval, limit, startTime)
+
+
+class IdleOrderBookStream:
+    """Substitui o stream de profundidade de `main`, que não faz parte deste roteiro."""
+
+    def __init__(self, symbols, fetch_snapshot):
+        self.symbols = list(symbols)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def update_symbols(self, symbols):
+        self.symbols = list(symbols)
+
+    def get_book(self, symbol):
+        return None
+
+
+def run_scenario(start_stream, exchange, kline_store, table, while_connected=None):
+    """Sobe o servidor falso, roda o roteiro com o stream criado por `start_stream(base_url)` e confere o resultado."""
+    paths = []
+    finished = threading.Event()
+    ready = threading.Event()
+    port_holder = {}
+
+    async def run_server():
+        async with websockets.serve(make_handler(exchange, paths, finished), '127.0.0.1', 0) as server:
+            port_holder['port'] = server.sockets[0].getsockname()[1]
+            ready.set()
+            await asyncio.to_thread(finished.wait)
+
+    server_thread = threading.Thread(target=asyncio.run, args=(run_server(),), daemon=True)
+    server_thread.start()
+    ready.wait(STEP_TIMEOUT_SECONDS)
+
+    stream = start_stream(f"ws://127.0.0.1:{port_holder['port']}")
+    try:
+        wait_until(lambda: table.get_mark_price(SYMBOL) == 108.5, "preço de marcação da segunda conexão")
+        assert stream.covers(SYMBOL, INTERVAL), "stream conectado deveria cobrir o símbolo/intervalo"
+        assert not stream.covers(SYMBOL, '5m') and not stream.covers('ETHUSDT')
+        expected_path = f"/stream?streams={SYMBOL.lower()}@kline_{INTERVAL}/{SYMBOL.lower()}@markPrice@1s"
+        assert paths == [expected_path, expected_path], paths
+        # Preenchimentos: na primeira conexão, na lacuna do candle 7 e na reconexão
+        assert exchange.backfill_calls == [SYMBOL] * 3, exchange.backfill_calls
+        assert stream.reconnect_count == 1, stream.reconnect_count
+        assert not stream.needs_backfill(SYMBOL), "preenchimentos concluídos não deveriam ficar pendentes"
+
+        stored = kline_store.get_klines(SYMBOL, INTERVAL)
+        open_times = [int(kline[0]) for kline in stored]
+        assert open_times == [BASE_OPEN_TIME + index * INTERVAL_MILLIS for index in range(9)], open_times
+        assert [kline[4] for kline in stored] == [100.0 + index for index in range(9)]
+        assert table.get_latest_kline(SYMBOL)[0] == candle(8, 108.0)[0]
+        if while_connected is not None:
+            while_connected(stream)
+    finally:
+        finished.set()
+        stream.stop()
+        server_thread.join(timeout=STEP_TIMEOUT_SECONDS)
+    assert not stream.covers(SYMBOL, INTERVAL), "stream parado não deveria cobrir o símbolo"
+    return stream
+
+
+def check_standalone():
+    with tempfile.TemporaryDirectory() as base_dir:
+        kline_store = KlineStore(base_dir=base_dir)
+        exchange = FakeExchange(kline_store)
+        table = MarketDataTable()
+
+        def start_stream(base_url):
+            stream = MarketStream([SYMBOL], table, kline_interval=INTERVAL, kline_store=kline_store,
+                                  backfill=exchange.backfill, base_url=base_url)
+            stream.start()
+            return stream
+
+        return run_scenario(start_stream, exchange, kline_store, table)
+
+
+def check_main_backfill(main):
+    """Mesmo roteiro com o preenchimento de `main.start_market_stream` e o `main.get_klines_cached` real."""
+    kline_store = KlineStore(base_dir=os.path.join('data', 'klines'))
+    exchange = FakeExchange(kline_store)
+    table = MarketDataTable()
+    client = FakeClient(exchange)
+    main.client = client
+    main.KLINE_STORE = kline_store
+    main.MARKET_DATA = table
+    main.get_server_time_ms = lambda: exchange.now_ms
+    main.OrderBookStream = IdleOrderBookStream
+
+    def start_stream(base_url):
+        class RecordingMarketStream(MarketStream):
+            def __init__(self, *args, backfill, **kwargs):
+                def recorded_backfill(symbol):
+                    backfill(symbol)
+                    exchange.record_backfill(symbol)
+                super().__init__(*args, backfill=recorded_backfill, base_url=base_url, **kwargs)
+
+        main.MarketStream = RecordingMarketStream
+        return main.start_market_stream([SYMBOL], INTERVAL, 5)
+
+    def while_connected(stream):
+        # Stream saudável e sem lacuna: a janela vem do cache, sem REST
+        calls = client.kline_calls
+        klines = main.get_klines_cached(SYMBOL, INTERVAL, 5)
+        assert client.kline_calls == calls, "cache coberto pelo stream não deveria consultar o REST"
+        assert int(klines[-1][0]) == candle(8, 108.0)[0], klines
+        # Com um preenchimento pendente o cache não é confiável: a janela é sincronizada via REST
+        with stream._backfill_lock:
+            stream._backfill_pending[SYMBOL] = 0
+        main.get_klines_cached(SYMBOL, INTERVAL, 5)
+        assert client.kline_calls == calls + 1, "preenchimento pendente deveria forçar a consulta ao REST"
+        with stream._backfill_lock:
+            del stream._backfill_pending[SYMBOL]
+
+    try:
+        return run_scenario(start_stream, exchange, kline_store, table, while_connected)
+    finally:
+        main.MARKET_STREAM = None
+        main.DEPTH_STREAM = None
+
+
+def run_check():
+    stream = check_standalone()
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            import main
+            main_stream = check_main_backfill(main)
+        finally:
+            os.chdir(original_cwd)
+
+    print(f"MarketStream: URL, sequência de 9 candles sem lacunas, 3 preenchimentos via REST "
+          f"e {stream.reconnect_count} reconexão: OK; preenchimento de main.start_market_stream "
+          f"({main_stream.reconnect_count} reconexão) e atalho de get_klines_cached: OK")
+
+
+if __name__ == "__main__":
+    run_check()
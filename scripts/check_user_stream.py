@@ -0,0 +1,212 @@
+"""
+Verificação do UserDataStream/OrderTracker contra um servidor websocket local, sem rede.
+
+O servidor falso atende /ws/<listenKey> e envia os eventos que o script pede; o cliente falso
+entrega um listenKey novo a cada conexão e responde futures_create_order/futures_get_order.
+O script confere:
+- ORDER_TRADE_UPDATE recebido antes da espera, eventos atrasados ignorados, ouvintes e ACCOUNT_UPDATE;
+- `wait_for_order` devolvendo None quando a conexão cai durante a espera (`connection_count`),
+  e a reconexão com um listenKey novo (inclusive após listenKeyExpired);
+- `main.enviar_ordem` confirmando a MARKET pelo stream sem consultar o REST e, com o stream
+  caindo antes do preenchimento, voltando para a consulta via futures_get_order.
+`main` é importado dentro de um diretório temporário, onde ficam os logs e dados que ele cria.
+Uso: python check_user_stream.py
+"""
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import websockets
+
+from market_stream import STREAM_RECONNECT_MIN_SECONDS
+from user_stream import ORDER_WAIT_HEALTH_CHECK_SECONDS, OrderTracker, UserDataStream
+
+SYMBOL = 'BTCUSDT'
+STEP_TIMEOUT_SECONDS = 5 # Espera máxima por cada etapa do roteiro
+
+
+def order_event(order_id, status, update_time, executed_qty='0', avg_price='0', quantity='0.01'):
+    return {'e': 'ORDER_TRADE_UPDATE', 'E': update_time, 'T': update_time, 'o': {
+        's': SYMBOL, 'c': f"check-{order_id}", 'S': 'BUY', 'o': 'MARKET', 'q': quantity, 'p': '0',
+        'ap': avg_price, 'sp': '0', 'X': status, 'i': order_id, 'z': executed_qty, 'R': False, 'T': update_time,
+    }}
+
+
+class FakeUserStreamServer:
+    """Servidor websocket local numa thread própria; guarda os caminhos pedidos e a conexão atual."""
+
+    def __init__(self):
+        self.paths = []
+        self.port = None
+        self._websocket = None
+        self._loop = None
+        self._ready = threading.Event()
+        self._stopped = None
+        self._thread = threading.Thread(target=self._run, name='fake-user-stream', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait(STEP_TIMEOUT_SECONDS)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stopped.set_result, None)
+        self._thread.join(timeout=STEP_TIMEOUT_SECONDS)
+
+    def _run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = self._loop.create_future()
+        async with websockets.serve(self._handler, '127.0.0.1', 0) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await self._stopped
+
+    async def _handler(self, websocket):
+        request = getattr(websocket, 'request', None)
+        self.paths.append(request.path if request is not None else websocket.path) # websockets < 14: servidor legado
+        self._websocket = websocket
+        await websocket.wait_closed()
+
+    def send(self, event):
+        asyncio.run_coroutine_threadsafe(self._websocket.send(json.dumps(event)), self._loop).result(STEP_TIMEOUT_SECONDS)
+
+    def drop(self):
+        """Fecha a conexão atual do lado do servidor, como uma queda da Binance."""
+        asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop).result(STEP_TIMEOUT_SECONDS)
+
+
+class FakeClient:
+    """listenKey novo a cada conexão e ordens MARKET cujo preenchimento o script decide como chega."""
+
+    def __init__(self, server):
+        self.server = server
+        self.listen_keys = []
+        self.closed_keys = []
+        self.rest_orders = {}
+        self.get_order_calls = 0
+        self.on_create_order = None
+        self._next_order_id = 100
+
+    def futures_stream_get_listen_key(self):
+        self.listen_keys.append(f"key{len(self.listen_keys) + 1}")
+        return self.listen_keys[-1]
+
+    def futures_stream_keepalive(self, listen_key):
+        pass
+
+    def futures_stream_close(self, listen_key):
+        self.closed_keys.append(listen_key)
+
+    def futures_create_order(self, **params):
+        self._next_order_id += 1
+        order_id = self._next_order_id
+        self.rest_orders[order_id] = {'orderId': order_id, 'symbol': params['symbol'], 'status': 'FILLED',
+                                      'executedQty': str(params['quantity']), 'avgPrice': '50000.0'}
+        if self.on_create_order is not None:
+            self.on_create_order(order_id, params)
+        return {'orderId': order_id, 'status': 'NEW', 'executedQty': '0', 'avgPrice': '0'}
+
+    def futures_get_order(self, symbol, orderId):
+        self.get_order_calls += 1
+        return dict(self.rest_orders[orderId])
+
+
+def wait_until(condition, description):
+    deadline = time.time() + STEP_TIMEOUT_SECONDS + STREAM_RECONNECT_MIN_SECONDS
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError(f"tempo esgotado esperando: {description}")
+        time.sleep(0.02)
+
+
+def check_tracker_and_reconnect(server, client, stream, listened, account_updates):
+    # Preenchimento que chega antes de alguém aguardar a ordem
+    server.send(order_event(1, 'FILLED', 100, executed_qty='0.01', avg_price='50000'))
+    wait_until(lambda: stream.tracker.get_order(1) is not None, "ordem 1 no tracker")
+    order = stream.wait_for_order(1, timeout_seconds=1)
+    assert order['status'] == 'FILLED' and order['avgPrice'] == '50000', order
+
+    # Evento atrasado não sobrescreve um estado mais novo
+    server.send(order_event(2, 'FILLED', 200, executed_qty='0.01'))
+    server.send(order_event(2, 'NEW', 150))
+    server.send({'e': 'ACCOUNT_UPDATE', 'E': 210, 'a': {'B': [], 'P': []}})
+    wait_until(lambda: account_updates, "ACCOUNT_UPDATE")
+    assert stream.tracker.get_order(2)['status'] == 'FILLED'
+    assert [(o['orderId'], o['status']) for o in listened] == [(1, 'FILLED'), (2, 'FILLED')], listened
+
+    # Queda durante a espera: wait_for_order devolve None em vez de esperar o tempo todo
+    server.send(order_event(3, 'NEW', 300))
+    connection = stream.connection_count
+    threading.Timer(0.2, server.drop).start()
+    started = time.time()
+    assert stream.wait_for_order(3, timeout_seconds=30) is None
+    waited = time.time() - started
+    assert waited < 0.2 + ORDER_WAIT_HEALTH_CHECK_SECONDS + 1, waited
+    wait_until(lambda: stream.connection_count == connection + 1 and stream.is_healthy(), "reconexão após a queda")
+
+    # listenKey expirado: reconecta com um listenKey novo
+    server.send({'e': 'listenKeyExpired', 'E': 400})
+    wait_until(lambda: stream.connection_count == connection + 2 and stream.is_healthy(), "reconexão após listenKeyExpired")
+    assert server.paths == ['/ws/key1', '/ws/key2', '/ws/key3'], server.paths
+    return waited
+
+
+def check_enviar_ordem(main, server, client, stream):
+    main.client = client
+    main.USER_STREAM = stream
+    main.ORDER_MONITOR_INTERVAL_SECONDS = 0.05
+
+    # Preenchimento pelo stream: nenhuma consulta REST
+    client.on_create_order = lambda order_id, params: server.send(
+        order_event(order_id, 'FILLED', int(time.time() * 1000), executed_qty=str(params['quantity']), avg_price='50001'))
+    order = main.enviar_ordem(SYMBOL, 0.01, None, 'BUY', 'MARKET', test_mode=False)
+    assert order['status'] == 'FILLED' and order['avgPrice'] == '50001', order
+    assert client.get_order_calls == 0, client.get_order_calls
+
+    # Stream cai antes do preenchimento: a confirmação vem da consulta via REST
+    client.on_create_order = lambda order_id, params: threading.Timer(0.2, server.drop).start()
+    order = main.enviar_ordem(SYMBOL, 0.01, None, 'BUY', 'MARKET', test_mode=False)
+    assert order['status'] == 'FILLED' and order['avgPrice'] == '50000.0', order
+    assert client.get_order_calls == 1, client.get_order_calls
+    sources = {tuple(series[0]) for series in main.ORDER_FILL_LATENCY.snapshot()['series']}
+    assert sources == {('user_stream',), ('rest',)}, sources
+
+
+def run_check():
+    server = FakeUserStreamServer()
+    server.start()
+    client = FakeClient(server)
+    listened = []
+    account_updates = []
+    tracker = OrderTracker()
+    tracker.add_listener(listened.append)
+    stream = UserDataStream(client, tracker, on_account_update=account_updates.append,
+                            base_url=f"ws://127.0.0.1:{server.port}")
+    stream.start()
+    original_cwd = os.getcwd()
+    try:
+        wait_until(stream.is_healthy, "primeira conexão")
+        waited = check_tracker_and_reconnect(server, client, stream, listened, account_updates)
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            try:
+                import main
+                check_enviar_ordem(main, server, client, stream)
+            finally:
+                os.chdir(original_cwd)
+    finally:
+        stream.stop()
+        server.stop()
+    assert client.closed_keys and client.closed_keys[-1] == client.listen_keys[-1], client.closed_keys
+
+    print(f"UserDataStream: eventos antecipados/atrasados, ouvintes e ACCOUNT_UPDATE OK; queda detectada em {waited:.2f}s; "
+          f"{len(client.listen_keys)} listenKeys; enviar_ordem via stream e via REST: OK")
+
+
+if __name__ == "__main__":
+    run_check()
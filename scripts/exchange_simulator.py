@@ -0,0 +1,743 @@
+"""
+Simulador local da Binance Futures para rodar o bot inteiro sem rede, em tempo acelerado.
+
+ExchangeSimulator implementa, em memória, o subconjunto da API do `Client` da python-binance
+usado pelo projeto (klines, tickers, livro de ofertas, ordens, posições, saldo, alavancagem, margem, exchange info) e reproduz
+os klines gravados pelo backtest (data/backtest_klines). O relógio é simulado: cada
+`time.sleep` do bot avança o tempo da simulação, e as ordens STOP_MARKET/TAKE_PROFIT_MARKET
+são executadas quando um candle fechado toca o preço de gatilho. O candle em formação é
+exposto apenas com o preço de abertura, para que o bot nunca veja preços futuros.
+
+Sem user data stream nem websockets: o bot usa a consulta via REST (futures_get_order) e
+os klines via futures_klines, exatamente como faz quando os streams estão indisponíveis.
+
+Uso (a partir de scripts/):
+  python exchange_simulator.py --symbols BTCUSDT ETHUSDT --candles 500
+  python exchange_simulator.py --warmup 300 --slippage 0.0005 --verbose
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from binance.client import Client
+from binance.exceptions import BinanceAPIException
+
+import main
+from backtest import BACKTEST_DEFAULTS, BACKTEST_KLINE_DIR, load_klines, load_params, stored_symbols, summarize
+from indicators import IndicatorEngine
+from kline_store import INTERVAL_MS, KLINE_FETCH_LIMIT, KlineStore
+from log_pipeline import BOT_LOG_FILE, LOG_DIR, setup_logging
+from order_book import DEPTH_SNAPSHOT_LIMIT, OrderBook
+from state_store import StateStore
+from watchlist import Watchlist
+from symbol_registry import SYMBOL_REGISTRY_SNAPSHOT_PATH, SymbolRegistry
+
+SIMULATOR_STATE_DIR = os.path.join('data', 'simulator') # Cache de klines, indicadores e configuração da simulação
+SIMULATOR_DEFAULT_LEVERAGE = 20 # Alavancagem inicial de cada símbolo, como numa conta nova
+SIMULATOR_WARMUP_CANDLES = 300 # Candles de histórico antes do início da simulação
+TRIGGER_ORDER_TYPES = ('STOP_MARKET', 'TAKE_PROFIT_MARKET')
+BOOK_LEVEL_SPACING = 0.0002 # Distância relativa entre níveis do livro sintético
+BOOK_LEVEL_VOLUME_FRACTION = 1.0 # Quantidade de cada nível como fração do volume do último candle fechado
+
+
+class SimulationFinished(KeyboardInterrupt):
+    """Fim dos dados: o bot executa a mesma limpeza de um Ctrl+C e encerra."""
+
+
+def api_error(code, msg):
+    """BinanceAPIException com o mesmo código e mensagem que a Binance retornaria."""
+    return BinanceAPIException(None, 400, json.dumps({'code': code, 'msg': msg}))
+
+
+class SimulatedClock:
+    """
+    Substitui o módulo `time` do bot: `sleep` avança o tempo simulado em vez de esperar.
+
+    Ao atingir `end_ms`, a thread principal recebe SimulationFinished uma única vez (as
+    chamadas seguintes a `sleep` retornam imediatamente para não interromper a limpeza).
+    Com `speed` definido, cada sleep também espera `segundos / speed` de tempo real.
+    """
+
+    def __init__(self, start_ms, end_ms, speed=None):
+        self.end_ms = end_ms
+        self.speed = speed
+        self.finished = False
+        self._now_ms = start_ms
+        self._lock = threading.Lock()
+
+    def now_ms(self):
+        with self._lock:
+            return self._now_ms
+
+    def time(self):
+        return self.now_ms() / 1000
+
+    def sleep(self, seconds):
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        with self._lock:
+            if self.finished:
+                return
+            self._now_ms = min(self._now_ms + int(seconds * 1000), self.end_ms)
+            reached_end = self._now_ms >= self.end_ms
+            if reached_end and threading.current_thread() is threading.main_thread():
+                self.finished = True
+        if reached_end and self.finished:
+            raise SimulationFinished()
+
+
+def default_exchange_symbol(symbol, reference_price):
+    """Item de exchange info com filtros plausíveis para símbolos ausentes do snapshot."""
+    magnitude = int(np.floor(np.log10(reference_price))) if reference_price > 0 else 0
+    tick_size = f"{10.0 ** (magnitude - 4):.{max(0, 4 - magnitude)}f}"
+    step_decimals = max(0, 3 - magnitude)
+    step_size = f"{10.0 ** -step_decimals:.{step_decimals}f}" if step_decimals else '1'
+    return {
+        'symbol': symbol, 'contractType': 'PERPETUAL', 'status': 'TRADING', 'quoteAsset': 'USDT',
+        'filters': [
+            {'filterType': 'PRICE_FILTER', 'tickSize': tick_size, 'minPrice': tick_size, 'maxPrice': '1000000'},
+            {'filterType': 'LOT_SIZE', 'stepSize': step_size, 'minQty': step_size, 'maxQty': '1000000'},
+            {'filterType': 'MARKET_LOT_SIZE', 'stepSize': step_size, 'minQty': step_size, 'maxQty': '1000000'},
+            {'filterType': 'MIN_NOTIONAL', 'notional': '5'},
+        ],
+    }
+
+
+class ExchangeSimulator(Client):
+    """
+    Conta de futuros USDT-M (modo one-way, margem cruzada) sobre klines gravados.
+
+    Herda de `Client` para passar pelas verificações `isinstance(client, Client)` do bot, mas
+    não abre sessão HTTP: endpoints não simulados levantam NotImplementedError. Ordens a
+    mercado executam no preço atual (abertura do candle em formação) com slippage e taxa
+    taker; ordens de gatilho são avaliadas candle a candle, com as aberturas além do gatilho
+    executando na abertura e o stop antes do take profit quando ambos são tocados no mesmo
+    candle (como o modo 'conservative' do backtest). Thread-safe: todas as chamadas
+    compartilham um único lock.
+    """
+
+    def __init__(self, clock, interval, symbols=None, base_dir=BACKTEST_KLINE_DIR,
+                 exchange_info_path=SYMBOL_REGISTRY_SNAPSHOT_PATH, initial_balance=BACKTEST_DEFAULTS['initial_balance'],
+                 taker_fee=BACKTEST_DEFAULTS['taker_fee'], slippage=BACKTEST_DEFAULTS['slippage']):
+        self.clock = clock
+        self.interval = interval
+        self.taker_fee = taker_fee
+        self.slippage = slippage
+        self.initial_balance = initial_balance
+        self.wallet_balance = initial_balance
+        self.session = None
+        self.timestamp_offset = 0
+        self.call_counts = Counter() # Endpoint -> quantidade de chamadas
+        self.fills = []
+        self.trades = [] # Posições encerradas, no formato de backtest.summarize
+        self._lock = threading.RLock()
+        self._orders = {} # orderId -> ordem no formato de futures_get_order
+        self._open_trigger_orders = {} # símbolo -> [orderId] de ordens de gatilho abertas
+        self._next_order_id = 1
+        self._next_candle = {} # símbolo -> índice do próximo candle a avaliar para as ordens de gatilho
+        self._positions = {} # símbolo -> {'amount', 'entry_price', 'fees', 'entry_time'}
+        self._leverage = {}
+        self._margin_types = {}
+
+        symbols = symbols if symbols is not None else stored_symbols(interval, base_dir)
+        self._klines = {}
+        for symbol in symbols:
+            klines = load_klines(symbol, interval, base_dir)
+            if len(klines):
+                self._klines[symbol] = klines
+        self._open_times = {symbol: np.asarray(klines['open_time']) for symbol, klines in self._klines.items()}
+        self._exchange_symbols = self._load_exchange_symbols(exchange_info_path)
+        self._min_notional = {s['symbol']: float(f['notional']) for s in self._exchange_symbols
+                              for f in s['filters'] if f['filterType'] == 'MIN_NOTIONAL'}
+
+    def _load_exchange_symbols(self, exchange_info_path):
+        snapshot = {}
+        if exchange_info_path and os.path.exists(exchange_info_path):
+            with open(exchange_info_path, 'r') as f:
+                snapshot = {s['symbol']: s for s in json.load(f)['symbols']}
+        return [snapshot.get(symbol) or default_exchange_symbol(symbol, float(klines['open'][0]))
+                for symbol, klines in self._klines.items()]
+
+    def _request_futures_api(self, method, path, signed=False, version=1, **kwargs):
+        raise NotImplementedError(f"Endpoint de futuros '{path}' não implementado no simulador.")
+
+    # --- Mercado ---
+    def _candle_index(self, symbol, now_ms):
+        """Índice do candle que contém `now_ms` (o último candle visível)."""
+        return int(np.searchsorted(self._open_times[symbol], now_ms, side='right')) - 1
+
+    def _require_symbol(self, symbol):
+        if symbol not in self._klines:
+            raise api_error(-1121, 'Invalid symbol.')
+        if self._candle_index(symbol, self.clock.now_ms()) < 0:
+            raise api_error(-1121, 'Invalid symbol.') # Ainda não listado no instante simulado
+
+    def _price(self, symbol, now_ms):
+        """Preço atual: abertura do candle em formação (ou o fechamento do último, após o fim dos dados)."""
+        klines = self._klines[symbol]
+        index = self._candle_index(symbol, now_ms)
+        if int(klines['close_time'][index]) < now_ms:
+            return float(klines['close'][index])
+        return float(klines['open'][index])
+
+    def _kline_row(self, klines, index, now_ms):
+        row = klines[index]
+        open_price = float(row['open'])
+        if int(row['close_time']) >= now_ms:
+            # Candle em formação: só a abertura é conhecida no instante simulado
+            values = (open_price, open_price, open_price, open_price, 0.0)
+        else:
+            values = (open_price, float(row['high']), float(row['low']), float(row['close']), float(row['volume']))
+        return [int(row['open_time']), *(str(value) for value in values), int(row['close_time']), '0', 0, '0', '0', '0']
+
+    def futures_klines(self, **params):
+        with self._lock:
+            self.call_counts['futures_klines'] += 1
+            symbol = params['symbol']
+            self._require_symbol(symbol)
+            if params['interval'] != self.interval:
+                raise api_error(-1120, 'Invalid interval.')
+            limit = min(int(params.get('limit', 500)), KLINE_FETCH_LIMIT)
+            now_ms = self.clock.now_ms()
+            end = self._candle_index(symbol, now_ms) + 1
+            if params.get('endTime') is not None:
+                end = min(end, int(np.searchsorted(self._open_times[symbol], int(params['endTime']), side='right')))
+            if params.get('startTime') is not None:
+                start = int(np.searchsorted(self._open_times[symbol], int(params['startTime']), side='left'))
+                end = min(end, start + limit)
+            else:
+                start = max(0, end - limit)
+            klines = self._klines[symbol]
+            return [self._kline_row(klines, index, now_ms) for index in range(start, end)]
+
+    def futures_ticker_price(self, **params):
+        with self._lock:
+            self.call_counts['futures_ticker_price'] += 1
+            now_ms = self.clock.now_ms()
+            if params.get('symbol'):
+                self._require_symbol(params['symbol'])
+                return {'symbol': params['symbol'], 'price': str(self._price(params['symbol'], now_ms)), 'time': now_ms}
+            return [{'symbol': symbol, 'price': str(self._price(symbol, now_ms)), 'time': now_ms}
+                    for symbol in self._klines if self._candle_index(symbol, now_ms) >= 0]
+
+    def _ticker_24h(self, symbol, now_ms):
+        """Estatísticas de 24h dos candles fechados na janela, mais o preço atual."""
+        klines = self._klines[symbol]
+        end = self._candle_index(symbol, now_ms)
+        start = min(int(np.searchsorted(self._open_times[symbol], now_ms - 86_400_000, side='left')), end)
+        closed = klines[start:end]
+        last_price = self._price(symbol, now_ms)
+        open_price = float(klines['open'][start])
+        high = max(float(closed['high'].max()), last_price) if len(closed) else last_price
+        low = min(float(closed['low'].min()), last_price) if len(closed) else last_price
+        volume = float(closed['volume'].sum())
+        quote_volume = float((closed['volume'] * closed['close']).sum())
+        return {
+            'symbol': symbol, 'priceChange': str(last_price - open_price),
+            'priceChangePercent': str((last_price / open_price - 1) * 100 if open_price else 0.0),
+            'lastPrice': str(last_price), 'openPrice': str(open_price), 'highPrice': str(high), 'lowPrice': str(low),
+            'volume': str(volume), 'quoteVolume': str(quote_volume), 'openTime': int(klines['open_time'][start]),
+            'closeTime': now_ms, 'count': len(closed),
+        }
+
+    def futures_ticker(self, **params):
+        with self._lock:
+            self.call_counts['futures_ticker'] += 1
+            now_ms = self.clock.now_ms()
+            if params.get('symbol'):
+                self._require_symbol(params['symbol'])
+                return self._ticker_24h(params['symbol'], now_ms)
+            return [self._ticker_24h(symbol, now_ms) for symbol in self._klines if self._candle_index(symbol, now_ms) >= 0]
+
+    def _book_ticker(self, symbol, now_ms):
+        # Spread simulado: o slippage de cada lado do preço atual
+        price = self._price(symbol, now_ms)
+        return {'symbol': symbol, 'bidPrice': str(price * (1 - self.slippage)), 'bidQty': '1000',
+                'askPrice': str(price * (1 + self.slippage)), 'askQty': '1000', 'time': now_ms}
+
+    def futures_orderbook_ticker(self, **params):
+        with self._lock:
+            self.call_counts['futures_orderbook_ticker'] += 1
+            now_ms = self.clock.now_ms()
+            if params.get('symbol'):
+                self._require_symbol(params['symbol'])
+                return self._book_ticker(params['symbol'], now_ms)
+            return [self._book_ticker(symbol, now_ms) for symbol in self._klines if self._candle_index(symbol, now_ms) >= 0]
+
+    def futures_order_book(self, **params):
+        # Livro sintético em torno do bookTicker, com profundidade proporcional ao volume recente
+        with self._lock:
+            self.call_counts['futures_order_book'] += 1
+            symbol = params['symbol']
+            self._require_symbol(symbol)
+            now_ms = self.clock.now_ms()
+            limit = int(params.get('limit', 500))
+            price = self._price(symbol, now_ms)
+            index = self._candle_index(symbol, now_ms)
+            volume = float(self._klines[symbol]['volume'][index - 1]) if index > 0 else 0.0
+            level_quantity = str(max(volume * BOOK_LEVEL_VOLUME_FRACTION, 1e-8))
+            step = price * BOOK_LEVEL_SPACING
+            bid, ask = price * (1 - self.slippage), price * (1 + self.slippage)
+            return {
+                'lastUpdateId': now_ms, 'E': now_ms, 'T': now_ms,
+                'bids': [[str(bid - level * step), level_quantity] for level in range(limit)],
+                'asks': [[str(ask + level * step), level_quantity] for level in range(limit)],
+            }
+
+    def futures_exchange_info(self):
+        self.call_counts['futures_exchange_info'] += 1
+        return {'timezone': 'UTC', 'serverTime': self.clock.now_ms(), 'symbols': list(self._exchange_symbols)}
+
+    def futures_ping(self):
+        self.call_counts['futures_ping'] += 1
+        return {}
+
+    def futures_time(self):
+        self.call_counts['futures_time'] += 1
+        return {'serverTime': self.clock.now_ms()}
+
+    # --- Conta ---
+    def _unrealized_pnl(self, symbol, now_ms):
+        position = self._positions.get(symbol)
+        if not position:
+            return 0.0
+        return (self._price(symbol, now_ms) - position['entry_price']) * position['amount']
+
+    def _account_totals(self, now_ms):
+        unrealized = sum(self._unrealized_pnl(symbol, now_ms) for symbol in self._positions)
+        initial_margin = sum(abs(position['amount']) * self._price(symbol, now_ms) / self._leverage.get(symbol, SIMULATOR_DEFAULT_LEVERAGE)
+                             for symbol, position in self._positions.items())
+        return unrealized, initial_margin, self.wallet_balance + unrealized - initial_margin
+
+    def futures_account_balance(self, **params):
+        with self._lock:
+            self.call_counts['futures_account_balance'] += 1
+            self._match_trigger_orders()
+            unrealized, _, available = self._account_totals(self.clock.now_ms())
+            return [{
+                'asset': 'USDT', 'balance': str(self.wallet_balance), 'crossWalletBalance': str(self.wallet_balance),
+                'crossUnPnl': str(unrealized), 'availableBalance': str(available), 'maxWithdrawAmount': str(available),
+                'updateTime': self.clock.now_ms(),
+            }]
+
+    def futures_account(self, **params):
+        with self._lock:
+            self.call_counts['futures_account'] += 1
+            self._match_trigger_orders()
+            unrealized, initial_margin, available = self._account_totals(self.clock.now_ms())
+            return {
+                'assets': [{'asset': 'USDT', 'walletBalance': str(self.wallet_balance), 'unrealizedProfit': str(unrealized),
+                            'availableBalance': str(available)}],
+                'totalWalletBalance': str(self.wallet_balance),
+                'totalUnrealizedProfit': str(unrealized),
+                'totalMarginBalance': str(self.wallet_balance + unrealized),
+                'totalInitialMargin': str(initial_margin),
+                'totalMaintMargin': '0',
+                'availableBalance': str(available),
+                'positions': self._position_rows(None),
+            }
+
+    def _position_rows(self, symbol):
+        now_ms = self.clock.now_ms()
+        symbols = [symbol] if symbol else [s for s in self._klines if self._candle_index(s, now_ms) >= 0]
+        rows = []
+        for s in symbols:
+            position = self._positions.get(s, {'amount': 0.0, 'entry_price': 0.0})
+            mark_price = self._price(s, now_ms)
+            leverage = self._leverage.get(s, SIMULATOR_DEFAULT_LEVERAGE)
+            rows.append({
+                'symbol': s, 'positionAmt': str(position['amount']), 'entryPrice': str(position['entry_price']),
+                'markPrice': str(mark_price), 'unRealizedProfit': str(self._unrealized_pnl(s, now_ms)),
+                'leverage': str(leverage), 'initialMargin': str(abs(position['amount']) * mark_price / leverage),
+                'notional': str(position['amount'] * mark_price), 'marginType': self._margin_types.get(s, 'cross'), 'isolatedMargin': '0',
+                'positionSide': 'BOTH', 'liquidationPrice': '0', 'updateTime': now_ms,
+            })
+        return rows
+
+    def futures_position_information(self, **params):
+        with self._lock:
+            self.call_counts['futures_position_information'] += 1
+            self._match_trigger_orders()
+            if params.get('symbol'):
+                self._require_symbol(params['symbol'])
+            return self._position_rows(params.get('symbol'))
+
+    def futures_change_leverage(self, **params):
+        with self._lock:
+            self.call_counts['futures_change_leverage'] += 1
+            symbol = params['symbol']
+            self._require_symbol(symbol)
+            leverage = int(params['leverage'])
+            if not 1 <= leverage <= 125:
+                raise api_error(-4028, f'Leverage {leverage} is not valid')
+            self._leverage[symbol] = leverage
+            return {'symbol': symbol, 'leverage': leverage, 'maxNotionalValue': '1000000'}
+
+    def futures_change_margin_type(self, **params):
+        with self._lock:
+            self.call_counts['futures_change_margin_type'] += 1
+            symbol = params['symbol']
+            self._require_symbol(symbol)
+            margin_type = {'ISOLATED': 'isolated', 'CROSSED': 'cross'}.get(params['marginType'])
+            if margin_type is None:
+                raise api_error(-1116, 'Invalid marginType.')
+            if self._margin_types.get(symbol, 'cross') == margin_type:
+                raise api_error(-4046, 'No need to change margin type.')
+            if self._positions.get(symbol, {}).get('amount'):
+                raise api_error(-4048, 'Margin type cannot be changed if there exists position.')
+            self._margin_types[symbol] = margin_type
+            return {'code': 200, 'msg': 'success'}
+
+    # --- Ordens ---
+    def _new_order(self, symbol, side, order_type, quantity, stop_price, reduce_only, now_ms):
+        order = {
+            'orderId': self._next_order_id, 'symbol': symbol, 'status': 'NEW',
+            'clientOrderId': f'sim_{self._next_order_id}', 'price': '0', 'avgPrice': '0', 'origQty': str(quantity),
+            'executedQty': '0', 'cumQuote': '0', 'timeInForce': 'GTC', 'type': order_type, 'origType': order_type,
+            'reduceOnly': reduce_only, 'closePosition': False, 'side': side, 'positionSide': 'BOTH',
+            'stopPrice': str(stop_price or 0), 'workingType': 'CONTRACT_PRICE', 'time': now_ms, 'updateTime': now_ms,
+        }
+        self._next_order_id += 1
+        self._orders[order['orderId']] = order
+        return order
+
+    def _validate_order(self, symbol, side, order_type, quantity, stop_price, reduce_only, now_ms):
+        if side not in ('BUY', 'SELL'):
+            raise api_error(-1102, "Mandatory parameter 'side' was not sent, was empty/null, or malformed.")
+        if order_type not in ('MARKET', *TRIGGER_ORDER_TYPES):
+            raise api_error(-1116, 'Invalid orderType.')
+        if quantity <= 0:
+            raise api_error(-4003, 'Quantity less than or equal to zero.')
+        price = self._price(symbol, now_ms)
+        if order_type in TRIGGER_ORDER_TYPES:
+            if not stop_price:
+                raise api_error(-1102, "Mandatory parameter 'stopPrice' was not sent, was empty/null, or malformed.")
+            # STOP vende abaixo / compra acima do preço atual; TAKE_PROFIT o contrário
+            triggers_below = (order_type == 'STOP_MARKET') == (side == 'SELL')
+            if (triggers_below and stop_price >= price) or (not triggers_below and stop_price <= price):
+                raise api_error(-2021, 'Order would immediately trigger.')
+        elif not reduce_only:
+            min_notional = self._min_notional.get(symbol, 0.0)
+            if quantity * price < min_notional:
+                raise api_error(-4164, f"Order's notional must be no smaller than {min_notional}")
+            _, _, available = self._account_totals(now_ms)
+            required_margin = quantity * price / self._leverage.get(symbol, SIMULATOR_DEFAULT_LEVERAGE)
+            if required_margin + quantity * price * self.taker_fee > available:
+                raise api_error(-2019, 'Margin is insufficient.')
+
+    def _create_order(self, params):
+        symbol = params['symbol']
+        self._require_symbol(symbol)
+        side = params.get('side')
+        order_type = params.get('type')
+        quantity = float(params.get('quantity', 0))
+        stop_price = float(params['stopPrice']) if params.get('stopPrice') else None
+        reduce_only = params.get('reduceOnly') in (True, 'true', 'True')
+        now_ms = self.clock.now_ms()
+        self._match_trigger_orders()
+        self._validate_order(symbol, side, order_type, quantity, stop_price, reduce_only, now_ms)
+
+        if order_type == 'MARKET':
+            position_amount = self._positions.get(symbol, {'amount': 0.0})['amount']
+            if reduce_only and (position_amount == 0 or (position_amount > 0) == (side == 'BUY')):
+                raise api_error(-2022, 'ReduceOnly Order is rejected.')
+            order = self._new_order(symbol, side, order_type, quantity, None, reduce_only, now_ms)
+            self._fill(order, self._price(symbol, now_ms), now_ms)
+            # Como na Binance, a resposta da criação chega antes do preenchimento
+            return dict(order, status='NEW', executedQty='0', avgPrice='0', cumQuote='0')
+
+        order = self._new_order(symbol, side, order_type, quantity, stop_price, reduce_only, now_ms)
+        self._open_trigger_orders.setdefault(symbol, []).append(order['orderId'])
+        self._next_candle[symbol] = max(self._next_candle.get(symbol, 0), self._candle_index(symbol, now_ms))
+        return dict(order)
+
+    def futures_create_order(self, **params):
+        with self._lock:
+            self.call_counts['futures_create_order'] += 1
+            return self._create_order(params)
+
+    def futures_place_batch_order(self, **params):
+        with self._lock:
+            self.call_counts['futures_place_batch_order'] += 1
+            responses = []
+            for order_params in params['batchOrders']:
+                try:
+                    responses.append(self._create_order(order_params))
+                except BinanceAPIException as e:
+                    responses.append({'code': e.code, 'msg': e.message})
+            return responses
+
+    def futures_get_order(self, **params):
+        with self._lock:
+            self.call_counts['futures_get_order'] += 1
+            self._match_trigger_orders()
+            order = self._orders.get(int(params['orderId']))
+            if order is None or order['symbol'] != params['symbol']:
+                raise api_error(-2013, 'Order does not exist.')
+            return dict(order)
+
+    def futures_get_open_orders(self, **params):
+        with self._lock:
+            self.call_counts['futures_get_open_orders'] += 1
+            self._match_trigger_orders()
+            symbols = [params['symbol']] if params.get('symbol') else list(self._open_trigger_orders)
+            return [dict(self._orders[order_id]) for symbol in symbols for order_id in self._open_trigger_orders.get(symbol, [])]
+
+    def _cancel(self, order_id, now_ms):
+        order = self._orders[order_id]
+        order['status'] = 'CANCELED'
+        order['updateTime'] = now_ms
+        self._open_trigger_orders[order['symbol']].remove(order_id)
+        return order
+
+    def futures_cancel_order(self, **params):
+        with self._lock:
+            self.call_counts['futures_cancel_order'] += 1
+            self._match_trigger_orders()
+            order_id = int(params['orderId'])
+            if order_id not in self._open_trigger_orders.get(params['symbol'], []):
+                raise api_error(-2011, 'Unknown order sent.')
+            return dict(self._cancel(order_id, self.clock.now_ms()))
+
+    def futures_cancel_all_open_orders(self, **params):
+        with self._lock:
+            self.call_counts['futures_cancel_all_open_orders'] += 1
+            self._require_symbol(params['symbol'])
+            self._match_trigger_orders()
+            now_ms = self.clock.now_ms()
+            for order_id in list(self._open_trigger_orders.get(params['symbol'], [])):
+                self._cancel(order_id, now_ms)
+            return {'code': 200, 'msg': 'The operation of cancel all open order is done.'}
+
+    # --- Execução ---
+    def _fill(self, order, trigger_price, fill_time):
+        """Executa a ordem a mercado em `trigger_price` (com slippage); reduce-only sem posição expira."""
+        symbol = order['symbol']
+        quantity = float(order['origQty'])
+        position = self._positions.get(symbol)
+        amount = position['amount'] if position else 0.0
+        if order['reduceOnly']:
+            if amount == 0 or (amount > 0) == (order['side'] == 'BUY'):
+                order['status'] = 'EXPIRED'
+                order['updateTime'] = fill_time
+                return
+            quantity = min(quantity, abs(amount))
+
+        direction = 1 if order['side'] == 'BUY' else -1
+        price = trigger_price * (1 + direction * self.slippage)
+        fee = price * quantity * self.taker_fee
+        self.wallet_balance -= fee
+        order.update(status='FILLED', executedQty=str(quantity), avgPrice=str(price),
+                     cumQuote=str(price * quantity), updateTime=fill_time)
+        self.fills.append({'time': fill_time, 'symbol': symbol, 'orderId': order['orderId'], 'type': order['type'],
+                           'side': order['side'], 'quantity': quantity, 'price': price, 'fee': fee})
+
+        signed_quantity = direction * quantity
+        if amount == 0 or (amount > 0) == (signed_quantity > 0):
+            # Abre ou aumenta a posição: preço médio ponderado
+            new_amount = amount + signed_quantity
+            entry_price = (position['entry_price'] * abs(amount) + price * quantity) / abs(new_amount) if position else price
+            self._positions[symbol] = {'amount': new_amount, 'entry_price': entry_price,
+                                       'fees': (position['fees'] if position else 0.0) + fee,
+                                       'entry_time': position['entry_time'] if position else fill_time}
+            return
+
+        closed_quantity = min(quantity, abs(amount))
+        realized = (price - position['entry_price']) * closed_quantity * (1 if amount > 0 else -1)
+        self.wallet_balance += realized
+        remaining = amount + signed_quantity
+        if abs(remaining) < 1e-12:
+            fees = position['fees'] + fee
+            self.trades.append({
+                'symbol': symbol, 'entry_time': position['entry_time'], 'exit_time': fill_time,
+                'entry_price': position['entry_price'], 'exit_price': price, 'quantity': closed_quantity,
+                'exit_reason': {'STOP_MARKET': 'SL', 'TAKE_PROFIT_MARKET': 'TP'}.get(order['type'], 'MARKET'),
+                'fees': fees, 'pnl': realized - fees, 'balance': self.wallet_balance,
+            })
+            del self._positions[symbol]
+        elif (remaining > 0) == (amount > 0):
+            position['amount'] = remaining
+            position['fees'] += fee
+        else:
+            # Inverte a posição: o excedente abre uma nova no preço da execução
+            self._positions[symbol] = {'amount': remaining, 'entry_price': price, 'fees': 0.0, 'entry_time': fill_time}
+
+    def _triggered_price(self, order, candle):
+        """Preço de execução da ordem de gatilho no candle, ou None se o candle não a atinge."""
+        stop_price = float(order['stopPrice'])
+        open_price, high, low = float(candle['open']), float(candle['high']), float(candle['low'])
+        triggers_below = (order['type'] == 'STOP_MARKET') == (order['side'] == 'SELL')
+        if triggers_below:
+            return (min(open_price, stop_price)) if low <= stop_price else None
+        return (max(open_price, stop_price)) if high >= stop_price else None
+
+    def _match_trigger_orders(self):
+        """Avalia as ordens de gatilho abertas contra os candles fechados desde a última avaliação."""
+        now_ms = self.clock.now_ms()
+        for symbol, order_ids in self._open_trigger_orders.items():
+            if not order_ids:
+                continue
+            klines = self._klines[symbol]
+            index = self._next_candle.get(symbol, 0)
+            while order_ids and index < len(klines) and int(klines['close_time'][index]) < now_ms:
+                candle = klines[index]
+                close_time = int(candle['close_time'])
+                triggered = []
+                for order_id in order_ids:
+                    order = self._orders[order_id]
+                    price = self._triggered_price(order, candle) if order['time'] <= close_time else None
+                    if price is not None:
+                        gap = price == float(candle['open'])
+                        triggered.append((not gap, order['type'] != 'STOP_MARKET', order_id, price))
+                # Aberturas além do gatilho primeiro; no mesmo candle, o stop antes do take profit
+                for _, _, order_id, price in sorted(triggered):
+                    order_ids.remove(order_id)
+                    self._fill(self._orders[order_id], price, close_time)
+                index += 1
+            self._next_candle[symbol] = index
+
+    # --- Relatório ---
+    def get_report(self):
+        with self._lock:
+            unrealized, _, _ = self._account_totals(self.clock.now_ms())
+            return {
+                'initial_balance': self.initial_balance,
+                'wallet_balance': self.wallet_balance,
+                'unrealized_pnl': unrealized,
+                'open_positions': {symbol: position['amount'] for symbol, position in self._positions.items()},
+                'open_orders': sum(len(order_ids) for order_ids in self._open_trigger_orders.values()),
+                'fills': len(self.fills),
+                'summary': summarize(self.trades, self.initial_balance),
+                'call_counts': dict(self.call_counts),
+            }
+
+
+# --- Execução do bot contra o simulador ---
+def run_bot_simulation(simulator, clock, params, state_dir=SIMULATOR_STATE_DIR, protection_check_seconds=None):
+    """
+    Roda `main.run_bot()` contra o simulador, com o relógio simulado e estado isolado em `state_dir`.
+
+    O cliente, o relógio, o registro de símbolos, o cache de klines, os indicadores, o banco de
+    estado, a lista de símbolos e o snapshot de métricas do módulo `main` são substituídos durante a
+    execução e restaurados no final; o log da simulação vai para `state_dir`, e não para o log do bot
+    transmitido pelo backend. Os streams ficam desligados; no lugar do livro do stream de profundidade, o dimensionamento
+    usa o livro sintético do simulador. Retorna o relatório do simulador.
+    """
+    shutil.rmtree(state_dir, ignore_errors=True)
+    os.makedirs(state_dir)
+    config_path = os.path.join(state_dir, 'settings.json')
+    with open(config_path, 'w') as f:
+        json.dump(dict(params, test_mode=False), f, indent=2)
+
+    def initialize_simulated_client():
+        main.client = simulator
+        main.TIME_OFFSET_MS = 0
+        return True
+
+    kline_store = KlineStore(base_dir=os.path.join(state_dir, 'klines'))
+    state_store = StateStore(os.path.join(state_dir, 'state.sqlite'))
+    patches = {
+        'time': clock,
+        'initialize_binance_client': initialize_simulated_client,
+        'start_market_stream': lambda *args: None,
+        'start_user_stream': lambda: None,
+        'get_order_book': lambda symbol: OrderBook.from_snapshot(symbol, simulator.futures_order_book(symbol=symbol, limit=DEPTH_SNAPSHOT_LIMIT)),
+        'CONFIG_FILE_PATH': config_path,
+        'SYMBOL_INFO': SymbolRegistry(simulator.futures_exchange_info, snapshot_path=os.path.join(state_dir, 'exchange_info.json')),
+        'KLINE_STORE': kline_store,
+        'INDICATOR_ENGINE': IndicatorEngine(kline_store, state_path=os.path.join(state_dir, 'indicator_state.json')),
+        'STATE_STORE': state_store,
+        'OPEN_POSITIONS': state_store.positions,
+        'LEVERAGE_SET_FOR_SYMBOL': state_store.leverage,
+        'MARGIN_TYPE_SET_FOR_SYMBOL': state_store.margin_types,
+        'WATCHLIST': Watchlist(snapshot_path=os.path.join(state_dir, 'watchlist.json')),
+        'METRICS_SNAPSHOT_PATH': os.path.join(state_dir, 'metrics.json'),
+    }
+    if protection_check_seconds is not None:
+        patches['PROTECTION_CHECK_INTERVAL_SECONDS'] = protection_check_seconds
+    originals = {name: getattr(main, name) for name in patches}
+    for name, value in patches.items():
+        setattr(main, name, value)
+    log_level = logging.getLogger().level # Mantém o nível escolhido pelo chamador (--verbose)
+    setup_logging(BOT_LOG_FILE, log_dir=state_dir, level=log_level)
+    try:
+        main.run_bot()
+    except SystemExit:
+        pass
+    finally:
+        main.SYMBOL_INFO.stop_background_refresh()
+        state_store.close()
+        for name, value in originals.items():
+            setattr(main, name, value)
+        main.client = None
+        setup_logging(BOT_LOG_FILE, log_dir=LOG_DIR, level=log_level)
+    return simulator.get_report()
+
+
+def print_simulation_report(report, simulated_ms, elapsed):
+    summary = report['summary']
+    print(f"\nSaldo: {report['initial_balance']:.2f} -> {report['wallet_balance']:.2f} USDT "
+          f"(PnL não realizado {report['unrealized_pnl']:.2f}) | execuções {report['fills']}")
+    print(f"Trades: {summary['trades']} | acerto {summary['win_rate']:.1f}% | PnL {summary['net_pnl']:.2f} USDT | "
+          f"PF {summary['profit_factor']:.2f} | MaxDD {summary['max_drawdown_pct']:.2f}% | taxas {summary['fees']:.2f} | "
+          f"saídas {summary['exits']}")
+    if report['open_positions'] or report['open_orders']:
+        print(f"[AVISO] Restaram posições {report['open_positions']} e {report['open_orders']} ordens abertas no fim.")
+    total_calls = sum(report['call_counts'].values())
+    print(f"Chamadas à API simulada: {total_calls} ({total_calls / max(simulated_ms / 60_000, 1):.2f}/min simulado)")
+    for endpoint, count in sorted(report['call_counts'].items(), key=lambda item: -item[1]):
+        print(f"  {endpoint:<32}{count:>8}")
+    print(f"Tempo simulado: {simulated_ms / 3_600_000:.1f}h em {elapsed:.1f}s ({simulated_ms / 1000 / max(elapsed, 1e-9):.0f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roda o bot completo contra uma Binance simulada sobre klines gravados.")
+    parser.add_argument("--symbols", nargs="+", help="Símbolos do universo simulado (padrão: todos os armazenados)")
+    parser.add_argument("--config", default=main.CONFIG_FILE_PATH, help="settings.json com os parâmetros do bot")
+    parser.add_argument("--data-dir", default=BACKTEST_KLINE_DIR)
+    parser.add_argument("--state-dir", default=SIMULATOR_STATE_DIR)
+    parser.add_argument("--warmup", type=int, default=SIMULATOR_WARMUP_CANDLES, help="Candles de histórico antes do início")
+    parser.add_argument("--candles", type=int, help="Quantidade de candles simulados (padrão: até o fim dos dados)")
+    parser.add_argument("--initial-balance", type=float)
+    parser.add_argument("--fee", type=float, help="Taxa taker por execução (ex.: 0.0005)")
+    parser.add_argument("--slippage", type=float)
+    parser.add_argument("--speed", type=float, help="Fator de aceleração em relação ao tempo real (padrão: sem espera)")
+    parser.add_argument("--protection-interval", type=float, help="Substitui PROTECTION_CHECK_INTERVAL_SECONDS (s simulados)")
+    parser.add_argument("--verbose", action="store_true", help="Mantém os logs INFO do bot")
+    args = parser.parse_args()
+
+    # Chaves do bot (alavancagem, risco, máximo de símbolos...) mais os parâmetros da simulação
+    params = load_params(args.config)
+    if os.path.exists(args.config):
+        with open(args.config, 'r') as f:
+            params = dict(json.load(f), **params)
+    for key, value in (('initial_balance', args.initial_balance), ('taker_fee', args.fee), ('slippage', args.slippage)):
+        if value is not None:
+            params[key] = value
+    interval = main.KLINE_INTERVAL_MAP[params['kline_interval_minutes']]
+    symbols = args.symbols or stored_symbols(interval, args.data_dir)
+    open_times = [load_klines(symbol, interval, args.data_dir)['open_time'] for symbol in symbols]
+    open_times = [times for times in open_times if len(times) > args.warmup]
+    if not open_times:
+        parser.error(f"nenhum histórico {interval} com mais de {args.warmup} candles: baixe com `python backtest.py --download`")
+
+    start_ms = min(int(times[args.warmup]) for times in open_times)
+    end_ms = max(int(times[-1]) for times in open_times) + INTERVAL_MS[interval]
+    if args.candles:
+        end_ms = min(end_ms, start_ms + args.candles * INTERVAL_MS[interval])
+
+    clock = SimulatedClock(start_ms, end_ms, args.speed)
+    simulator = ExchangeSimulator(clock, interval, symbols, args.data_dir, initial_balance=params['initial_balance'],
+                                  taker_fee=params['taker_fee'], slippage=params['slippage'])
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    start = time.perf_counter()
+    report = run_bot_simulation(simulator, clock, params, args.state_dir, args.protection_interval)
+    print_simulation_report(report, clock.now_ms() - start_ms, time.perf_counter() - start)
@@ -0,0 +1,356 @@
+import itertools
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from kline_store import INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+INDICATOR_STATE_PATH = os.path.join('data', 'indicator_state.json') # Snapshot do estado dos indicadores
+
+# Colunas do array OHLC usado pelos cálculos em lote
+OHLC_OPEN, OHLC_HIGH, OHLC_LOW, OHLC_CLOSE = range(4)
+
+
+# --- Referência escalar: recalcula o indicador sobre a janela inteira ---
+def calculate_ema(prices, period):
+    if len(prices) < period:
+        return None
+    ema = [0.0] * len(prices)
+    ema[period - 1] = sum(prices[:period]) / period
+    multiplier = 2 / (period + 1)
+    for i in range(period, len(prices)):
+        ema[i] = ((prices[i] - ema[i-1]) * multiplier) + ema[i-1]
+    return ema[-1]
+
+
+def calculate_atr(klines, period):
+    if len(klines) < period:
+        return None
+
+    true_ranges = []
+    for i in range(1, len(klines)):
+        high = float(klines[i][2])
+        low = float(klines[i][3])
+        prev_close = float(klines[i-1][4])
+
+        tr1 = high - low
+        tr2 = abs(high - prev_close)
+        tr3 = abs(low - prev_close)
+        true_ranges.append(max(tr1, tr2, tr3))
+
+    if len(true_ranges) < period:
+        return None
+
+    atr_values = [0.0] * len(true_ranges)
+    atr_values[period - 1] = sum(true_ranges[:period]) / period
+
+    multiplier = 2 / (period + 1)
+    for i in range(period, len(true_ranges)):
+        atr_values[i] = ((true_ranges[i] - atr_values[i-1]) * multiplier) + atr_values[i-1]
+
+    return atr_values[-1]
+
+
+class IncrementalEMA:
+    """
+    EMA atualizada em O(1) por candle.
+
+    Mesma semente de calculate_ema: a média simples dos primeiros `period` valores,
+    seguida da recursão com multiplicador 2 / (period + 1).
+    """
+
+    __slots__ = ('period', 'multiplier', 'count', 'seed_sum', 'value')
+
+    def __init__(self, period):
+        self.period = period
+        self.multiplier = 2 / (period + 1)
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = None
+
+    def _next(self, price):
+        if self.count + 1 < self.period:
+            return None
+        if self.count + 1 == self.period:
+            return (self.seed_sum + price) / self.period
+        return ((price - self.value) * self.multiplier) + self.value
+
+    def update(self, price):
+        value = self._next(price)
+        self.count += 1
+        if self.count <= self.period:
+            self.seed_sum += price
+        self.value = value
+        return value
+
+    def peek(self, price):
+        """Valor que a EMA teria com `price` como próximo ponto, sem alterar o estado."""
+        return self._next(price)
+
+    def snapshot(self):
+        return {'count': self.count, 'seed_sum': self.seed_sum, 'value': self.value}
+
+    def restore(self, state):
+        self.count = state['count']
+        self.seed_sum = state['seed_sum']
+        self.value = state['value']
+
+
+class IncrementalATR:
+    """
+    ATR atualizado em O(1) por candle, com a mesma semântica de calculate_atr.
+
+    O primeiro candle fornece apenas o fechamento anterior; os true ranges seguintes
+    alimentam uma IncrementalEMA do período do ATR.
+    """
+
+    __slots__ = ('period', 'prev_close', 'ema')
+
+    def __init__(self, period):
+        self.period = period
+        self.prev_close = None
+        self.ema = IncrementalEMA(period)
+
+    def _true_range(self, high, low):
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def update(self, high, low, close):
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+        value = self.ema.update(self._true_range(high, low))
+        self.prev_close = close
+        return value
+
+    def peek(self, high, low, close):
+        if self.prev_close is None:
+            return None
+        return self.ema.peek(self._true_range(high, low))
+
+    @property
+    def value(self):
+        return self.ema.value
+
+    def snapshot(self):
+        return {'prev_close': self.prev_close, 'ema': self.ema.snapshot()}
+
+    def restore(self, state):
+        self.prev_close = state['prev_close']
+        self.ema.restore(state['ema'])
+
+
+class SymbolIndicators:
+    """EMA de tendência, EMA de pullback e ATR de um (símbolo, intervalo), alimentados por candles fechados."""
+
+    __slots__ = ('trend_period', 'pullback_period', 'atr_period', 'ema_trend', 'ema_pullback', 'atr', 'last_open_time')
+
+    def __init__(self, trend_period, pullback_period, atr_period):
+        self.trend_period = trend_period
+        self.pullback_period = pullback_period
+        self.atr_period = atr_period
+        self.reset()
+
+    def reset(self):
+        self.ema_trend = IncrementalEMA(self.trend_period)
+        self.ema_pullback = IncrementalEMA(self.pullback_period)
+        self.atr = IncrementalATR(self.atr_period)
+        self.last_open_time = None
+
+    def update(self, kline):
+        high, low, close = float(kline[2]), float(kline[3]), float(kline[4])
+        self.ema_trend.update(close)
+        self.ema_pullback.update(close)
+        self.atr.update(high, low, close)
+        self.last_open_time = int(kline[0])
+
+    def peek(self, kline):
+        """(ema_trend, ema_pullback, atr) incluindo o candle em formação, sem alterar o estado."""
+        high, low, close = float(kline[2]), float(kline[3]), float(kline[4])
+        return self.ema_trend.peek(close), self.ema_pullback.peek(close), self.atr.peek(high, low, close)
+
+    def snapshot(self):
+        return {
+            'periods': [self.trend_period, self.pullback_period, self.atr_period],
+            'last_open_time': self.last_open_time,
+            'ema_trend': self.ema_trend.snapshot(),
+            'ema_pullback': self.ema_pullback.snapshot(),
+            'atr': self.atr.snapshot(),
+        }
+
+    def restore(self, state):
+        self.ema_trend.restore(state['ema_trend'])
+        self.ema_pullback.restore(state['ema_pullback'])
+        self.atr.restore(state['atr'])
+        self.last_open_time = state['last_open_time']
+
+
+class IndicatorEngine:
+    """
+    Indicadores incrementais por (símbolo, intervalo), sincronizados com o KlineStore.
+
+    A cada avaliação só os candles fechados posteriores ao último já processado são
+    aplicados; o candle atual entra por `peek`. Se o histórico local tiver uma lacuna em
+    relação ao estado, os indicadores são recalculados a partir de todo o histórico armazenado.
+    """
+
+    def __init__(self, kline_store, state_path=INDICATOR_STATE_PATH):
+        self.kline_store = kline_store
+        self.state_path = state_path
+        self._indicators = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def _get(self, symbol, interval, trend_period, pullback_period, atr_period):
+        key = f"{symbol}_{interval}"
+        periods = (trend_period, pullback_period, atr_period)
+        indicators = self._indicators.get(key)
+        if indicators is None or (indicators.trend_period, indicators.pullback_period, indicators.atr_period) != periods:
+            indicators = SymbolIndicators(*periods)
+            self._indicators[key] = indicators
+        return indicators
+
+    def evaluate(self, symbol, interval, trend_period, pullback_period, atr_period, current_kline):
+        """Retorna (ema_trend, ema_pullback, atr) com `current_kline` como último candle."""
+        current_open_time = int(current_kline[0])
+        with self._lock:
+            indicators = self._get(symbol, interval, trend_period, pullback_period, atr_period)
+            if indicators.last_open_time is not None and indicators.last_open_time >= current_open_time:
+                # Estado à frente do candle pedido (ex.: histórico reiniciado): recomeça do zero
+                indicators.reset()
+
+            if indicators.last_open_time is None:
+                new_klines = self.kline_store.get_klines_since(symbol, interval, None)
+            else:
+                new_klines = self.kline_store.get_klines_since(symbol, interval, indicators.last_open_time)
+                if new_klines and new_klines[0][0] != indicators.last_open_time + INTERVAL_MS[interval]:
+                    logger.info("[INDICADORES] Lacuna no histórico de %s (%s). Recalculando a partir do histórico local.", symbol, interval,
+                                extra={'symbol': symbol, 'event': 'indicator_gap'})
+                    indicators.reset()
+                    new_klines = self.kline_store.get_klines_since(symbol, interval, None)
+
+            for kline in new_klines:
+                if kline[0] >= current_open_time:
+                    break
+                indicators.update(kline)
+                self._dirty = True
+            return indicators.peek(current_kline)
+
+    # --- Persistência ---
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {key: indicators.snapshot() for key, indicators in self._indicators.items()}
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return 0
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("[INDICADORES] Snapshot de indicadores ilegível (%s). Recalculando do histórico local.", e)
+            return 0
+        with self._lock:
+            for key, indicator_state in state.items():
+                indicators = SymbolIndicators(*indicator_state['periods'])
+                indicators.restore(indicator_state)
+                self._indicators[key] = indicators
+        logger.info("[INDICADORES] Estado restaurado para %s séries.", len(state))
+        return len(state)
+
+
+# --- Cálculo vetorizado em lote (N símbolos x T candles) ---
+def klines_to_ohlc(klines_by_symbol):
+    """Converte listas de klines (todas com T candles) num array float64 de forma (N, T, 4): open, high, low, close."""
+    symbol_count = len(klines_by_symbol)
+    candle_count = len(klines_by_symbol[0]) if symbol_count else 0
+    values = itertools.chain.from_iterable(kline[1:5] for klines in klines_by_symbol for kline in klines)
+    return np.fromiter(values, dtype=np.float64, count=symbol_count * candle_count * 4).reshape(symbol_count, candle_count, 4)
+
+
+def _ema_last_weights(length, period):
+    """
+    Pesos w tais que values @ w é o último valor de calculate_ema sobre `length` pontos.
+
+    Semente = média dos primeiros `period` pontos; cada passo seguinte multiplica a
+    contribuição anterior por (1 - m) e soma m * x, com m = 2 / (period + 1).
+    """
+    multiplier = 2 / (period + 1)
+    steps = length - period
+    weights = np.empty(length, dtype=np.float64)
+    weights[:period] = (1 - multiplier) ** steps / period
+    weights[period:] = multiplier * (1 - multiplier) ** np.arange(steps - 1, -1, -1)
+    return weights
+
+
+def batch_ema(values, period):
+    """Último valor da EMA ao longo do último eixo de `values` (N, T); NaN se T < period."""
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[-1] < period:
+        return np.full(values.shape[:-1], np.nan)
+    return values @ _ema_last_weights(values.shape[-1], period)
+
+
+def batch_true_range(ohlc):
+    """True ranges (N, T - 1) a partir do segundo candle, como em calculate_atr."""
+    high = ohlc[:, 1:, OHLC_HIGH]
+    low = ohlc[:, 1:, OHLC_LOW]
+    prev_close = ohlc[:, :-1, OHLC_CLOSE]
+    return np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def batch_atr(ohlc, period):
+    return batch_ema(batch_true_range(ohlc), period)
+
+
+def batch_indicators(ohlc, trend_period, pullback_period, atr_period):
+    """EMA de tendência, EMA de pullback e ATR do último candle de cada um dos N símbolos de `ohlc` (N, T, 4)."""
+    ohlc = np.asarray(ohlc, dtype=np.float64)
+    close = ohlc[:, :, OHLC_CLOSE]
+    return {
+        'ema_trend': batch_ema(close, trend_period),
+        'ema_pullback': batch_ema(close, pullback_period),
+        'atr': batch_atr(ohlc, atr_period),
+    }
+
+
+# --- Séries completas (um valor por candle), com a mesma semântica do IndicatorEngine ---
+def ema_series(values, period):
+    """EMA em cada ponto de `values` (1D): NaN antes de `period` pontos, semente SMA e recursão como IncrementalEMA."""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(values.shape[0], np.nan)
+    if values.shape[0] < period:
+        return result
+    multiplier = 2 / (period + 1)
+    value = values[:period].mean()
+    result[period - 1] = value
+    # Recursão sequencial sobre floats nativos (bem mais rápida que indexar o array a cada passo)
+    out = [value]
+    for price in values[period:].tolist():
+        value = ((price - value) * multiplier) + value
+        out.append(value)
+    result[period - 1:] = out
+    return result
+
+
+def atr_series(ohlc, period):
+    """ATR em cada candle de `ohlc` (T, 4), como IncrementalATR: o primeiro candle só fornece o fechamento anterior."""
+    ohlc = np.asarray(ohlc, dtype=np.float64)
+    result = np.full(ohlc.shape[0], np.nan)
+    if ohlc.shape[0] < 2:
+        return result
+    true_range = batch_true_range(ohlc[np.newaxis])[0]
+    result[1:] = ema_series(true_range, period)
+    return result
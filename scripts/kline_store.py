@@ -0,0 +1,238 @@
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+KLINE_STORE_DIR = os.path.join('data', 'klines') # Diretório padrão dos arquivos de klines
+KLINE_STORE_MAX_ROWS = 1000 # Quantidade máxima de candles mantida por (símbolo, intervalo); None = sem limite
+KLINE_FETCH_LIMIT = 1500 # Máximo de candles por requisição futures_klines
+
+# Cada candle ocupa um registro binário de tamanho fixo:
+# open_time (int64), open, high, low, close, volume (float64), close_time (int64)
+KLINE_RECORD = struct.Struct('<qdddddq')
+KLINE_RECORD_SIZE = KLINE_RECORD.size
+
+INTERVAL_MS = {
+    '1m': 60_000,
+    '3m': 180_000,
+    '5m': 300_000,
+    '15m': 900_000,
+    '30m': 1_800_000,
+    '1h': 3_600_000,
+    '2h': 7_200_000,
+    '4h': 14_400_000,
+    '1d': 86_400_000,
+}
+
+
+def kline_to_record(kline):
+    return KLINE_RECORD.pack(int(kline[0]), float(kline[1]), float(kline[2]), float(kline[3]),
+                             float(kline[4]), float(kline[5]), int(kline[6]))
+
+
+class _KlineSeries:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = bytearray()
+        self.loaded = False
+        # Indica se o último candle armazenado já estava fechado quando foi baixado
+        self.last_complete = False
+
+    @property
+    def count(self):
+        return len(self.data) // KLINE_RECORD_SIZE
+
+    def last_record(self):
+        if not self.data:
+            return None
+        return KLINE_RECORD.unpack_from(self.data, len(self.data) - KLINE_RECORD_SIZE)
+
+
+class KlineStore:
+    """
+    Cache local e persistente de klines por (símbolo, intervalo).
+
+    Os candles ficam num arquivo binário de registros fixos por série e numa cópia em memória.
+    Cada atualização baixa apenas os candles posteriores ao último fechado já armazenado
+    (o último candle, ainda em formação, é sempre substituído), e as janelas de lookback
+    são servidas da memória sem nenhuma requisição.
+    """
+
+    def __init__(self, base_dir=KLINE_STORE_DIR, max_rows=KLINE_STORE_MAX_ROWS):
+        self.base_dir = base_dir
+        self.max_rows = max_rows
+        self._series = {}
+        self._series_lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+
+    def series_path(self, symbol, interval):
+        return os.path.join(self.base_dir, f"{symbol}_{interval}.bin")
+
+    def _get_series(self, symbol, interval):
+        key = (symbol, interval)
+        with self._series_lock:
+            series = self._series.get(key)
+            if series is None:
+                series = _KlineSeries(self.series_path(symbol, interval))
+                self._series[key] = series
+        if not series.loaded:
+            with series.lock:
+                if not series.loaded:
+                    self._load(series)
+        return series
+
+    def _load(self, series):
+        if os.path.exists(series.path):
+            with open(series.path, 'rb') as f:
+                data = f.read()
+            # Descarta um registro incompleto deixado por uma gravação interrompida
+            valid_size = len(data) - (len(data) % KLINE_RECORD_SIZE)
+            if valid_size != len(data):
+                logger.warning("[KLINES] Registro incompleto descartado em %s.", series.path)
+                with open(series.path, 'r+b') as f:
+                    f.truncate(valid_size)
+            series.data = bytearray(data[:valid_size])
+        series.loaded = True
+
+    # --- Leitura ---
+    def get_klines(self, symbol, interval, count=None):
+        """Retorna os últimos `count` candles no formato [open_time, open, high, low, close, volume, close_time]."""
+        series = self._get_series(symbol, interval)
+        with series.lock:
+            if count is None:
+                view = bytes(series.data)
+            else:
+                view = bytes(series.data[-count * KLINE_RECORD_SIZE:]) if count > 0 else b''
+        return [list(record) for record in KLINE_RECORD.iter_unpack(view)]
+
+    def get_klines_since(self, symbol, interval, open_time):
+        """Candles com open_time posterior a `open_time` (todos, se None), localizados por busca binária."""
+        series = self._get_series(symbol, interval)
+        with series.lock:
+            low, high = 0, series.count
+            if open_time is not None:
+                while low < high:
+                    middle = (low + high) // 2
+                    if KLINE_RECORD.unpack_from(series.data, middle * KLINE_RECORD_SIZE)[0] <= open_time:
+                        low = middle + 1
+                    else:
+                        high = middle
+            view = bytes(series.data[low * KLINE_RECORD_SIZE:])
+        return [list(record) for record in KLINE_RECORD.iter_unpack(view)]
+
+    def get_last_kline(self, symbol, interval):
+        series = self._get_series(symbol, interval)
+        with series.lock:
+            record = series.last_record()
+        return list(record) if record else None
+
+    def count(self, symbol, interval):
+        return self._get_series(symbol, interval).count
+
+    # --- Escrita ---
+    def merge_klines(self, symbol, interval, klines, persist=True):
+        """
+        Grava candles novos; candles com open_time já armazenado substituem os existentes a partir dali.
+
+        Com `persist=False` apenas a cópia em memória é alterada (usado para as atualizações
+        intermediárias de um candle já presente no arquivo).
+        """
+        if not klines:
+            return 0
+        series = self._get_series(symbol, interval)
+        records = b''.join(kline_to_record(kline) for kline in klines)
+        first_open_time = int(klines[0][0])
+        with series.lock:
+            keep_rows = series.count
+            # Recua até o primeiro candle armazenado que será substituído (normalmente só o último, ainda aberto)
+            while keep_rows > 0 and KLINE_RECORD.unpack_from(series.data, (keep_rows - 1) * KLINE_RECORD_SIZE)[0] >= first_open_time:
+                keep_rows -= 1
+            keep_size = keep_rows * KLINE_RECORD_SIZE
+            del series.data[keep_size:]
+            series.data += records
+
+            if persist:
+                if self.max_rows is not None and series.count > self.max_rows * 1.5:
+                    # Compacta o arquivo mantendo apenas os `max_rows` candles mais recentes
+                    del series.data[:-self.max_rows * KLINE_RECORD_SIZE]
+                    tmp_path = series.path + '.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(series.data)
+                    os.replace(tmp_path, series.path)
+                else:
+                    with open(series.path, 'ab') as f:
+                        f.truncate(keep_size)
+                        f.write(records)
+        return len(klines)
+
+    def apply_live_kline(self, symbol, interval, kline, is_closed):
+        """
+        Aplica um candle recebido pelo websocket.
+
+        Retorna False, sem gravar, quando o candle não continua a série armazenada
+        (lacuna ou série vazia); nesse caso a série deve ser completada com `update`.
+        """
+        series = self._get_series(symbol, interval)
+        open_time = int(kline[0])
+        with series.lock:
+            last = series.last_record()
+        if last is None or open_time not in (last[0], last[0] + INTERVAL_MS[interval]):
+            return False
+        # Em disco basta gravar o candle quando ele aparece e quando fecha; os ticks intermediários ficam só em memória
+        self.merge_klines(symbol, interval, [kline], persist=is_closed or open_time != last[0])
+        series.last_complete = is_closed
+        return True
+
+    def update(self, symbol, interval, min_count, fetch_klines, now_ms=None):
+        """
+        Sincroniza a série com a exchange e garante pelo menos `min_count` candles.
+
+        `fetch_klines(symbol, interval, limit, start_time)` deve chamar futures_klines
+        (start_time None = candles mais recentes).
+        """
+        interval_ms = INTERVAL_MS[interval]
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        series = self._get_series(symbol, interval)
+        with series.lock:
+            stored_count = series.count
+            last = series.last_record()
+
+        missing_candles = None
+        if last is not None:
+            last_open_time, last_close_time = last[0], last[6]
+            if series.last_complete:
+                start_time = last_close_time + 1 # Último candle armazenado já estava fechado
+            else:
+                start_time = last_open_time # Último candle foi baixado em formação: substitui
+            missing_candles = (now_ms - start_time) // interval_ms + 1
+
+        if last is None or stored_count < min_count or missing_candles > KLINE_FETCH_LIMIT * 2:
+            # Sem histórico utilizável: baixa a janela completa mais recente
+            klines = fetch_klines(symbol, interval, min(max(min_count, 1), KLINE_FETCH_LIMIT), None)
+            if klines:
+                with series.lock:
+                    series.data = bytearray()
+                    with open(series.path, 'wb'):
+                        pass
+                self.merge_klines(symbol, interval, klines)
+                series.last_complete = int(klines[-1][6]) < now_ms
+            return len(klines) if klines else 0
+
+        fetched = 0
+        while True:
+            klines = fetch_klines(symbol, interval, min(missing_candles, KLINE_FETCH_LIMIT), start_time)
+            if not klines:
+                break
+            fetched += self.merge_klines(symbol, interval, klines)
+            last_close_time = int(klines[-1][6])
+            series.last_complete = last_close_time < now_ms
+            if len(klines) < KLINE_FETCH_LIMIT or last_close_time >= now_ms:
+                break
+            start_time = last_close_time + 1
+            missing_candles = (now_ms - start_time) // interval_ms + 1
+        return fetched
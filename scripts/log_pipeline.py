@@ -0,0 +1,364 @@
+"""
+Pipeline de logs assíncrono: as threads do bot só enfileiram o registro, e uma thread
+dedicada grava JSON (uma linha por registro) em arquivo com rotação por tamanho e por dia,
+compactando os arquivos antigos com gzip.
+
+Campos estruturados são passados via `extra`, por exemplo:
+  logger.info("[SINAL] %s: Sinal de COMPRA", symbol, extra={'symbol': symbol, 'event': 'signal_long'})
+Com mensagens no estilo %, a interpolação só acontece se o nível estiver habilitado.
+"""
+import atexit
+import copy
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+from collections import deque
+
+LOG_DIR = 'logs'
+BOT_LOG_FILE = 'bot_activity.log' # Lido pelo endpoint /logs do backend
+BACKEND_LOG_FILE = 'backend_api.log'
+WORKER_LOG_DIR = 'workers' # Subdiretório de LOG_DIR com um arquivo por processo filho (<arquivo>.<pid>.log)
+LOG_MAX_BYTES = 20 * 1024 * 1024 # Rotação por tamanho (além da rotação diária)
+LOG_BACKUP_COUNT = 14 # Arquivos rotacionados (.1.gz, .2.gz...) mantidos
+LOG_QUEUE_SIZE = 10000 # Registros pendentes antes de começar a descartar
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FIELDS = ('symbol', 'event', 'latency_ms', 'order_id') # Campos estruturados aceitos via `extra`
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_BUFFER_SIZE = 2000 # Registros recentes mantidos em memória pelo LogFollower
+LOG_FOLLOW_INTERVAL_SECONDS = 0.5 # Intervalo de verificação de novas linhas no arquivo
+TAIL_BLOCK_SIZE = 64 * 1024 # Bloco lido por vez, de trás para frente, por tail_lines
+
+_listener = None
+_LEVEL_NUMBERS = {name: logging.getLevelName(name) for name in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')}
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro: ts, level, logger, msg, campos de LOG_FIELDS presentes e exc."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def parse_log_line(line):
+    """Registro (dicionário) de uma linha do log; aceita JSON e o formato de texto antigo."""
+    line = line.rstrip('\n')
+    try:
+        entry = json.loads(line)
+        if isinstance(entry, dict) and 'msg' in entry:
+            return entry
+    except ValueError:
+        pass
+    parts = line.split(' - ', 2)
+    if len(parts) == 3 and parts[1] in _LEVEL_NUMBERS:
+        return {'ts': parts[0], 'level': parts[1], 'msg': parts[2]}
+    return {'ts': None, 'level': 'INFO', 'msg': line}
+
+
+def format_log_record(entry):
+    """Registro no formato de texto antigo ("data - NÍVEL - mensagem") exibido pelo painel."""
+    if not entry.get('ts'):
+        return entry['msg']
+    return f"{entry['ts'].replace('T', ' ').replace('.', ',')} - {entry['level']} - {entry['msg']}"
+
+
+def format_log_line(line):
+    return format_log_record(parse_log_line(line))
+
+
+def record_matches(entry, level=None, symbol=None):
+    """Filtro por nível mínimo (ex.: 'WARNING' inclui ERROR) e por símbolo (campo estruturado ou texto)."""
+    if level is not None and _LEVEL_NUMBERS.get(entry.get('level'), logging.INFO) < _LEVEL_NUMBERS.get(level.upper(), 0):
+        return False
+    if symbol is not None and entry.get('symbol') != symbol and symbol not in entry['msg']:
+        return False
+    return True
+
+
+def _tail(f, count, end, block_size):
+    """(últimas `count` linhas completas antes de `end`, posição logo após a última linha completa)."""
+    position = end
+    data = b''
+    while position > 0 and data.count(b'\n') <= count:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        data = f.read(read_size) + data
+    complete_end = end
+    if data and not data.endswith(b'\n'):
+        # Linha ainda sendo escrita: fica para quem continuar lendo a partir de complete_end
+        partial = data[data.rfind(b'\n') + 1:]
+        complete_end -= len(partial)
+        data = data[:len(data) - len(partial)]
+    lines = data.splitlines()
+    if position > 0:
+        lines = lines[1:] # A primeira linha do bloco pode estar cortada
+    return [line.decode('utf-8', errors='replace') for line in lines[-count:]] if count else [], complete_end
+
+
+def tail_lines(path, count, block_size=TAIL_BLOCK_SIZE):
+    """Últimas `count` linhas do arquivo, lidas em blocos a partir do fim: o custo não depende do tamanho do arquivo."""
+    with open(path, 'rb') as f:
+        return _tail(f, count, f.seek(0, os.SEEK_END), block_size)[0]
+
+
+class LogFollower:
+    """
+    Acompanha um arquivo de log (como `tail -F`) numa thread: mantém os últimos registros num
+    buffer circular e repassa cada registro novo aos ouvintes. Na partida só o fim do arquivo é
+    lido; rotações (arquivo recriado ou truncado) são detectadas e o novo arquivo é lido do início.
+    """
+
+    def __init__(self, path, buffer_size=LOG_BUFFER_SIZE, poll_interval=LOG_FOLLOW_INTERVAL_SECONDS):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._records = deque(maxlen=buffer_size)
+        self._next_id = 1
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b''
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._load_tail()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._follow, name='log-follower', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def buffer_size(self):
+        return self._records.maxlen
+
+    def add_listener(self, callback):
+        """Registra `callback(registro)`, chamado na thread do follower a cada registro novo."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def get_records(self, level=None, symbol=None, limit=100, after_id=None):
+        """Os `limit` registros mais recentes do buffer que passam pelos filtros, em ordem cronológica."""
+        with self._lock:
+            records = list(self._records)
+        selected = []
+        for entry in reversed(records):
+            if len(selected) >= limit or (after_id is not None and entry['id'] <= after_id):
+                break
+            if record_matches(entry, level, symbol):
+                selected.append(entry)
+        selected.reverse()
+        return selected
+
+    # --- Leitura do arquivo ---
+    def _load_tail(self):
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                lines, self._offset = _tail(f, self._records.maxlen, stat.st_size, TAIL_BLOCK_SIZE)
+                self._inode = stat.st_ino
+        except FileNotFoundError:
+            return
+        with self._lock:
+            for line in lines:
+                self._append(line)
+
+    def _append(self, line):
+        entry = parse_log_line(line)
+        entry['id'] = self._next_id
+        self._next_id += 1
+        self._records.append(entry)
+        return entry
+
+    def _read_new_lines(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Arquivo rotacionado: o novo é lido desde o início
+            self._inode = stat.st_ino
+            self._offset = 0
+            self._partial = b''
+        if stat.st_size == self._offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = self._partial + f.read(stat.st_size - self._offset)
+        self._offset = stat.st_size
+        lines = data.split(b'\n')
+        self._partial = lines.pop() # Resto sem quebra de linha: completado na próxima leitura
+        return [line.decode('utf-8', errors='replace') for line in lines if line]
+
+    def _follow(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                lines = self._read_new_lines()
+            except OSError:
+                continue
+            if not lines:
+                continue
+            with self._lock:
+                entries = [self._append(line) for line in lines]
+                listeners = list(self._listeners)
+            for entry in entries:
+                for listener in listeners:
+                    listener(entry)
+
+
+class RotatingCompressedFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler que também rotaciona na virada do dia e compacta os arquivos rotacionados."""
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, delay=False):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=delay)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+        self._current_date = self._file_date()
+
+    def _file_date(self):
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            return datetime.date.fromtimestamp(os.path.getmtime(self.baseFilename))
+        return datetime.date.today()
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if datetime.date.fromtimestamp(record.created) != self._current_date:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._current_date = datetime.date.today()
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enfileira sem nunca bloquear quem loga: com a fila cheia o registro é descartado e contado.
+    Na thread que loga só a mensagem é interpolada; o JSON e a escrita ficam com o listener.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # O traceback referencia frames da thread que logou: é formatado antes de enfileirar
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(file_name=BOT_LOG_FILE, log_dir=LOG_DIR, level=LOG_LEVEL, console=True):
+    """
+    Configura o logger raiz com o pipeline assíncrono (arquivo JSON com rotação + console em texto).
+    Pode ser chamada de novo para trocar o arquivo; o listener anterior é esvaziado e encerrado.
+    """
+    global _listener
+    os.makedirs(log_dir, exist_ok=True)
+    _stop_listener()
+    if _listener is not None:
+        for handler in _listener.handlers:
+            handler.close()
+
+    file_handler = RotatingCompressedFileHandler(os.path.join(log_dir, file_name))
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop() # Grava o que ainda estiver na fila
+
+
+def _worker_file_handler(parent_handler):
+    """Handler do processo filho: mesmo formato e nível do pai, num arquivo só deste processo (criado no primeiro registro)."""
+    directory, file_name = os.path.split(parent_handler.baseFilename)
+    stem, extension = os.path.splitext(file_name)
+    worker_dir = os.path.join(directory, WORKER_LOG_DIR)
+    os.makedirs(worker_dir, exist_ok=True)
+    handler = RotatingCompressedFileHandler(os.path.join(worker_dir, f"{stem}.{os.getpid()}{extension}"), delay=True)
+    handler.setFormatter(parent_handler.formatter)
+    handler.setLevel(parent_handler.level)
+    return handler
+
+
+def _use_direct_handlers_in_child():
+    # Processos filhos (ProcessPoolExecutor) não herdam a thread do listener e podem sair sem
+    # rodar o atexit: neles os handlers gravam diretamente, sem fila. O arquivo com rotação do
+    # pai é trocado por um arquivo próprio do filho, porque vários processos rotacionando e
+    # compactando o mesmo arquivo perdem ou misturam registros
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.handlers = [handler for handler in root.handlers if not isinstance(handler, NonBlockingQueueHandler)]
+    for handler in _listener.handlers:
+        if isinstance(handler, RotatingCompressedFileHandler):
+            handler = _worker_file_handler(handler)
+        root.addHandler(handler)
+    _listener = None
+
+
+atexit.register(_stop_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_use_direct_handlers_in_child)
@@ -1,47 +1,35 @@
 import os
 import time
+from time import perf_counter
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from requests.exceptions import ConnectionError
 from dotenv import load_dotenv
 import json
 import sys
-import decimal
 import statistics 
 import math 
-from functools import wraps
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import logging # Importa o módulo de logging
+from binance_scheduler import BinanceRequestScheduler, ScheduledClient, PRIORITY_SCAN, is_rate_limit_error
+from kline_store import INTERVAL_MS, KlineStore
+from market_stream import MarketDataTable, MarketStream
+from order_book import DEPTH_SNAPSHOT_LIMIT, OrderBookStream
+from symbol_registry import SymbolRegistry
+from user_stream import OrderTracker, UserDataStream
+from indicators import IndicatorEngine, OHLC_CLOSE, batch_indicators, klines_to_ohlc
+from metrics import METRICS_SNAPSHOT_PATH, REGISTRY as METRICS_REGISTRY, histogram
+from log_pipeline import BOT_LOG_FILE, setup_logging
+from state_store import StateStore
+from strategy import (CONFIG_FILE_PATH, KLINE_INTERVAL_MAP, SIGNAL_INVALID_LEVELS, SIGNAL_LONG, SIGNAL_LOW_VOLATILITY, SIGNAL_NONE,
+                      calcular_quantidade_ordem, calculate_min_atr_threshold, evaluate_long_signal)
+from watchlist import Watchlist
 
 # --- Configuração de Logging ---
-# Garante que o diretório de logs exista
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# Configura o logger raiz
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Limpa quaisquer handlers existentes para evitar duplicação ou conflitos
-if logger.hasHandlers():
-    logger.handlers.clear()
-
-# Configura o FileHandler para salvar logs em um arquivo com UTF-8
-file_handler = logging.FileHandler(os.path.join(log_dir, 'bot_activity.log'), mode='a', encoding='utf-8')
-file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
-
-# Configura o StreamHandler para exibir logs no console com UTF-8
-# Usa sys.stdout para garantir que a saída vá para o console padrão
-console_handler = logging.StreamHandler(sys.stdout)
-console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(console_formatter)
-console_handler.encoding = 'utf-8' # <--- ESTA É A LINHA CRÍTICA PARA UTF-8 NO CONSOLE
-logger.addHandler(console_handler)
-
-# Define o logger específico para o módulo (se você usa o __name__)
-# Isso garante que todas as mensagens do seu código usem esta configuração
+# Registros em JSON gravados por uma thread dedicada: quem loga só enfileira (rotação diária/por tamanho, com gzip)
+setup_logging(BOT_LOG_FILE)
 logger = logging.getLogger(__name__)
 
 
@@ -52,11 +40,21 @@ API_SECRET = os.getenv("BINANCE_API_SECRET")
 
 # --- Variáveis globais do bot ---
 client = None
-CONFIG_FILE_PATH = "config/settings.json"
-SYMBOL_INFO = {} 
-LEVERAGE_SET_FOR_SYMBOL = {} 
-OPEN_POSITIONS = {} 
+SYMBOL_INFO = SymbolRegistry(lambda: client.futures_exchange_info()) # Filtros por símbolo, com TTL, cache negativo e snapshot em disco
+STATE_STORE = StateStore() # Posições e alavancagens gravadas em SQLite e restauradas na partida
+LEVERAGE_SET_FOR_SYMBOL = STATE_STORE.leverage # símbolo -> alavancagem já definida na exchange
+MARGIN_TYPE_SET_FOR_SYMBOL = STATE_STORE.margin_types # símbolo -> tipo de margem ('ISOLATED'/'CROSSED') na exchange
+OPEN_POSITIONS = STATE_STORE.positions # símbolo -> posição aberta pelo bot, com os IDs das ordens de entrada e SL/TP
 TIME_OFFSET_MS = 0 
+REQUEST_SCHEDULER = BinanceRequestScheduler() # Agendador central de peso das requisições REST (mantido entre reconexões)
+KLINE_STORE = KlineStore() # Cache local e persistente de klines por (símbolo, intervalo)
+INDICATOR_ENGINE = IndicatorEngine(KLINE_STORE) # EMA/ATR incrementais por (símbolo, intervalo)
+MARKET_DATA = MarketDataTable() # Último candle e último preço de marcação recebidos via websocket
+MARKET_STREAM = None # Ingestão dos streams de kline/markPrice (iniciada após a varredura)
+DEPTH_STREAM = None # Livros de ofertas locais dos símbolos monitorados (iniciado junto com o MARKET_STREAM)
+WATCHLIST = Watchlist() # Símbolos monitorados, renovados por varreduras em segundo plano
+ORDER_TRACKER = OrderTracker() # Estado das ordens recebido pelo user data stream
+USER_STREAM = None # User data stream (apenas no modo real)
 
 # --- Configurações para Reconexão, Monitoramento de Ordens e Retries ---
 RECONNECT_INTERVAL_SECONDS = 10 # Intervalo para tentar reconectar à API
@@ -64,7 +62,28 @@ ORDER_MONITOR_INTERVAL_SECONDS = 2 # Intervalo para verificar o status de ordens
 ORDER_FILL_TIMEOUT_SECONDS = 60 # Tempo máximo para uma ordem ser preenchida
 MAX_RETRIES = 3 # Número máximo de tentativas para chamadas de API
 RETRY_DELAY_SECONDS = 2 # Atraso inicial entre as tentativas de retry
-CYCLE_SLEEP_SECONDS = 6 # Tempo de espera entre os ciclos principais do bot
+CYCLE_SLEEP_SECONDS = 6 # Tempo de espera após um erro inesperado no ciclo principal
+PROTECTION_CHECK_INTERVAL_SECONDS = 10 # Intervalo das verificações de proteção das posições entre fechamentos de candle
+CANDLE_CLOSE_GRACE_MS = 1500 # Espera após o fechamento do candle para o candle fechado chegar (websocket/REST)
+
+# --- Configurações da Varredura Concorrente de Mercado ---
+SCAN_MAX_WORKERS = 8 # Número máximo de requisições de klines simultâneas durante a varredura
+PREFLIGHT_MAX_WORKERS = 8 # Ajustes de alavancagem/margem simultâneos antes de começar a operar
+MARGIN_TYPE_NAMES = {'isolated': 'ISOLATED', 'cross': 'CROSSED'} # marginType do position risk -> parâmetro de futures_change_margin_type
+LAST_SCAN_DURATION_SECONDS = None # Duração da última varredura concluída
+EXECUTION_MAX_WORKERS = 8 # Número máximo de símbolos processados em paralelo em cada ciclo
+MAX_CONCURRENT_ENTRIES = 2 # Número máximo de entradas (ordem + SL/TP) em andamento ao mesmo tempo
+ENTRY_SEMAPHORE = threading.BoundedSemaphore(MAX_CONCURRENT_ENTRIES)
+SYMBOL_LOCKS = {} # símbolo -> Lock que protege OPEN_POSITIONS[símbolo]
+SYMBOL_LOCKS_GUARD = threading.Lock()
+
+# --- Métricas de latência (gravadas em disco e expostas pelo backend em /metrics) ---
+SCAN_DURATION = histogram('bot_scan_duration_seconds', 'Duração da varredura e seleção de símbolos')
+CYCLE_DURATION = histogram('bot_cycle_duration_seconds', 'Duração do ciclo de análise e execução no fechamento do candle')
+SIGNAL_CHECK_DURATION = histogram('bot_signal_check_duration_seconds', 'Duração de check_entry_signal por símbolo')
+SIGNAL_TO_ORDER_LATENCY = histogram('bot_signal_to_order_seconds', 'Tempo entre o sinal de entrada e o aceite da ordem pela Binance')
+ORDER_FILL_LATENCY = histogram('bot_order_fill_seconds', 'Tempo entre o envio da ordem a mercado e a confirmação do preenchimento', ('source',))
+PROTECTION_PLACEMENT_LATENCY = histogram('bot_protection_placement_seconds', 'Duração do envio das ordens de SL/TP', ('outcome',))
 
 # --- Decorador para adicionar lógica de retry a chamadas de API ---
 def retry_api_call(max_retries=MAX_RETRIES, delay=RETRY_DELAY_SECONDS):
@@ -75,18 +94,38 @@ def retry_api_call(max_retries=MAX_RETRIES, delay=RETRY_DELAY_SECONDS):
                 try:
                     return func(*args, **kwargs)
                 except (ConnectionError, BinanceAPIException) as e:
-                    logger.warning(f"[RETRY] Tentativa {i+1}/{max_retries} falhou para {func.__name__}: {e}")
+                    logger.warning("[RETRY] Tentativa %s/%s falhou para %s: %s", i + 1, max_retries, func.__name__, e)
                     if i < max_retries - 1:
+                        if is_rate_limit_error(e):
+                            # O agendador já retém as requisições até o fim do Retry-After; não soma espera extra
+                            continue
                         time.sleep(delay * (2 ** i)) # Atraso exponencial
                     else:
-                        logger.error(f"[RETRY] Todas as tentativas falharam para {func.__name__}. Erro: {e}")
+                        logger.error("[RETRY] Todas as tentativas falharam para %s. Erro: %s", func.__name__, e)
                         raise # Re-lança a exceção após todas as tentativas
                 except Exception as e:
-                    logger.error(f"[ERRO] Erro inesperado em {func.__name__}: {e}")
+                    logger.error("[ERRO] Erro inesperado em %s: %s", func.__name__, e)
                     raise # Re-lança exceções inesperadas
         return wrapper
     return decorator
 
+# --- Funções de tempo alinhadas ao relógio do servidor da Binance ---
+def get_server_time_ms():
+    return int(time.time() * 1000) + TIME_OFFSET_MS
+
+def next_candle_close_ms(interval_ms, server_time_ms):
+    """Instante (ms, horário do servidor) em que o candle atual do intervalo fecha."""
+    return (server_time_ms // interval_ms + 1) * interval_ms
+
+# --- Função para obter o lock de um símbolo (serializa o processamento e as alterações em OPEN_POSITIONS) ---
+def get_symbol_lock(symbol):
+    with SYMBOL_LOCKS_GUARD:
+        lock = SYMBOL_LOCKS.get(symbol)
+        if lock is None:
+            lock = threading.Lock()
+            SYMBOL_LOCKS[symbol] = lock
+        return lock
+
 # --- Função para inicializar o cliente Binance de forma robusta e sincronizar o tempo ---
 def initialize_binance_client():
     global client, TIME_OFFSET_MS
@@ -97,7 +136,7 @@ def initialize_binance_client():
         return False
 
     try:
-        temp_client = Client(API_KEY, API_SECRET)
+        temp_client = ScheduledClient(API_KEY, API_SECRET, scheduler=REQUEST_SCHEDULER)
         temp_client.futures_ping() # Testa a conexão
         client = temp_client # Atribui o cliente globalmente
         
@@ -110,7 +149,7 @@ def initialize_binance_client():
         logger.info("[INFO] Cliente Binance Futures inicializado e conectado com sucesso.")
         return True
     except Exception as e:
-        logger.critical(f"[ERRO CRÍTICO] Falha ao inicializar ou conectar o cliente Binance Futures: {e}")
+        logger.critical("[ERRO CRÍTICO] Falha ao inicializar ou conectar o cliente Binance Futures: %s", e)
         logger.critical("Verifique suas chaves de API e sua conexão com a internet.")
         client = None
         return False
@@ -122,51 +161,17 @@ def load_config_from_json():
             config = json.load(f)
             return config
     except FileNotFoundError:
-        logger.critical(f"[ERRO CRÍTICO] Arquivo de configuração '{CONFIG_FILE_PATH}' não encontrado.")
+        logger.critical("[ERRO CRÍTICO] Arquivo de configuração '%s' não encontrado.", CONFIG_FILE_PATH)
         logger.critical("O bot não pode operar sem as configurações. Por favor, crie a pasta 'config' e o arquivo 'settings.json' dentro dela.")
         return None
     except json.JSONDecodeError as e:
-        logger.critical(f"[ERRO CRÍTICO] Erro ao decodificar JSON em '{CONFIG_FILE_PATH}': {e}")
+        logger.critical("[ERRO CRÍTICO] Erro ao decodificar JSON em '%s': %s", CONFIG_FILE_PATH, e)
         logger.critical("Verifique a sintaxe do seu seu arquivo 'settings.json'.")
         return None
     except Exception as e:
-        logger.critical(f"[ERRO CRÍTICO] Ocorreu um erro inesperado ao carregar o arquivo de configuração: {e}")
+        logger.critical("[ERRO CRÍTICO] Ocorreu um erro inesperado ao carregar o arquivo de configuração: %s", e)
         return None
 
-# --- Função para obter informações de precisão dos símbolos da Binance ---
-@retry_api_call()
-def get_exchange_info():
-    global SYMBOL_INFO
-    if client is None:
-        logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível obter informações da exchange.")
-        return
-    info = client.futures_exchange_info()
-    for s in info['symbols']:
-        if s['contractType'] == 'PERPETUAL' and s['status'] == 'TRADING':
-            lot_size_filter = next((f for f in s['filters'] if f['filterType'] == 'LOT_SIZE'), None)
-            price_filter = next((f for f in s['filters'] if f['filterType'] == 'PRICE_FILTER'), None)
-            min_notional_filter = next((f for f in s['filters'] if f['filterType'] == 'MIN_NOTIONAL'), None)
-            market_lot_size_filter = next((f for f in s['filters'] if f['filterType'] == 'MARKET_LOT_SIZE'), None) 
-
-            if lot_size_filter and price_filter and min_notional_filter and market_lot_size_filter:
-                quantity_precision = -decimal.Decimal(lot_size_filter['stepSize']).normalize().as_tuple().exponent
-                if quantity_precision < 0: quantity_precision = 0
-                price_precision = -decimal.Decimal(price_filter['tickSize']).normalize().as_tuple().exponent
-                if price_precision < 0: price_precision = 0
-
-                SYMBOL_INFO[s['symbol']] = {
-                    'quantity_precision': quantity_precision,
-                    'price_precision': price_precision,
-                    'min_qty': float(lot_size_filter['minQty']),
-                    'max_qty': float(lot_size_filter['maxQty']),
-                    'min_price': float(price_filter['minPrice']),
-                    'max_price': float(price_filter['maxPrice']), 
-                    'step_size': float(lot_size_filter['stepSize']),
-                    'min_notional': float(min_notional_filter['notional']),
-                    'market_max_qty': float(market_lot_size_filter['maxQty']) 
-                }
-    logger.info("[INFO] Informações de precisão dos símbolos carregadas com sucesso da Binance.")
-
 # --- Função para mostrar o saldo de USDT na conta Futures ---
 @retry_api_call()
 def mostrar_saldo():
@@ -178,74 +183,47 @@ def mostrar_saldo():
     for ativo in info:
         if ativo["asset"] == "USDT":
             available_balance = float(ativo['availableBalance'])
-            logger.info(f"💰 Saldo Futures USDT: Total = {ativo['balance']} | Disponível = {available_balance}")
+            logger.info("💰 Saldo Futures USDT: Total = %s | Disponível = %s", ativo['balance'], available_balance)
             return available_balance
     logger.warning("[AVISO] Saldo USDT não encontrado na conta Futures.")
     return 0.0
 
+# --- Função para registrar o orçamento de peso e a fila do agendador de requisições ---
+def log_request_budget():
+    status = REQUEST_SCHEDULER.get_status()
+    logger.info("[RATE LIMIT] Peso disponível: %.0f/%.0f | Usado (Binance, 1m): %s | Fila: %s | Bloqueio: %ss", status['available_weight'], status['capacity'], status['used_weight_1m'], status['queue_depth'], status['blocked_for_seconds'])
+    return status
+
 # --- Função robusta para obter o preço de mercado atual ---
 def get_current_market_price(symbol_name, max_retries=MAX_RETRIES, delay=RETRY_DELAY_SECONDS):
     global client
     for i in range(max_retries):
         try:
+            # Preço de marcação recebido pelo websocket dispensa a requisição REST
+            streamed_price = MARKET_DATA.get_price(symbol_name)
+            if streamed_price is not None:
+                return streamed_price
+
             if not isinstance(client, Client) or not hasattr(client, 'futures_ticker_price'):
-                logger.warning(f"[RECUPERAÇÃO] Cliente Binance não está pronto para obter preço. Tentando re-inicializar ({i+1}/{max_retries})...")
+                logger.warning("[RECUPERAÇÃO] Cliente Binance não está pronto para obter preço. Tentando re-inicializar (%s/%s)...", i + 1, max_retries)
                 if not initialize_binance_client():
-                    logger.error(f"[ERRO] Falha ao re-inicializar cliente para obter preço para {symbol_name}.")
+                    logger.error("[ERRO] Falha ao re-inicializar cliente para obter preço para %s.", symbol_name)
                     if i < max_retries - 1:
                         time.sleep(delay)
                     continue
                 else:
-                    logger.info(f"[INFO] Cliente Binance re-inicializado com sucesso para obter preço.")
+                    logger.info("[INFO] Cliente Binance re-inicializado com sucesso para obter preço.")
                     time.sleep(1) 
 
             ticker_price = client.futures_ticker_price(symbol=symbol_name)
             return float(ticker_price['price'])
         except Exception as e:
-            logger.warning(f"[AVISO] Falha ao obter preço de mercado para {symbol_name} (tentativa {i+1}/{max_retries}): {e}. Tentando novamente.")
+            logger.warning("[AVISO] Falha ao obter preço de mercado para %s (tentativa %s/%s): %s. Tentando novamente.", symbol_name, i + 1, max_retries, e)
             if i < max_retries - 1:
                 time.sleep(delay)
-    logger.error(f"[ERRO] Não foi possível obter o preço de mercado para {symbol_name} após {max_retries} tentativas.")
+    logger.error("[ERRO] Não foi possível obter o preço de mercado para %s após %s tentativas.", symbol_name, max_retries)
     return None
 
-# --- Funções de Indicadores Técnicos ---
-def calculate_ema(prices, period):
-    if len(prices) < period:
-        return None
-    ema = [0.0] * len(prices)
-    ema[period - 1] = sum(prices[:period]) / period
-    multiplier = 2 / (period + 1)
-    for i in range(period, len(prices)):
-        ema[i] = ((prices[i] - ema[i-1]) * multiplier) + ema[i-1]
-    return ema[-1] 
-
-def calculate_atr(klines, period):
-    if len(klines) < period:
-        return None
-    
-    true_ranges = []
-    for i in range(1, len(klines)):
-        high = float(klines[i][2])
-        low = float(klines[i][3])
-        prev_close = float(klines[i-1][4])
-        
-        tr1 = high - low
-        tr2 = abs(high - prev_close)
-        tr3 = abs(low - prev_close)
-        true_ranges.append(max(tr1, tr2, tr3))
-    
-    if len(true_ranges) < period:
-        return None
-
-    atr_values = [0.0] * len(true_ranges)
-    atr_values[period - 1] = sum(true_ranges[:period]) / period 
-    
-    multiplier = 2 / (period + 1)
-    for i in range(period, len(true_ranges)):
-        atr_values[i] = ((true_ranges[i] - atr_values[i-1]) * multiplier) + atr_values[i-1]
-        
-    return atr_values[-1] 
-
 # --- Função para obter todos os símbolos de Futuros USDT ---
 @retry_api_call()
 def get_all_usdt_futures_symbols():
@@ -254,218 +232,256 @@ def get_all_usdt_futures_symbols():
         return []
     
     try:
-        exchange_info = client.futures_exchange_info()
-        usdt_symbols = []
-        for s in exchange_info['symbols']:
-            if s['symbol'].endswith('USDT') and s['contractType'] == 'PERPETUAL' and s['status'] == 'TRADING':
-                usdt_symbols.append(s['symbol'])
-        logger.info(f"[INFO] Encontrados {len(usdt_symbols)} pares USDT perpétuos negociáveis.")
+        # Usa o registro de símbolos (snapshot em disco ou o mesmo download usado para os filtros)
+        SYMBOL_INFO.ensure_loaded()
+        usdt_symbols = SYMBOL_INFO.usdt_perpetual_symbols()
+        logger.info("[INFO] Encontrados %s pares USDT perpétuos negociáveis.", len(usdt_symbols))
         return usdt_symbols
     except Exception as e:
-        logger.error(f"[ERRO] Falha ao obter todos os símbolos de Futuros USDT: {e}")
+        logger.error("[ERRO] Falha ao obter todos os símbolos de Futuros USDT: %s", e)
         return []
 
+# --- Funções de acesso a klines via cache local incremental ---
+def fetch_klines_from_exchange(symbol, interval, limit, start_time=None):
+    params = {'symbol': symbol, 'interval': interval, 'limit': limit}
+    if start_time is not None:
+        params['startTime'] = start_time
+    return client.futures_klines(**params)
+
+def get_klines_cached(symbol, kline_interval_str, required_klines_count):
+    """Atualiza o cache local apenas com os candles novos e retorna a janela pedida sem baixar o histórico novamente."""
+    # Com o websocket ativo para o símbolo (e sem lacuna pendente) o cache já está atualizado: nenhuma requisição é necessária
+    if MARKET_STREAM is not None and MARKET_STREAM.covers(symbol, kline_interval_str) and \
+       not MARKET_STREAM.needs_backfill(symbol) and KLINE_STORE.count(symbol, kline_interval_str) >= required_klines_count:
+        return KLINE_STORE.get_klines(symbol, kline_interval_str, required_klines_count)
+
+    server_time_ms = get_server_time_ms()
+    KLINE_STORE.update(symbol, kline_interval_str, required_klines_count, fetch_klines_from_exchange, now_ms=server_time_ms)
+    return KLINE_STORE.get_klines(symbol, kline_interval_str, required_klines_count)
+
+# --- Livro de ofertas: snapshot REST e livro local mantido pelo stream de profundidade ---
+def fetch_order_book_snapshot(symbol, limit=DEPTH_SNAPSHOT_LIMIT):
+    # Ressincronização do livro: prioridade baixa, para não disputar o peso com as ordens
+    with REQUEST_SCHEDULER.priority(PRIORITY_SCAN):
+        return client.futures_order_book(symbol=symbol, limit=limit)
+
+def get_order_book(symbol):
+    """
+    Livro local do símbolo mantido pelo stream de profundidade, ou None se ele não estiver sincronizado e
+    recente (stream desligado ou reconectando). Sem livro, a quantidade é dimensionada sem o limite de
+    liquidez: o caminho de entrada nunca faz uma chamada REST de profundidade.
+    """
+    book = DEPTH_STREAM.get_book(symbol) if DEPTH_STREAM is not None else None
+    if book is None:
+        logger.debug("[LIQUIDEZ] %s: Livro local indisponível. Dimensionando sem limite de liquidez.", symbol,
+                     extra={'symbol': symbol, 'event': 'order_book_unavailable'})
+    return book
+
+# --- Preenchimento via REST das lacunas do stream (sempre consulta a exchange, mesmo com o stream conectado) ---
+def backfill_klines(symbol, kline_interval_str, required_klines_count):
+    KLINE_STORE.update(symbol, kline_interval_str, required_klines_count, fetch_klines_from_exchange, now_ms=get_server_time_ms())
+
+# --- Função para iniciar (ou atualizar) a ingestão de klines e preços via websocket ---
+def start_market_stream(symbols, kline_interval_str, required_klines_count):
+    global MARKET_STREAM, DEPTH_STREAM
+
+    if MARKET_STREAM is None:
+        backfill = partial(backfill_klines, kline_interval_str=kline_interval_str, required_klines_count=required_klines_count)
+        MARKET_STREAM = MarketStream(symbols, MARKET_DATA, kline_interval=kline_interval_str,
+                                     kline_store=KLINE_STORE, backfill=backfill)
+        MARKET_STREAM.start()
+        logger.info("[STREAM] Ingestão de klines (%s) e preços de marcação iniciada para %s.", kline_interval_str, symbols)
+    else:
+        MARKET_STREAM.update_symbols(symbols)
+    if DEPTH_STREAM is None:
+        DEPTH_STREAM = OrderBookStream(symbols, fetch_order_book_snapshot)
+        DEPTH_STREAM.start()
+    else:
+        DEPTH_STREAM.update_symbols(symbols)
+    return MARKET_STREAM
+
+# --- Função para baixar klines da varredura com prioridade baixa no agendador ---
+def fetch_scan_klines(symbol, kline_interval_str, required_klines_count):
+    with REQUEST_SCHEDULER.priority(PRIORITY_SCAN):
+        return get_klines_cached(symbol, kline_interval_str, required_klines_count)
+
+# --- Pré-filtro da varredura: estatísticas de 24h e melhor bid/ask de todos os símbolos em duas requisições ---
+@retry_api_call()
+def fetch_market_overview():
+    with REQUEST_SCHEDULER.priority(PRIORITY_SCAN):
+        return client.futures_ticker(), client.futures_orderbook_ticker()
+
+def prefilter_scan_candidates(symbols, min_quote_volume_usdt=0, max_price_change_percent=0, max_spread_percent=0, top_k=0):
+    """
+    Descarta, antes de baixar qualquer kline, os pares com volume de 24h abaixo do mínimo, variação
+    de 24h extrema ou spread largo, e mantém os `top_k` de maior volume. Limites iguais a 0 ficam
+    desativados. Os símbolos retornados mantêm a ordem original (desempate da ordenação por ATR).
+    """
+    tickers, book = fetch_market_overview()
+    tickers_by_symbol = {ticker['symbol']: ticker for ticker in tickers}
+    book_by_symbol = {entry['symbol']: entry for entry in book}
+
+    candidates = []
+    for symbol in symbols:
+        ticker = tickers_by_symbol.get(symbol)
+        if ticker is None:
+            continue # Sem negociação nas últimas 24h
+        quote_volume = float(ticker['quoteVolume'])
+        if min_quote_volume_usdt and quote_volume < min_quote_volume_usdt:
+            continue
+        if max_price_change_percent and abs(float(ticker['priceChangePercent'])) > max_price_change_percent:
+            continue
+        entry = book_by_symbol.get(symbol)
+        if max_spread_percent and entry is not None:
+            bid, ask = float(entry['bidPrice']), float(entry['askPrice'])
+            if bid <= 0 or (ask - bid) / ((ask + bid) / 2) * 100 > max_spread_percent:
+                continue
+        candidates.append((symbol, quote_volume))
+
+    if top_k and len(candidates) > top_k:
+        top_symbols = {symbol for symbol, _ in sorted(candidates, key=lambda item: item[1], reverse=True)[:top_k]}
+        candidates = [(symbol, volume) for symbol, volume in candidates if symbol in top_symbols]
+    logger.info(f"[SCAN] Pré-filtro 24h: {len(candidates)} de {len(symbols)} pares seguem para a análise de klines "
+                f"(volume ≥ {min_quote_volume_usdt:,.0f} USDT, variação ≤ {max_price_change_percent}%, "
+                f"spread ≤ {max_spread_percent}%, top {top_k or 'todos'}).")
+    return [symbol for symbol, _ in candidates]
+
 # --- Função para varrer e selecionar os melhores símbolos ---
 @retry_api_call()
-def scan_and_select_best_symbols(kline_interval_minutes, kline_trend_period, kline_pullback_period, kline_atr_period, min_atr_multiplier_for_entry, max_symbols_to_monitor): 
-    global client
+def scan_and_select_best_symbols(kline_interval_minutes, kline_trend_period, kline_pullback_period, kline_atr_period, min_atr_multiplier_for_entry, max_symbols_to_monitor, prefilter=None): 
+    global client, LAST_SCAN_DURATION_SECONDS
+    scan_start_time = time.time()
     all_usdt_symbols = get_all_usdt_futures_symbols()
     if not all_usdt_symbols:
         logger.warning("[AVISO] Nenhuma lista de símbolos USDT disponível para varredura. Retornando lista vazia.")
         return []
 
-    selected_symbols_data = [] 
-    
-    kline_interval_map = {
-        1: Client.KLINE_INTERVAL_1MINUTE,
-        5: Client.KLINE_INTERVAL_5MINUTE,
-        15: Client.KLINE_INTERVAL_15MINUTE,
-        30: Client.KLINE_INTERVAL_30MINUTE,
-        60: Client.KLINE_INTERVAL_1HOUR,
-        240: Client.KLINE_INTERVAL_4HOUR,
-        1440: Client.KLINE_INTERVAL_1DAY
-    }
-    kline_interval_str = kline_interval_map.get(kline_interval_minutes)
+    kline_interval_str = KLINE_INTERVAL_MAP.get(kline_interval_minutes)
     
     required_klines_count = max(kline_trend_period, kline_pullback_period, kline_atr_period) + 2 
     
-    logger.info(f"\n--- Iniciando Varredura de Mercado para os Melhores Pares ({kline_interval_minutes}m Klines) ---")
-    logger.info(f"Critérios: Tendência de Alta, Volatilidade Suficiente (ATR).") 
+    logger.info("\n--- Iniciando Varredura de Mercado para os Melhores Pares (%sm Klines) ---", kline_interval_minutes)
+    logger.info("Critérios: Tendência de Alta, Volatilidade Suficiente (ATR).") 
 
+    # A lista de pares e os filtros vêm do mesmo registro: um par ausente aqui não tem filtros completos
+    symbols_to_scan = []
     for symbol in all_usdt_symbols:
-        try:
-            if symbol not in SYMBOL_INFO:
-                get_exchange_info() 
-                if symbol not in SYMBOL_INFO:
-                    logger.info(f"[SCAN] {symbol}: Informações de precisão não disponíveis. Pulando.")
-                    continue
+        if symbol not in SYMBOL_INFO:
+            logger.debug("[SCAN] %s: Informações de precisão não disponíveis. Pulando.", symbol, extra={'symbol': symbol, 'event': 'scan_skipped'})
+            continue
+        symbols_to_scan.append(symbol)
 
-            klines = client.futures_klines(symbol=symbol, interval=kline_interval_str, limit=required_klines_count)
-            if not klines or len(klines) < required_klines_count:
-                continue
-            
-            close_prices = [float(kline[4]) for kline in klines]
-            
-            ema_trend = calculate_ema(close_prices, kline_trend_period)
-            if ema_trend is None:
+    # Estágio barato: só os pares líquidos e com spread estreito seguem para o download de klines
+    if prefilter:
+        try:
+            symbols_to_scan = prefilter_scan_candidates(symbols_to_scan, **prefilter)
+        except Exception as e:
+            logger.warning("[AVISO] Falha no pré-filtro de 24h (%s). Analisando todos os %s pares.", e, len(symbols_to_scan))
+
+    # Baixa os klines em paralelo; a ordem original dos símbolos é mantida para o desempate da ordenação
+    scan_klines = [None] * len(symbols_to_scan)
+
+    with ThreadPoolExecutor(max_workers=SCAN_MAX_WORKERS) as executor:
+        pending = {
+            executor.submit(fetch_scan_klines, symbol, kline_interval_str, required_klines_count): index
+            for index, symbol in enumerate(symbols_to_scan)
+        }
+        for future in as_completed(pending):
+            index = pending[future]
+            try:
+                klines = future.result()
+                if klines and len(klines) >= required_klines_count:
+                    scan_klines[index] = klines[-required_klines_count:]
+            except Exception as e:
+                logger.error("[ERRO SCAN] Falha ao analisar %s: %s", symbols_to_scan[index], e)
+
+    # Calcula EMA/ATR de todos os símbolos de uma vez (N símbolos x T candles)
+    scanned_indexes = [index for index, klines in enumerate(scan_klines) if klines is not None]
+    scan_results = []
+    if scanned_indexes:
+        ohlc = klines_to_ohlc([scan_klines[index] for index in scanned_indexes])
+        batch = batch_indicators(ohlc, kline_trend_period, kline_pullback_period, kline_atr_period)
+
+        for row, index in enumerate(scanned_indexes):
+            symbol = symbols_to_scan[index]
+            ema_trend = float(batch['ema_trend'][row])
+            atr = float(batch['atr'][row])
+            if math.isnan(ema_trend) or math.isnan(atr):
                 continue
 
-            current_price = float(klines[-1][4]) 
-
+            current_price = float(ohlc[row, -1, OHLC_CLOSE])
             is_uptrend = current_price > ema_trend
-            
-            atr = calculate_atr(klines, kline_atr_period)
-            if atr is None:
-                continue
-            
-            min_atr_threshold = SYMBOL_INFO[symbol]['step_size'] * 5 * min_atr_multiplier_for_entry
+            price_precision = SYMBOL_INFO[symbol]['price_precision']
+
+            min_atr_threshold = calculate_min_atr_threshold(SYMBOL_INFO[symbol]['step_size'], min_atr_multiplier_for_entry)
             if atr < min_atr_threshold:
-                logger.info(f"[SCAN] {symbol}: Volatilidade (ATR {atr:.{SYMBOL_INFO[symbol]['price_precision']}f}) abaixo do mínimo ({min_atr_threshold:.{SYMBOL_INFO[symbol]['price_precision']}f}). Sem sinal.")
+                logger.debug("[SCAN] %s: Volatilidade (ATR %.*f) abaixo do mínimo (%.*f). Sem sinal.", symbol,
+                             price_precision, atr, price_precision, min_atr_threshold, extra={'symbol': symbol, 'event': 'scan_low_volatility'})
                 continue
 
             if is_uptrend:
-                selected_symbols_data.append({
+                scan_results.append({
                     'symbol': symbol,
                     'current_price': current_price,
                     'ema_trend': ema_trend,
-                    'atr': atr
+                    'atr': atr,
+                    'min_atr_threshold': min_atr_threshold,
+                    'recent_klines': scan_klines[index][-2:],
                 })
-                logger.info(f"[SCAN] ✅ {symbol}: Selecionado! Preço: {current_price:.{SYMBOL_INFO[symbol]['price_precision']}f}, EMA Tendência: {ema_trend:.{SYMBOL_INFO[symbol]['price_precision']}f}, ATR: {atr:.{SYMBOL_INFO[symbol]['price_precision']}f}")
-
-        except Exception as e:
-            logger.error(f"[ERRO SCAN] Falha ao analisar {symbol}: {e}")
+                logger.debug("[SCAN] ✅ %s: Selecionado! Preço: %.*f, EMA Tendência: %.*f, ATR: %.*f", symbol, price_precision, current_price,
+                             price_precision, ema_trend, price_precision, atr, extra={'symbol': symbol, 'event': 'scan_candidate'})
 
+    selected_symbols_data = scan_results
     selected_symbols_data.sort(key=lambda x: x['atr'], reverse=False) # Ordena por ATR, menos volátil primeiro
-    
-    final_selected_symbols = [s['symbol'] for s in selected_symbols_data[:max_symbols_to_monitor]]
-
-    logger.info(f"\n--- Varredura Concluída. {len(final_selected_symbols)} Pares Selecionados para Monitoramento ---")
-    logger.info(f"Pares Selecionados: {final_selected_symbols}")
-    return final_selected_symbols
 
-# --- Função para calcular SL/TP baseado no ATR ---
-def calculate_atr_based_sl_tp(current_price, atr_value, side, risk_reward_ratio, price_precision):
-    sl_multiplier = 2.0 
-    tp_multiplier = sl_multiplier * risk_reward_ratio
-
-    sl_price = None
-    tp_price = None
-
-    if side == Client.SIDE_BUY: 
-        sl_price = current_price - (atr_value * sl_multiplier)
-        tp_price = current_price + (atr_value * tp_multiplier)
-    elif side == Client.SIDE_SELL: 
-        sl_price = current_price + (atr_value * sl_multiplier)
-        tp_price = current_price - (atr_value * tp_multiplier)
-    
-    if sl_price is not None:
-        sl_price = round(sl_price, price_precision)
-    if tp_price is not None:
-        tp_price = round(tp_price, price_precision)
-        
-    if side == Client.SIDE_BUY and sl_price >= current_price:
-        sl_price = current_price * 0.99 
-        logger.warning(f"[AVISO] SL para {side} ajustado para {sl_price:.{price_precision}f} (fallback).")
-    elif side == Client.SIDE_SELL and sl_price <= current_price:
-        sl_price = current_price * 1.01 
-        logger.warning(f"[AVISO] SL para {side} ajustado para {sl_price:.{price_precision}f} (fallback).")
-
-    if side == Client.SIDE_BUY and tp_price <= current_price:
-        tp_price = current_price * 1.01 
-        logger.warning(f"[AVISO] TP para {side} ajustado para {tp_price:.{price_precision}f} (fallback).")
-    elif side == Client.SIDE_SELL and tp_price >= current_price:
-        tp_price = current_price * 0.99 
-        logger.warning(f"[AVISO] TP para {side} ajustado para {tp_price:.{price_precision}f} (fallback).")
-
-    return sl_price, tp_price
-
-# --- Função para calcular a quantidade da ordem a ser negociada (com gerenciamento de risco e min_notional) ---
-def calcular_quantidade_ordem(entrada_preco, available_balance, stop_loss_price,
-                              leverage_val, risk_per_trade_percent, max_risk_usdt_per_trade, symbol_name):
-    if symbol_name not in SYMBOL_INFO:
-        logger.error(f"[ERRO] Informações de símbolo para {symbol_name} não encontradas. Não é possível calcular a quantidade.")
-        return None
-
-    info = SYMBOL_INFO[symbol_name]
-    
-    if entrada_preco <= 0:
-        logger.error("[ERRO] Preço de entrada inválido para cálculo de quantidade.")
-        return None
+    # O lote acima semeia EMA/ATR no início da janela de `required_klines_count` candles (e pode usar o candle
+    # em formação), enquanto check_entry_signal usa o IndicatorEngine sobre todo o histórico do KlineStore e o
+    # último candle fechado. Perto dos limites os dois podem discordar: os candidatos são confirmados, em ordem,
+    # com os mesmos valores do sinal de entrada até completar a lista (só poucos símbolos passam pelo engine).
+    server_time_ms = get_server_time_ms()
+    final_selected_symbols = []
+    for candidate in selected_symbols_data:
+        if len(final_selected_symbols) >= max_symbols_to_monitor:
+            break
+        if confirm_scan_candidate(candidate, kline_interval_str, kline_trend_period, kline_pullback_period,
+                                  kline_atr_period, server_time_ms):
+            final_selected_symbols.append(candidate['symbol'])
 
-    price_diff = abs(entrada_preco - stop_loss_price)
-    if stop_loss_price is None or price_diff < info['step_size'] * 2: 
-        logger.error("[ERRO] Preço de Stop Loss inválido ou muito próximo do preço de entrada para cálculo de quantidade.")
-        return None
-    
-    sl_value_per_unit = price_diff 
-    
-    risk_usdt_from_percent = available_balance * (risk_per_trade_percent / 100)
-    risk_usdt = min(risk_usdt_from_percent, max_risk_usdt_per_trade)
-    
-    if risk_usdt <= 0:
-        logger.warning("[AVISO] Risco calculado é zero ou negativo. Não é possível calcular a quantidade da ordem.")
-        return None
+    LAST_SCAN_DURATION_SECONDS = time.time() - scan_start_time
+    logger.info("\n--- Varredura Concluída em %.2fs (%s pares analisados). %s Pares Selecionados para Monitoramento ---", LAST_SCAN_DURATION_SECONDS, len(symbols_to_scan), len(final_selected_symbols))
+    logger.info("Pares Selecionados: %s", final_selected_symbols)
+    return final_selected_symbols
 
-    # 1. Calcula a quantidade baseada no risco
-    quantidade_base_risco = risk_usdt / sl_value_per_unit
-    
-    step_size = info['step_size']
-    quantity_precision = info['quantity_precision']
-    min_qty = info['min_qty']
-    max_qty = info['max_qty']
-    min_notional = info.get('min_notional', 5.0) # Obtém o min_notional do SYMBOL_INFO, com fallback
-    market_max_qty = info.get('market_max_qty', max_qty) 
-
-    # 2. Calcula a quantidade mínima para atender ao valor nocional
-    # Arredonda para cima para garantir que o mínimo nocional seja atendido
-    quantidade_min_notional_raw = min_notional / entrada_preco
-    quantidade_min_notional = math.ceil(quantidade_min_notional_raw / step_size) * step_size
-    quantidade_min_notional = round(quantidade_min_notional, quantity_precision)
-
-    # 3. A quantidade final deve ser a MAIOR entre a calculada pelo risco e a mínima pelo nocional
-    # Isso garante que o requisito de min_notional seja sempre atendido primeiro
-    quantidade_final = max(quantidade_base_risco, quantidade_min_notional)
-    
-    # Arredonda para baixo para o step_size mais próximo para garantir que não exceda o saldo
-    quantidade_final = math.floor(quantidade_final / step_size) * step_size 
-    quantidade_final = round(quantidade_final, quantity_precision)
-
-    # Log para informar ajuste de nocional
-    # Se a quantidade final calculada (que já atende ao min_notional) for maior que a base de risco
-    if quantidade_final > quantidade_base_risco and quantidade_base_risco > 0:
-        logger.warning(f"[AVISO] Quantidade ajustada de {quantidade_base_risco:.{quantity_precision}f} para {quantidade_final:.{quantity_precision}f} para atender ao valor nocional mínimo ({min_notional:.2f} USDT).")
-    elif quantidade_final < min_notional / entrada_preco and quantidade_final > 0: # Se por algum arredondamento ficou abaixo do nocional
-        logger.warning(f"[AVISO] Quantidade calculada ({quantidade_final:.{quantity_precision}f}) é menor que a necessária para o valor nocional mínimo ({min_notional:.2f} USDT). Forçando ajuste.")
-        quantidade_final = quantidade_min_notional
-        logger.info(f"[INFO] Quantidade ajustada para {quantidade_final} para atender ao valor nocional mínimo.")
-
-
-    # 4. Verifica limites de quantidade da exchange (min_qty, max_qty, market_max_qty)
-    if quantidade_final < min_qty:
-        logger.warning(f"[AVISO] Quantidade calculada ({quantidade_final}) menor que a mínima ({min_qty}) para {symbol_name}. Não é possível abrir posição.")
-        return None 
-    elif quantidade_final > max_qty:
-        logger.warning(f"[AVISO] Quantidade calculada ({quantidade_final}) maior que a máxima ({max_qty}) para {symbol_name}. Ajustando para max_qty.")
-        quantidade_final = max_qty
-    
-    if quantidade_final > market_max_qty:
-        logger.warning(f"[AVISO] Quantidade calculada ({quantidade_final}) maior que a máxima permitida para ordem de mercado ({market_max_qty}) para {symbol_name}. Ajustando para market_max_qty.")
-        quantidade_final = market_max_qty
-        
-    # Arredonda novamente após todos os ajustes de limites
-    quantidade_final = round(quantidade_final / step_size) * step_size
-    quantidade_final = round(quantidade_final, quantity_precision)
-    
-    # 5. Verifica se há margem suficiente para a quantidade final (que já atende ao min_notional e outros filtros)
-    initial_margin_needed = (entrada_preco * quantidade_final) / leverage_val
-    if initial_margin_needed > available_balance:
-        logger.error(f"[ERRO] Saldo insuficiente para a margem inicial calculada ({initial_margin_needed:.2f} USDT) para {symbol_name}. Disponível: {available_balance:.2f} USDT. Não é possível abrir esta posição com o valor nocional mínimo exigido.")
-        return None 
+# --- Confirmação de um candidato da varredura com os indicadores do sinal de entrada ---
+def confirm_scan_candidate(candidate, kline_interval_str, kline_trend_period, kline_pullback_period, kline_atr_period, server_time_ms):
+    symbol = candidate['symbol']
+    previous_kline, current_kline = candidate['recent_klines']
+    if current_kline[6] >= server_time_ms:
+        current_kline = previous_kline # Mesmo critério de check_entry_signal: avalia o último candle fechado
+    ema_trend, _, atr = INDICATOR_ENGINE.evaluate(
+        symbol, kline_interval_str, kline_trend_period, kline_pullback_period, kline_atr_period, current_kline
+    )
+    current_price = float(current_kline[4])
+    if ema_trend is None or atr is None or atr < candidate['min_atr_threshold'] or current_price <= ema_trend:
+        price_precision = SYMBOL_INFO[symbol]['price_precision']
+        logger.debug("[SCAN] %s: Descartado pelos indicadores do sinal de entrada (Preço %.*f, EMA Tendência %s, ATR %s).",
+                     symbol, price_precision, current_price,
+                     None if ema_trend is None else round(ema_trend, price_precision), None if atr is None else round(atr, price_precision),
+                     extra={'symbol': symbol, 'event': 'scan_engine_mismatch'})
+        return False
+    return True
 
-    return quantidade_final
+# --- Função para iniciar o user data stream (preenchimentos de ordens em tempo real) ---
+def start_user_stream():
+    global USER_STREAM
+    if USER_STREAM is None:
+        USER_STREAM = UserDataStream(client, ORDER_TRACKER)
+        USER_STREAM.start()
+        logger.info("[USER STREAM] Acompanhamento de ordens via user data stream iniciado.")
+    return USER_STREAM
 
 # --- Função para enviar ordens (TESTE ou REAL) ---
-def enviar_ordem(symbol, quantity, price, side, order_type, test_mode, time_in_force=None, stop_price=None, reduce_only=False):
+def enviar_ordem(symbol, quantity, price, side, order_type, test_mode, time_in_force=None, stop_price=None, reduce_only=False, signal_time=None):
     if client is None:
         logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível enviar ordem.")
         return None
@@ -489,46 +505,73 @@ def enviar_ordem(symbol, quantity, price, side, order_type, test_mode, time_in_f
          del params['price']
 
     if test_mode: 
-        logger.info(f"--- SIMULANDO ORDEM (TESTE) para {symbol} ---")
+        logger.info("--- SIMULANDO ORDEM (TESTE) para %s ---", symbol)
         # Em modo de teste, simula um preenchimento completo para ordens de mercado,
         # e um status 'FILLED' para ordens limit/stop.
         simulated_status = 'FILLED' if order_type == 'MARKET' and reduce_only is not True else 'NEW' 
         simulated_avg_price = price if price else get_current_market_price(symbol)
         if simulated_avg_price is None: simulated_avg_price = 0.0 # Valor de fallback
         
-        logger.info(f"✅ Ordem de TESTE {order_type} {side} para {symbol} simulada com sucesso. Status: {simulated_status}, Preço Médio: {simulated_avg_price}")
+        logger.info("✅ Ordem de TESTE %s %s para %s simulada com sucesso. Status: %s, Preço Médio: %s", order_type, side, symbol, simulated_status, simulated_avg_price)
         return {'orderId': f'TEST_ORDER_{int(time.time())}_{symbol}_{order_type}', 'status': simulated_status, 'executedQty': quantity if simulated_status == 'FILLED' else 0.0, 'avgPrice': simulated_avg_price} 
     else:
-        logger.info(f"--- ENVIANDO ORDEM REAL para {symbol} ---")
+        logger.info("--- ENVIANDO ORDEM REAL para %s ---", symbol)
         try:
+            submitted_at = perf_counter()
             response = client.futures_create_order(**params)
+            if signal_time is not None:
+                SIGNAL_TO_ORDER_LATENCY.observe(perf_counter() - signal_time)
             
             # Se for uma ordem de mercado, monitore até que seja FILLED
             if order_type == 'MARKET':
                 order_id = response.get('orderId')
                 if order_id:
                     start_time = time.time()
-                    while time.time() - start_time < ORDER_FILL_TIMEOUT_SECONDS:
+
+                    # Preenchimento informado pelo user data stream assim que a Binance o reporta
+                    if USER_STREAM is not None and USER_STREAM.is_healthy():
+                        order_info = USER_STREAM.wait_for_order(order_id, ORDER_FILL_TIMEOUT_SECONDS)
+                        if order_info is not None:
+                            executed_qty = float(order_info['executedQty'])
+                            if order_info['status'] == 'FILLED' and executed_qty >= quantity:
+                                fill_seconds = perf_counter() - submitted_at
+                                ORDER_FILL_LATENCY.observe(fill_seconds, 'user_stream')
+                                logger.info("✅ Ordem REAL MARKET %s para %s preenchida com sucesso! ID: %s, Quantidade: %s, Preço Médio: %s (user data stream)",
+                                            side, symbol, order_id, executed_qty, order_info['avgPrice'],
+                                            extra={'symbol': symbol, 'event': 'order_filled', 'order_id': order_id, 'latency_ms': round(fill_seconds * 1000, 1)})
+                            else:
+                                logger.warning("[AVISO] Ordem REAL MARKET %s para %s não foi totalmente preenchida. Status: %s, Executado: %s/%s.", side, symbol, order_info['status'], executed_qty, quantity)
+                            return order_info
+                        logger.warning("[AVISO] Sem confirmação da ordem %s para %s pelo user data stream. Consultando via REST.", order_id, symbol)
+
+                    # Sem stream (ou stream caiu durante a espera): consulta periódica via REST
+                    while True:
                         order_info = client.futures_get_order(symbol=symbol, orderId=order_id)
                         current_status = order_info['status']
                         executed_qty = float(order_info['executedQty'])
                         avg_price = float(order_info['avgPrice'])
 
                         if current_status == 'FILLED' and executed_qty >= quantity: # Garante que foi preenchida totalmente
-                            logger.info(f"✅ Ordem REAL MARKET {side} para {symbol} preenchida com sucesso! ID: {order_id}, Quantidade: {executed_qty}, Preço Médio: {avg_price}")
+                            fill_seconds = perf_counter() - submitted_at
+                            ORDER_FILL_LATENCY.observe(fill_seconds, 'rest')
+                            logger.info("✅ Ordem REAL MARKET %s para %s preenchida com sucesso! ID: %s, Quantidade: %s, Preço Médio: %s",
+                                        side, symbol, order_id, executed_qty, avg_price,
+                                        extra={'symbol': symbol, 'event': 'order_filled', 'order_id': order_id, 'latency_ms': round(fill_seconds * 1000, 1)})
                             return order_info # Retorna a informação completa da ordem preenchida
                         elif current_status in ['CANCELED', 'EXPIRED', 'REJECTED', 'PARTIALLY_FILLED']:
                             # Se a ordem foi cancelada, expirou, rejeitada ou preenchida parcialmente (e não totalmente)
-                            logger.warning(f"[AVISO] Ordem REAL MARKET {side} para {symbol} não foi totalmente preenchida. Status: {current_status}, Executado: {executed_qty}/{quantity}.")
+                            logger.warning("[AVISO] Ordem REAL MARKET %s para %s não foi totalmente preenchida. Status: %s, Executado: %s/%s.", side, symbol, current_status, executed_qty, quantity)
                             return order_info # Retorna o status atual para que a lógica de erro possa lidar
-                        
-                        logger.info(f"⏳ Aguardando preenchimento da ordem MARKET {order_id} para {symbol}. Status atual: {current_status}, Executado: {executed_qty}/{quantity}")
+
+                        if time.time() - start_time >= ORDER_FILL_TIMEOUT_SECONDS:
+                            break
+                        logger.info("⏳ Aguardando preenchimento da ordem MARKET %s para %s. Status atual: %s, Executado: %s/%s", order_id, symbol, current_status, executed_qty, quantity)
                         time.sleep(ORDER_MONITOR_INTERVAL_SECONDS)
                     
-                    logger.warning(f"[AVISO] Tempo limite excedido para preenchimento da ordem MARKET {order_id} para {symbol}. Status final: {current_status}, Executado: {executed_qty}/{quantity}")
+                    logger.warning("[AVISO] Tempo limite excedido para preenchimento da ordem MARKET %s para %s. Status final: %s, Executado: %s/%s", order_id, symbol, current_status, executed_qty, quantity)
                     return order_info # Retorna o último status conhecido
                 else:
-                    logger.error(f"[ERRO] Ordem MARKET {side} para {symbol} não retornou um orderId. Falha no envio inicial.")
+                    logger.error("[ERRO] Ordem MARKET %s para %s não retornou um orderId. Falha no envio inicial.", side, symbol)
                     return {'orderId': None, 'status': 'FAILED', 'executedQty': 0.0, 'avgPrice': 0.0}
             else: # Para ordens que não são MARKET (STOP_MARKET, TAKE_PROFIT_MARKET, etc.)
                 clean_message = f"✅ Ordem REAL {order_type} {side} para {symbol} enviada com sucesso."
@@ -545,10 +588,66 @@ def enviar_ordem(symbol, quantity, price, side, order_type, test_mode, time_in_f
                 logger.info(clean_message)
                 return response
         except Exception as e:
-            logger.error(f"Falha ao enviar ordem REAL para {symbol}: {e}")
+            logger.error("Falha ao enviar ordem REAL para %s: %s", symbol, e)
             return {'orderId': None, 'status': 'FAILED', 'executedQty': 0.0, 'avgPrice': 0.0}
 
 
+# --- Função para enviar SL e TP juntos (bracket) numa única requisição de ordens em lote ---
+def enviar_ordens_protecao(symbol, quantity, side, sl_price, tp_price, test_mode):
+    """
+    Envia o STOP_MARKET e o TAKE_PROFIT_MARKET de uma posição via futures_place_batch_order.
+
+    Tudo ou nada: se alguma das duas ordens falhar, as ordens abertas do símbolo são
+    canceladas para não deixar uma proteção pela metade. Retorna um dicionário com
+    'success', 'sl_order', 'tp_order' e 'errors'.
+    """
+    result = {'success': False, 'sl_order': None, 'tp_order': None, 'errors': []}
+    if test_mode:
+        result['sl_order'] = enviar_ordem(symbol, quantity, None, side, 'STOP_MARKET', test_mode, stop_price=sl_price, reduce_only=True)
+        result['tp_order'] = enviar_ordem(symbol, quantity, None, side, 'TAKE_PROFIT_MARKET', test_mode, stop_price=tp_price, reduce_only=True)
+        result['success'] = True
+        return result
+    if client is None:
+        logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível enviar ordens de proteção.")
+        result['errors'].append('Cliente Binance não inicializado')
+        return result
+
+    quantity_precision = SYMBOL_INFO[symbol]['quantity_precision']
+    price_precision = SYMBOL_INFO[symbol]['price_precision']
+    # O endpoint de lote exige todos os valores como texto
+    protective_orders = [
+        {'symbol': symbol, 'side': side, 'type': order_type, 'quantity': f"{quantity:.{quantity_precision}f}",
+         'stopPrice': f"{stop_price:.{price_precision}f}", 'reduceOnly': 'true'}
+        for order_type, stop_price in (('STOP_MARKET', sl_price), ('TAKE_PROFIT_MARKET', tp_price))
+    ]
+
+    logger.info("--- ENVIANDO ORDENS DE PROTEÇÃO (SL/TP) REAIS para %s em lote ---", symbol)
+    try:
+        responses = client.futures_place_batch_order(batchOrders=protective_orders)
+    except Exception as e:
+        # Resultado desconhecido: alguma ordem pode ter sido aceita
+        logger.error("Falha ao enviar ordens de proteção para %s: %s", symbol, e)
+        result['errors'].append(str(e))
+        responses = []
+    else:
+        for key, response in zip(('sl_order', 'tp_order'), responses):
+            if response.get('orderId'):
+                result[key] = response
+            else:
+                result['errors'].append(f"{response.get('code')}: {response.get('msg')}")
+
+    if result['sl_order'] and result['tp_order']:
+        result['success'] = True
+        logger.info("✅ Ordens de proteção para %s enviadas com sucesso. SL ID: %s (%s), TP ID: %s (%s)", symbol, result['sl_order']['orderId'], sl_price, result['tp_order']['orderId'], tp_price)
+        return result
+
+    logger.error("[ERRO] Ordens de proteção para %s não foram aceitas por completo: %s. Cancelando as ordens restantes.", symbol, result['errors'])
+    cancel_all_open_orders_for_symbol(symbol, test_mode)
+    result['sl_order'] = None
+    result['tp_order'] = None
+    return result
+
+
 # --- Função para monitorar o status de uma ordem LIMIT (mantida para referência, mas não usada para entrada MARKET) ---
 @retry_api_call()
 def monitor_limit_order_status(symbol_name, order_id, timeout_seconds, test_mode, tp_price_target):
@@ -558,7 +657,7 @@ def monitor_limit_order_status(symbol_name, order_id, timeout_seconds, test_mode
     start_time = time.time()
     while time.time() - start_time < timeout_seconds:
         if test_mode: 
-            logger.info(f"[SIMULAÇÃO] Ordem de teste {order_id} para {symbol_name} assumida como FILLED.")
+            logger.info("[SIMULAÇÃO] Ordem de teste %s para %s assumida como FILLED.", order_id, symbol_name)
             return 'FILLED' 
         
         order_info = client.futures_get_order(symbol=symbol_name, orderId=order_id)
@@ -567,16 +666,16 @@ def monitor_limit_order_status(symbol_name, order_id, timeout_seconds, test_mode
         current_market_price = get_current_market_price(symbol_name) 
 
         if current_market_price is None:
-            logger.warning(f"[AVISO] Não foi possível obter preço de mercado durante monitoramento da ordem {order_id}. Continuando...")
+            logger.warning("[AVISO] Não foi possível obter preço de mercado durante monitoramento da ordem %s. Continuando...", order_id)
             time.sleep(ORDER_MONITOR_INTERVAL_SECONDS)
             continue
 
         if tp_price_target is not None and current_market_price >= tp_price_target:
-            logger.info(f"[OPORTUNIDADE PERDIDA] Preço de mercado ({current_market_price:.{SYMBOL_INFO[symbol_name]['price_precision']}f}) atingiu ou ultrapassou o TP teórico ({tp_price_target:.{SYMBOL_INFO[symbol_name]['price_precision']}f}) antes da ordem de entrada {order_id} ser preenchida. Cancelando ordem.")
+            logger.info("[OPORTUNIDADE PERDIDA] Preço de mercado (%.*f) atingiu ou ultrapassou o TP teórico (%.*f) antes da ordem de entrada %s ser preenchida. Cancelando ordem.", SYMBOL_INFO[symbol_name]['price_precision'], current_market_price, SYMBOL_INFO[symbol_name]['price_precision'], tp_price_target, order_id)
             cancel_all_open_orders_for_symbol(symbol_name, test_mode)
             return 'MISSED_OPPORTUNITY'
 
-        logger.info(f"[MONITOR] Status da ordem {order_id} para {symbol_name}: {status}")
+        logger.info("[MONITOR] Status da ordem %s para %s: %s", order_id, symbol_name, status)
 
         if status == 'FILLED':
             return 'FILLED'
@@ -585,7 +684,7 @@ def monitor_limit_order_status(symbol_name, order_id, timeout_seconds, test_mode
         
         time.sleep(ORDER_MONITOR_INTERVAL_SECONDS) 
             
-    logger.warning(f"[MONITOR] Tempo limite ({timeout_seconds}s) excedido para ordem {order_id} de {symbol_name}.")
+    logger.warning("[MONITOR] Tempo limite (%ss) excedido para ordem %s de %s.", timeout_seconds, order_id, symbol_name)
     return 'TIMEOUT'
 
 # --- Função para cancelar todas as ordens abertas para um símbolo ---
@@ -594,22 +693,22 @@ def cancel_all_open_orders_for_symbol(symbol_name, test_mode):
     if client is None:
         logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível cancelar ordens.")
         return None
-    logger.info(f"⏳ Tentando cancelar todas as ordens abertas para {symbol_name}...")
+    logger.info("⏳ Tentando cancelar todas as ordens abertas para %s...", symbol_name)
     if test_mode: 
-        logger.info(f"✅ SIMULAÇÃO: Todas as ordens abertas para {symbol_name} canceladas.")
+        logger.info("✅ SIMULAÇÃO: Todas as ordens abertas para %s canceladas.", symbol_name)
         return [{'orderId': f'TEST_CANCEL_{int(time.time())}'}] 
     else:
         try:
             response = client.futures_cancel_all_open_orders(symbol=symbol_name)
-            logger.info(f"✅ Ordens abertas para {symbol_name} canceladas: {response}")
+            logger.info("✅ Ordens abertas para %s canceladas: %s", symbol_name, response)
             return response
         except BinanceAPIException as e:
             # Trata caso onde não há ordens abertas (código 20011)
             if e.code == -2011: # Código de erro da Binance para 'No orders exist'
-                logger.info(f"Não há ordens abertas para {symbol_name} para cancelar.")
+                logger.info("Não há ordens abertas para %s para cancelar.", symbol_name)
                 return []
             else:
-                logger.error(f"Erro ao cancelar ordens para {symbol_name}: {e}")
+                logger.error("Erro ao cancelar ordens para %s: %s", symbol_name, e)
                 raise # Re-lança outras exceções
 
 # --- Função para verificar e fechar posições abertas reais (APENAS as não rastreadas pelo bot) ---
@@ -623,80 +722,178 @@ def check_and_close_untracked_positions(symbol_name, test_mode):
         position_amount = float(position['positionAmt'])
         
         if position_amount != 0 and symbol_name not in OPEN_POSITIONS:
-            logger.warning(f"[POSIÇÃO REAL - NÃO RASTREADA] Posição aberta detectada para {symbol_name}: {position_amount} unidades. Fechando...")
-            cancel_all_open_orders_for_symbol(symbol_name, test_mode) 
-            close_side = Client.SIDE_SELL if position_amount > 0 else Client.SIDE_BUY
-            quantity_to_close = abs(position_amount)
-
-            logger.info(f"⏳ Tentando fechar posição REAL NÃO RASTREADA de {symbol_name} ({quantity_to_close} unidades, lado: {close_side}) via ordem de mercado...")
-            
-            close_order_response = enviar_ordem(
-                symbol=symbol_name,
-                quantity=quantity_to_close,
-                price=None,
-                side=close_side,
-                order_type='MARKET',
-                time_in_force=None,
-                stop_price=None,
-                test_mode=test_mode,
-                reduce_only=True 
-            )
-            
-            if close_order_response and close_order_response.get('orderId'):
-                logger.info(f"✅ Ordem de fechamento de posição REAL NÃO RASTREADA para {symbol_name} enviada com sucesso.")
-                return True
-            else:
-                logger.error(f"[ERRO] Falha ao fechar posição REAL NÃO RASTREADA para {symbol_name}.")
-                return False
+            return close_untracked_position(symbol_name, position_amount, test_mode)
         elif position_amount != 0 and symbol_name in OPEN_POSITIONS:
             return False
         
     return False
 
+def close_untracked_position(symbol_name, position_amount, test_mode):
+    logger.warning("[POSIÇÃO REAL - NÃO RASTREADA] Posição aberta detectada para %s: %s unidades. Fechando...", symbol_name, position_amount)
+    cancel_all_open_orders_for_symbol(symbol_name, test_mode) 
+    close_side = Client.SIDE_SELL if position_amount > 0 else Client.SIDE_BUY
+    quantity_to_close = abs(position_amount)
+
+    logger.info("⏳ Tentando fechar posição REAL NÃO RASTREADA de %s (%s unidades, lado: %s) via ordem de mercado...", symbol_name, quantity_to_close, close_side)
+    
+    close_order_response = enviar_ordem(
+        symbol=symbol_name,
+        quantity=quantity_to_close,
+        price=None,
+        side=close_side,
+        order_type='MARKET',
+        time_in_force=None,
+        stop_price=None,
+        test_mode=test_mode,
+        reduce_only=True 
+    )
+    
+    if close_order_response and close_order_response.get('orderId'):
+        logger.info("✅ Ordem de fechamento de posição REAL NÃO RASTREADA para %s enviada com sucesso.", symbol_name)
+        return True
+    else:
+        logger.error("[ERRO] Falha ao fechar posição REAL NÃO RASTREADA para %s.", symbol_name)
+        return False
+
+# --- Funções de reconciliação em lote (uma consulta de posições e uma de ordens para todos os símbolos) ---
+def index_positions_and_orders(positions, open_orders):
+    """Indexa as respostas da Binance: símbolo -> quantidade da posição e símbolo -> {orderId: ordem}."""
+    positions_by_symbol = {}
+    for pos in positions:
+        positions_by_symbol.setdefault(pos['symbol'], float(pos['positionAmt']))
+    orders_by_symbol = {}
+    for order in open_orders:
+        orders_by_symbol.setdefault(order['symbol'], {})[str(order.get('orderId'))] = order
+    return positions_by_symbol, orders_by_symbol
+
 @retry_api_call()
-def reconcile_positions_and_orders(symbol_name, test_mode):
+def reconcile_all_positions_and_orders(symbols, test_mode):
     if client is None:
         logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível reconciliar posições.")
         return
-    if symbol_name not in OPEN_POSITIONS:
+    tracked_symbols = [symbol for symbol in symbols if symbol in OPEN_POSITIONS]
+    if not tracked_symbols:
         return
 
-    logger.info(f"⏳ Reconciliando posição para {symbol_name}...")
+    logger.info("⏳ Reconciliando posições para %s...", tracked_symbols)
+    positions_by_symbol, orders_by_symbol = index_positions_and_orders(
+        client.futures_position_information(),
+        client.futures_get_open_orders()
+    )
+    for symbol_name in tracked_symbols:
+        with get_symbol_lock(symbol_name):
+            reconcile_positions_and_orders(
+                symbol_name, test_mode,
+                positions_by_symbol.get(symbol_name, 0.0),
+                orders_by_symbol.get(symbol_name, {})
+            )
+
+@retry_api_call()
+def fetch_position_risk():
+    """Posição, alavancagem e tipo de margem de todos os símbolos numa única consulta (position risk)."""
+    return client.futures_position_information()
 
-    actual_positions = client.futures_position_information(symbol=symbol_name)
-    position_closed_on_exchange = True
-    actual_position_amount = 0.0
+@retry_api_call()
+def recover_positions_on_startup(symbols, test_mode, position_risk):
+    """
+    Recuperação na partida a partir do position risk e de uma consulta de ordens: as posições
+    restauradas do STATE_STORE são reconciliadas (fechadas na exchange saem do estado, sem SL/TP
+    são fechadas) e posições abertas nos símbolos monitorados que o bot não conhece são fechadas.
+    """
+    if client is None:
+        logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível recuperar as posições.")
+        return
+    positions_by_symbol, orders_by_symbol = index_positions_and_orders(
+        position_risk,
+        client.futures_get_open_orders()
+    )
+    for symbol_name in list(OPEN_POSITIONS):
+        with get_symbol_lock(symbol_name):
+            reconcile_positions_and_orders(
+                symbol_name, test_mode,
+                positions_by_symbol.get(symbol_name, 0.0),
+                orders_by_symbol.get(symbol_name, {})
+            )
+    for symbol_name in symbols:
+        position_amount = positions_by_symbol.get(symbol_name, 0.0)
+        if position_amount != 0 and symbol_name not in OPEN_POSITIONS:
+            with get_symbol_lock(symbol_name):
+                close_untracked_position(symbol_name, position_amount, test_mode)
 
-    for pos in actual_positions:
-        if pos['symbol'] == symbol_name:
-            actual_position_amount = float(pos['positionAmt'])
-            if actual_position_amount != 0:
-                position_closed_on_exchange = False
-            break
+def preflight_leverage_and_margin(symbols, leverage_val, margin_type, position_risk):
+    """
+    Compara a alavancagem e o tipo de margem atuais (position risk) com a configuração e corrige,
+    em paralelo, apenas os símbolos divergentes. O resultado fica em LEVERAGE_SET_FOR_SYMBOL e
+    MARGIN_TYPE_SET_FOR_SYMBOL, então o ciclo de trading não faz essas chamadas. `margin_type`
+    None mantém o tipo de margem da conta.
+    """
+    current = {}
+    for row in position_risk:
+        current.setdefault(row['symbol'], (int(row['leverage']), MARGIN_TYPE_NAMES.get(row.get('marginType'))))
+
+    def fix_symbol(symbol_name):
+        current_leverage, current_margin_type = current[symbol_name]
+        if margin_type and current_margin_type != margin_type:
+            try:
+                client.futures_change_margin_type(symbol=symbol_name, marginType=margin_type)
+                logger.info("[PREFLIGHT] Tipo de margem de %s alterado de %s para %s.", symbol_name, current_margin_type, margin_type)
+                current_margin_type = margin_type
+            except BinanceAPIException as e:
+                if e.code == -4046: # No need to change margin type
+                    current_margin_type = margin_type
+                else: # Ex.: posição ou ordens abertas no símbolo impedem a troca
+                    logger.warning("[PREFLIGHT] Não foi possível alterar o tipo de margem de %s para %s: %s", symbol_name, margin_type, e)
+        if current_margin_type:
+            MARGIN_TYPE_SET_FOR_SYMBOL[symbol_name] = current_margin_type
+        if current_leverage != leverage_val:
+            client.futures_change_leverage(symbol=symbol_name, leverage=leverage_val)
+            logger.info("[PREFLIGHT] Alavancagem de %s alterada de %sx para %sx.", symbol_name, current_leverage, leverage_val)
+        LEVERAGE_SET_FOR_SYMBOL[symbol_name] = leverage_val
+
+    to_fix = []
+    for symbol_name in symbols:
+        if symbol_name not in current:
+            continue # Sem linha no position risk: a alavancagem é definida antes da primeira entrada
+        current_leverage, current_margin_type = current[symbol_name]
+        if current_leverage == leverage_val and (not margin_type or current_margin_type == margin_type):
+            LEVERAGE_SET_FOR_SYMBOL[symbol_name] = leverage_val
+            if current_margin_type:
+                MARGIN_TYPE_SET_FOR_SYMBOL[symbol_name] = current_margin_type
+        else:
+            to_fix.append(symbol_name)
+
+    with ThreadPoolExecutor(max_workers=PREFLIGHT_MAX_WORKERS) as executor:
+        futures = {executor.submit(fix_symbol, symbol_name): symbol_name for symbol_name in to_fix}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                # Fica fora do cache: processar_simbolo tenta definir a alavancagem antes da entrada
+                LEVERAGE_SET_FOR_SYMBOL.pop(futures[future], None)
+                logger.error("[PREFLIGHT] Falha ao ajustar %s: %s", futures[future], e)
+    logger.info("[PREFLIGHT] Alavancagem/margem verificadas para %s símbolos; %s ajustados.", len(symbols), len(to_fix))
+
+def reconcile_positions_and_orders(symbol_name, test_mode, actual_position_amount, open_orders_by_id):
+    if symbol_name not in OPEN_POSITIONS:
+        return
+
+    position_closed_on_exchange = actual_position_amount == 0
 
-    actual_open_orders = client.futures_get_open_orders(symbol=symbol_name)
-    
     sl_order_id_internal = OPEN_POSITIONS[symbol_name].get('sl_order_id')
     tp_order_id_internal = OPEN_POSITIONS[symbol_name].get('tp_order_id')
 
-    sl_order_exists_on_exchange = False
-    tp_order_exists_on_exchange = False
-
-    for order in actual_open_orders:
-        if str(order.get('orderId')) == str(sl_order_id_internal):
-            sl_order_exists_on_exchange = True
-        if str(order.get('orderId')) == str(tp_order_id_internal):
-            tp_order_exists_on_exchange = True
+    sl_order_exists_on_exchange = str(sl_order_id_internal) in open_orders_by_id
+    tp_order_exists_on_exchange = str(tp_order_id_internal) in open_orders_by_id
 
     if position_closed_on_exchange:
-        logger.info(f"✅ Posição para {symbol_name} está FECHADA na Binance. Removendo do rastreamento interno e cancelando ordens remanescentes.")
+        logger.info("✅ Posição para %s está FECHADA na Binance. Removendo do rastreamento interno e cancelando ordens remanescentes.", symbol_name)
         cancel_all_open_orders_for_symbol(symbol_name, test_mode)
         del OPEN_POSITIONS[symbol_name]
     elif not sl_order_exists_on_exchange or not tp_order_exists_on_exchange:
-        logger.warning(f"[ALERTA] Posição para {symbol_name} está ABERTA, mas ordens protetoras (SL/TP) estão INCOMPLETAS ou AUSENTES na Binance.")
-        logger.warning(f"  SL presente: {sl_order_exists_on_exchange}, TP presente: {tp_order_exists_on_exchange}")
+        logger.warning("[ALERTA] Posição para %s está ABERTA, mas ordens protetoras (SL/TP) estão INCOMPLETAS ou AUSENTES na Binance.", symbol_name)
+        logger.warning("  SL presente: %s, TP presente: %s", sl_order_exists_on_exchange, tp_order_exists_on_exchange)
         
-        logger.info(f"⏳ Fechando posição desprotegida para {symbol_name} via ordem de mercado para segurança...")
+        logger.info("⏳ Fechando posição desprotegida para %s via ordem de mercado para segurança...", symbol_name)
         
         cancel_all_open_orders_for_symbol(symbol_name, test_mode)
         
@@ -713,12 +910,12 @@ def reconcile_positions_and_orders(symbol_name, test_mode):
             reduce_only=True 
         )
         if close_order_response and close_order_response.get('orderId'):
-            logger.info(f"✅ Posição desprotegida para {symbol_name} fechada com sucesso via mercado.")
+            logger.info("✅ Posição desprotegida para %s fechada com sucesso via mercado.", symbol_name)
             del OPEN_POSITIONS[symbol_name]
         else:
-            logger.error(f"[ERRO] Falha crítica ao fechar posição desprotegida para {symbol_name}. Requer intervenção manual.")
+            logger.error("[ERRO] Falha crítica ao fechar posição desprotegida para %s. Requer intervenção manual.", symbol_name)
     else:
-        logger.info(f"✅ Posição para {symbol_name} está ABERTA e PROTEGIDA na Binance.")
+        logger.info("✅ Posição para %s está ABERTA e PROTEGIDA na Binance.", symbol_name, extra={'symbol': symbol_name, 'event': 'position_protected'})
 
 
 # --- Função para verificar sinal de entrada com base na estratégia de Klines ---
@@ -726,103 +923,86 @@ def reconcile_positions_and_orders(symbol_name, test_mode):
 def check_entry_signal(symbol_name, kline_interval_minutes, kline_trend_period, kline_pullback_period, kline_atr_period, min_atr_multiplier_for_entry):
     global client
     
-    kline_interval_map = {
-        1: Client.KLINE_INTERVAL_1MINUTE,
-        5: Client.KLINE_INTERVAL_5MINUTE,
-        15: Client.KLINE_INTERVAL_15MINUTE,
-        30: Client.KLINE_INTERVAL_30MINUTE,
-        60: Client.KLINE_INTERVAL_1HOUR,
-        240: Client.KLINE_INTERVAL_4HOUR,
-        1440: Client.KLINE_INTERVAL_1DAY
-    }
-    kline_interval_str = kline_interval_map.get(kline_interval_minutes)
+    kline_interval_str = KLINE_INTERVAL_MAP.get(kline_interval_minutes)
 
     required_klines_count = max(kline_trend_period, kline_pullback_period, kline_atr_period) + 2 
     
     if not isinstance(client, Client) or not hasattr(client, 'futures_klines'):
-        logger.warning(f"[AVISO] Cliente Binance não está pronto para obter Klines para {symbol_name}. Tentando re-inicializar...")
+        logger.warning("[AVISO] Cliente Binance não está pronto para obter Klines para %s. Tentando re-inicializar...", symbol_name)
         if not initialize_binance_client():
-            logger.error(f"[ERRO] Falha ao re-inicializar cliente para Klines para {symbol_name}.")
+            logger.error("[ERRO] Falha ao re-inicializar cliente para Klines para %s.", symbol_name)
             return False, None, None, None 
 
     try:
-        klines = client.futures_klines(symbol=symbol_name, interval=kline_interval_str, limit=required_klines_count)
+        # A avaliação acontece no fechamento do candle: o candle recém-aberto é descartado e o último fechado é o "atual"
+        klines = get_klines_cached(symbol_name, kline_interval_str, required_klines_count + 1)
+        if klines and klines[-1][6] >= get_server_time_ms():
+            klines = klines[:-1]
+        else:
+            klines = klines[-required_klines_count:]
         
         if not klines or len(klines) < required_klines_count:
-            logger.warning(f"[AVISO] Klines insuficientes ({len(klines)}/{required_klines_count}) para {symbol_name} no intervalo {kline_interval_minutes}m para análise de sinal.")
+            logger.warning("[AVISO] Klines insuficientes (%s/%s) para %s no intervalo %sm para análise de sinal.", len(klines), required_klines_count, symbol_name, kline_interval_minutes)
             return False, None, None, None
 
-        close_prices = [float(kline[4]) for kline in klines]
-        high_prices = [float(kline[2]) for kline in klines]
-        low_prices = [float(kline[3]) for kline in klines] 
-        
         current_price = float(klines[-1][4]) 
         current_high = float(klines[-1][2])
         current_low = float(klines[-1][3])
 
-        # --- 1. Calcula Indicadores ---
-        ema_trend = calculate_ema(close_prices, kline_trend_period)
-        ema_pullback = calculate_ema(close_prices, kline_pullback_period)
-        atr = calculate_atr(klines, kline_atr_period)
+        # --- 1. Calcula Indicadores (estado incremental; só os candles novos são processados) ---
+        ema_trend, ema_pullback, atr = INDICATOR_ENGINE.evaluate(
+            symbol_name, kline_interval_str, kline_trend_period,
+            kline_pullback_period, kline_atr_period, klines[-1]
+        )
 
         if any(x is None for x in [ema_trend, ema_pullback, atr]):
-            logger.warning(f"[AVISO] Indicadores (EMA/ATR) não puderam ser calculados para {symbol_name}. Pulando análise de sinal.")
+            logger.warning("[AVISO] Indicadores (EMA/ATR) não puderam ser calculados para %s. Pulando análise de sinal.", symbol_name)
             return False, None, None, None
         
-        if symbol_name not in SYMBOL_INFO:
-            get_exchange_info() 
-            if symbol_name not in SYMBOL_INFO:
-                logger.error(f"[ERRO] Informações de precisão para {symbol_name} não disponíveis após recarga. Não é possível continuar a análise de sinal.")
-                return False, None, None, None
+        if SYMBOL_INFO.resolve(symbol_name) is None:
+            logger.error("[ERRO] Informações de precisão para %s não disponíveis após recarga. Não é possível continuar a análise de sinal.", symbol_name)
+            return False, None, None, None
 
         price_precision = SYMBOL_INFO[symbol_name]['price_precision']
 
-        logger.info(f"[INFO] Análise ({symbol_name}) ({kline_interval_minutes}m):")
-        logger.info(f"Preço={current_price:.{price_precision}f}, EMA({kline_trend_period})={ema_trend:.{price_precision}f}, EMA({kline_pullback_period})={ema_pullback:.{price_precision}f}, ATR({kline_atr_period})={atr:.{price_precision}f}")
+        logger.info("[INFO] Análise (%s) (%sm): Preço=%.*f, EMA(%s)=%.*f, EMA(%s)=%.*f, ATR(%s)=%.*f",
+                    symbol_name, kline_interval_minutes, price_precision, current_price,
+                    kline_trend_period, price_precision, ema_trend, kline_pullback_period, price_precision, ema_pullback,
+                    kline_atr_period, price_precision, atr, extra={'symbol': symbol_name, 'event': 'signal_analysis'})
+
+        # --- 2. Volatilidade, tendência, pullback e níveis de SL/TP ---
+        min_atr_threshold = calculate_min_atr_threshold(SYMBOL_INFO[symbol_name]['step_size'], min_atr_multiplier_for_entry)
+        prev_low = float(klines[-2][3]) if len(klines) >= 2 else None
+        prev_close = float(klines[-2][4]) if len(klines) >= 2 else None
+        signal, sl_price, tp_price = evaluate_long_signal(
+            current_price, current_low, prev_low, prev_close, ema_trend, ema_pullback, atr,
+            min_atr_threshold, config['risk_reward_ratio'], price_precision
+        )
 
-        # --- 2. Filtra por Volatilidade (ATR) ---
-        min_atr_threshold = SYMBOL_INFO[symbol_name]['step_size'] * 5 * min_atr_multiplier_for_entry
-        if atr < min_atr_threshold:
-            logger.info(f"[INFO] {symbol_name}: Volatilidade (ATR {atr:.{price_precision}f}) abaixo do mínimo ({min_atr_threshold:.{price_precision}f}). Sem sinal.")
+        if signal == SIGNAL_LOW_VOLATILITY:
+            logger.info("[INFO] %s: Volatilidade (ATR %.*f) abaixo do mínimo (%.*f). Sem sinal.", symbol_name,
+                        price_precision, atr, price_precision, min_atr_threshold, extra={'symbol': symbol_name, 'event': 'signal_low_volatility'})
             return False, None, None, None
 
-        # --- 3. Condições para Sinal de Compra (LONG) ---
-        is_uptrend = current_price > ema_trend
-
-        pulled_back = False
-        if current_price < ema_pullback and current_price > ema_trend:
-            pulled_back = True
-        elif current_low <= ema_trend and current_price > ema_trend:
-            pulled_back = True
-        elif len(klines) >= 2:
-            prev_low = float(klines[-2][3])
-            prev_close = float(klines[-2][4])
-            if prev_low <= ema_trend and prev_close < current_price:
-                pulled_back = True
-
-        confirmed_resumption = current_price > ema_pullback
-
-        if is_uptrend and pulled_back and confirmed_resumption:
-            logger.info(f"[SINAL] ✅ {symbol_name}: Sinal de COMPRA (LONG) detectado!")
-            entry_price = current_price 
-            
-            sl_price, tp_price = calculate_atr_based_sl_tp(entry_price, atr, Client.SIDE_BUY, config['risk_reward_ratio'], price_precision)
+        if signal == SIGNAL_NONE:
+            logger.info("[INFO] %s: Condição (LONG) não atendidas", symbol_name, extra={'symbol': symbol_name, 'event': 'signal_none'})
+            return False, None, None, None
 
-            if sl_price is None or tp_price is None:
-                logger.warning(f"[AVISO] {symbol_name}: SL ou TP não puderam ser calculados com base no ATR. Sem sinal.")
-                return False, None, None, None
+        logger.info("[SINAL] ✅ %s: Sinal de COMPRA (LONG) detectado!", symbol_name, extra={'symbol': symbol_name, 'event': 'signal_long'})
+        entry_price = current_price 
 
-            if sl_price >= entry_price or tp_price <= entry_price:
-                logger.warning(f"[AVISO] {symbol_name}: SL ({sl_price:.{price_precision}f}) ou TP ({tp_price:.{price_precision}f}) inválidos em relação à entrada ({entry_price:.{price_precision}f}). Sem sinal.")
-                return False, None, None, None
+        if sl_price is None or tp_price is None:
+            logger.warning("[AVISO] %s: SL ou TP não puderam ser calculados com base no ATR. Sem sinal.", symbol_name)
+            return False, None, None, None
 
-            return True, round(entry_price, price_precision), sl_price, tp_price
-        else:
-            logger.info(f"[INFO] {symbol_name}: Condição (LONG) não atendidas")
+        if signal == SIGNAL_INVALID_LEVELS:
+            logger.warning("[AVISO] %s: SL (%.*f) ou TP (%.*f) inválidos em relação à entrada (%.*f). Sem sinal.", symbol_name, price_precision, sl_price, price_precision, tp_price, price_precision, entry_price)
             return False, None, None, None
 
+        return True, round(entry_price, price_precision), sl_price, tp_price
+
     except Exception as e:
-        logger.error(f"[ERRO] Falha na verificação de sinal para {symbol_name}: {e}")
+        logger.error("[ERRO] Falha na verificação de sinal para %s: %s", symbol_name, e)
         return False, None, None, None
 
 
@@ -839,122 +1019,179 @@ def executar(selected_symbols_for_monitoring_data, leverage_val,
     """
     available_balance = mostrar_saldo()
 
-    for symbol_item in selected_symbols_for_monitoring_data: 
-        reconcile_positions_and_orders(symbol_item, test_mode_val)
-
+    reconcile_all_positions_and_orders(selected_symbols_for_monitoring_data, test_mode_val)
+
+    # Cada símbolo é processado em paralelo; o ciclo dura o tempo do símbolo mais lento
+    connection_error = None
+    with ThreadPoolExecutor(max_workers=EXECUTION_MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(
+                processar_simbolo, symbol_item, available_balance, leverage_val,
+                risk_per_trade_percent_val, max_risk_usdt_per_trade_val, test_mode_val,
+                kline_interval_minutes, kline_trend_period, kline_pullback_period,
+                kline_atr_period, min_atr_multiplier_for_entry
+            ): symbol_item
+            for symbol_item in selected_symbols_for_monitoring_data
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (ConnectionError, BinanceAPIException) as e:
+                logger.error("[ERRO] Falha de conexão ao processar %s: %s", futures[future], e)
+                connection_error = e
+            except Exception as e:
+                logger.error("[ERRO] Falha inesperada ao processar %s: %s", futures[future], e)
+    if connection_error is not None:
+        raise connection_error
+
+# --- Função que processa um símbolo: alavancagem, sinal, dimensionamento, entrada e SL/TP ---
+def processar_simbolo(symbol_item, available_balance, leverage_val,
+                      risk_per_trade_percent_val, max_risk_usdt_per_trade_val, test_mode_val,
+                      kline_interval_minutes, kline_trend_period, kline_pullback_period,
+                      kline_atr_period, min_atr_multiplier_for_entry):
+    with get_symbol_lock(symbol_item):
         if symbol_item not in OPEN_POSITIONS: 
-            logger.info(f"\n📡 Analisando par: {symbol_item}") 
+            logger.info("📡 Analisando par: %s", symbol_item, extra={'symbol': symbol_item, 'event': 'symbol_analysis'})
             
-            if symbol_item not in LEVERAGE_SET_FOR_SYMBOL or not LEVERAGE_SET_FOR_SYMBOL[symbol_item]:
+            if LEVERAGE_SET_FOR_SYMBOL.get(symbol_item) != leverage_val:
                 try:
                     if client:
                         client.futures_change_leverage(symbol=symbol_item, leverage=leverage_val)
-                        logger.info(f"[INFO] Alavancagem para {symbol_item} definida para {leverage_val}x.")
-                        LEVERAGE_SET_FOR_SYMBOL[symbol_item] = True
+                        logger.info("[INFO] Alavancagem para %s definida para %sx.", symbol_item, leverage_val)
+                        LEVERAGE_SET_FOR_SYMBOL[symbol_item] = leverage_val
                     else:
-                        logger.error(f"[ERRO] Cliente Binance não inicializado. Não foi possível definir alavancagem para {symbol_item}.")
-                        continue
+                        logger.error("[ERRO] Cliente Binance não inicializado. Não foi possível definir alavancagem para %s.", symbol_item)
+                        return
                 except Exception as e:
-                    logger.error(f"[ERRO] Falha ao definir alavancagem para {symbol_item}: {e}")
-                    continue
+                    logger.error("[ERRO] Falha ao definir alavancagem para %s: %s", symbol_item, e)
+                    return
 
-            has_signal, entry_price, sl_price, tp_price = check_entry_signal(
-                symbol_item, kline_interval_minutes, kline_trend_period, 
-                kline_pullback_period, kline_atr_period, min_atr_multiplier_for_entry
-            )
+            with SIGNAL_CHECK_DURATION.time():
+                has_signal, entry_price, sl_price, tp_price = check_entry_signal(
+                    symbol_item, kline_interval_minutes, kline_trend_period, 
+                    kline_pullback_period, kline_atr_period, min_atr_multiplier_for_entry
+                )
 
             if has_signal:
-                logger.info(f"[SINAL DE ENTRADA] Condições atendidas para LONG em {symbol_item}.")
+                signal_time = perf_counter()
+                logger.info("[SINAL DE ENTRADA] Condições atendidas para LONG em %s.", symbol_item)
                 
                 quantidade = calcular_quantidade_ordem(
                     entry_price, available_balance, sl_price,
-                    leverage_val, risk_per_trade_percent_val, max_risk_usdt_per_trade_val, symbol_item 
+                    leverage_val, risk_per_trade_percent_val, max_risk_usdt_per_trade_val, symbol_item,
+                    SYMBOL_INFO.get(symbol_item), order_book=get_order_book(symbol_item)
                 )
                 
                 if quantidade is not None and quantidade > 0: 
-                    logger.info(f"[📊 Níveis Estratégicos para {symbol_item} (LONG)]") 
-                    logger.info(f"📥 Entrada:         {entry_price}")
-                    logger.info(f"📉 Stop Loss:       {sl_price}")
-                    logger.info(f"📈 Take Profit:     {tp_price}") 
-                    logger.info(f"📊 Quantidade:      {quantidade}")
-                    logger.info(f"Alavancagem:           {leverage_val}x") 
-                    logger.info(f"Custo Estimado:     {round(entry_price * quantidade / leverage_val, 2)} USDT (Margem Inicial)")
-
-                    entry_order_response = enviar_ordem(
-                        symbol=symbol_item,
-                        quantity=quantidade,
-                        price=None, 
-                        side=Client.SIDE_BUY,
-                        order_type='MARKET', 
-                        test_mode=test_mode_val,
-                        reduce_only=False 
-                    )
-                    
-                    # A lógica de verificação de preenchimento da ordem de entrada foi movida para dentro de enviar_ordem
-                    if entry_order_response and entry_order_response.get('status') == 'FILLED' and float(entry_order_response.get('executedQty', 0.0)) >= quantidade: 
-                        entry_order_id = entry_order_response['orderId']
-                        logger.info(f"✅ Ordem de entrada MARKET para {symbol_item} preenchida com sucesso! (ID: {entry_order_id}).")
-
-                        sl_tp_side = Client.SIDE_SELL 
-
-                        sl_order_response = enviar_ordem(
+                    logger.info("[📊 Níveis Estratégicos para %s (LONG)]", symbol_item) 
+                    logger.info("📥 Entrada:         %s", entry_price)
+                    logger.info("📉 Stop Loss:       %s", sl_price)
+                    logger.info("📈 Take Profit:     %s", tp_price) 
+                    logger.info("📊 Quantidade:      %s", quantidade)
+                    logger.info("Alavancagem:           %sx", leverage_val) 
+                    logger.info("Custo Estimado:     %s USDT (Margem Inicial)", round(entry_price * quantidade / leverage_val, 2))
+
+                    # Limite global de entradas simultâneas (envio, preenchimento e SL/TP)
+                    with ENTRY_SEMAPHORE:
+                        entry_order_response = enviar_ordem(
                             symbol=symbol_item,
                             quantity=quantidade,
-                            price=None,
-                            side=sl_tp_side,
-                            order_type='STOP_MARKET',
-                            stop_price=sl_price,
+                            price=None, 
+                            side=Client.SIDE_BUY,
+                            order_type='MARKET', 
                             test_mode=test_mode_val,
-                            reduce_only=True 
+                            reduce_only=False,
+                            signal_time=signal_time
                         )
-                        logger.info(f"[DEBUG] Resposta SL: {sl_order_response}") 
-                        
-                        tp_order_response = enviar_ordem(
-                            symbol=symbol_item,
-                            quantity=quantidade,
-                            price=None,
-                            side=sl_tp_side,
-                            order_type='TAKE_PROFIT_MARKET',
-                            stop_price=tp_price,
-                            test_mode=test_mode_val,
-                            reduce_only=True 
-                        )
-                        logger.info(f"[DEBUG] Resposta TP: {tp_order_response}") 
+                    
+                        # A lógica de verificação de preenchimento da ordem de entrada foi movida para dentro de enviar_ordem
+                        if entry_order_response and entry_order_response.get('status') == 'FILLED' and float(entry_order_response.get('executedQty', 0.0)) >= quantidade: 
+                            entry_order_id = entry_order_response['orderId']
+                            logger.info("✅ Ordem de entrada MARKET para %s preenchida com sucesso! (ID: %s).", symbol_item, entry_order_id)
 
-                        if (sl_order_response and sl_order_response.get('orderId')) and \
-                           (tp_order_response and tp_order_response.get('orderId')): 
-                            logger.info(f"[POSIÇÃO] Ordens de Stop Loss e Take Profit para {symbol_item} enviadas.")
+                            sl_tp_side = Client.SIDE_SELL 
+
+                            # Gravada antes do envio do SL/TP: se o bot cair agora, a recuperação encontra a posição sem proteção e a fecha
                             OPEN_POSITIONS[symbol_item] = {
-                                "status": "OPEN",
+                                "status": "PROTECTING",
                                 "entry_price": entry_order_response.get('avgPrice'), 
                                 "quantity": quantidade,
                                 "sl_price": sl_price,
                                 "tp_price": tp_price,
                                 "side": Client.SIDE_BUY, 
-                                "entry_order_id": entry_order_response.get('orderId'), 
-                                "sl_order_id": sl_order_response.get('orderId'),
-                                "tp_order_id": tp_order_response.get('orderId')
+                                "entry_order_id": entry_order_id, 
+                                "sl_order_id": None,
+                                "tp_order_id": None
                             }
-                            logger.info(f"[POSIÇÃO] Posição {'simulada ' if test_mode_val else ''}aberta para {symbol_item}. Gerenciada por TP/SL na exchange.")
+
+                            protection_started_at = perf_counter()
+                            protection = enviar_ordens_protecao(symbol_item, quantidade, sl_tp_side, sl_price, tp_price, test_mode_val)
+                            protection_seconds = perf_counter() - protection_started_at
+                            PROTECTION_PLACEMENT_LATENCY.observe(protection_seconds, 'ok' if protection['success'] else 'failed')
+
+                            if protection['success']: 
+                                logger.info("[POSIÇÃO] Ordens de Stop Loss e Take Profit para %s enviadas.", symbol_item,
+                                            extra={'symbol': symbol_item, 'event': 'protection_placed', 'latency_ms': round(protection_seconds * 1000, 1)})
+                                OPEN_POSITIONS[symbol_item] = dict(
+                                    OPEN_POSITIONS[symbol_item],
+                                    status="OPEN",
+                                    sl_order_id=protection['sl_order'].get('orderId'),
+                                    tp_order_id=protection['tp_order'].get('orderId')
+                                )
+                                logger.info("[POSIÇÃO] Posição %saberta para %s. Gerenciada por TP/SL na exchange.", 'simulada ' if test_mode_val else '', symbol_item)
+                            else:
+                                logger.error("[ERRO] Falha ao enviar ordens de Stop Loss ou Take Profit para %s. Tentando fechar posição para evitar desproteção.", symbol_item)
+                                # Se as ordens de proteção falharam, tenta fechar a posição de entrada
+                                enviar_ordem(symbol_item, float(entry_order_response.get('executedQty', 0.0)), None, sl_tp_side, 'MARKET', test_mode_val, reduce_only=True) 
+                                if symbol_item in OPEN_POSITIONS: del OPEN_POSITIONS[symbol_item]
                         else:
-                            logger.error(f"[ERRO] Falha ao enviar ordens de Stop Loss ou Take Profit para {symbol_item}. Tentando fechar posição para evitar desproteção.")
-                            # Se as ordens de proteção falharam, tenta fechar a posição de entrada
-                            enviar_ordem(symbol_item, float(entry_order_response.get('executedQty', 0.0)), None, sl_tp_side, 'MARKET', test_mode_val, reduce_only=True) 
+                            logger.error("[ERRO] Ordem de entrada MARKET para %s não foi TOTALMENTE FILLED ou falhou. Status: %s, Executado: %s/%s. Fechando qualquer posição parcial para segurança.", symbol_item, entry_order_response.get('status'), float(entry_order_response.get('executedQty', 0.0)), quantidade)
+                            # Se a ordem de entrada não foi totalmente preenchida, tenta fechar o que foi preenchido
+                            enviar_ordem(symbol_item, float(entry_order_response.get('executedQty', 0.0)), None, Client.SIDE_SELL, 'MARKET', test_mode_val, reduce_only=True)
                             if symbol_item in OPEN_POSITIONS: del OPEN_POSITIONS[symbol_item]
-                    else:
-                        logger.error(f"[ERRO] Ordem de entrada MARKET para {symbol_item} não foi TOTALMENTE FILLED ou falhou. Status: {entry_order_response.get('status')}, Executado: {float(entry_order_response.get('executedQty', 0.0))}/{quantidade}. Fechando qualquer posição parcial para segurança.")
-                        # Se a ordem de entrada não foi totalmente preenchida, tenta fechar o que foi preenchido
-                        enviar_ordem(symbol_item, float(entry_order_response.get('executedQty', 0.0)), None, Client.SIDE_SELL, 'MARKET', test_mode_val, reduce_only=True)
-                        if symbol_item in OPEN_POSITIONS: del OPEN_POSITIONS[symbol_item]
                 else:
-                    logger.warning(f"[AVISO] Não foi possível calcular a quantidade de ordem válida para {symbol_item}. Não prosseguindo com simulação de entrada.")
+                    logger.warning("[AVISO] Não foi possível calcular a quantidade de ordem válida para %s. Não prosseguindo com simulação de entrada.", symbol_item)
                 
         else:
-            logger.info(f"[POSIÇÃO] Posição aberta para {symbol_item}. As ordens de TP/SL estão ativas na exchange.")
+            logger.info("[POSIÇÃO] Posição aberta para %s. As ordens de TP/SL estão ativas na exchange.", symbol_item)
             pass
 
+# --- Renovação da lista de símbolos monitorados (varredura em segundo plano) ---
+def rescan_watchlist(kline_interval_minutes, kline_trend_period, kline_pullback_period, kline_atr_period,
+                     min_atr_multiplier_for_entry, max_symbols_to_monitor, scan_prefilter, leverage_val, margin_type):
+    """Roda na thread da varredura: seleciona os símbolos e prepara alavancagem/margem dos que vão entrar na lista."""
+    with SCAN_DURATION.time():
+        selected = scan_and_select_best_symbols(
+            kline_interval_minutes, kline_trend_period, kline_pullback_period, kline_atr_period,
+            min_atr_multiplier_for_entry, max_symbols_to_monitor, scan_prefilter
+        )
+    added = [symbol for symbol in selected if symbol not in WATCHLIST.symbols]
+    if added:
+        preflight_leverage_and_margin(added, leverage_val, margin_type, fetch_position_risk())
+    return selected
+
+def apply_watchlist_rescan(kline_interval_str, required_klines_count, next_scan_at):
+    """Roda no loop principal, entre ciclos: aplica o resultado pendente da varredura, mantendo os símbolos com posição."""
+    selected = WATCHLIST.take_pending()
+    if selected is None:
+        return
+    if not selected:
+        logger.warning("[WATCHLIST] A nova varredura não selecionou nenhum símbolo. Mantendo a lista atual.")
+        return
+    added, removed = WATCHLIST.replace(selected, keep=list(OPEN_POSITIONS))
+    WATCHLIST.record_scan(get_server_time_ms() / 1000, LAST_SCAN_DURATION_SECONDS, next_scan_at)
+    if added or removed:
+        logger.info("[WATCHLIST] Lista de símbolos atualizada: +%s -%s. Monitorando: %s", added, removed, list(WATCHLIST.symbols))
+        start_market_stream(list(WATCHLIST.symbols), kline_interval_str, required_klines_count)
+    if WATCHLIST.kept_symbols:
+        logger.info("[WATCHLIST] Mantidos por posição aberta: %s", list(WATCHLIST.kept_symbols))
+    WATCHLIST.write_snapshot()
+
 # --- Ponto de Entrada Principal do Programa ---
-if __name__ == "__main__":
+def run_bot():
+    """Inicializa o cliente, carrega as configurações, seleciona os símbolos e executa o loop principal."""
+    global config
+
     internet_down = False
 
     if not initialize_binance_client():
@@ -979,65 +1216,110 @@ if __name__ == "__main__":
         loaded_min_atr_multiplier_for_entry = float(config.get("min_atr_multiplier_for_entry", 1.0))
         loaded_max_symbols_to_monitor = int(config.get("max_symbols_to_monitor", 5))
         loaded_risk_reward_ratio = float(config.get("risk_reward_ratio", 2.0))
+        loaded_watchlist_rescan_minutes = int(config.get("watchlist_rescan_minutes", 60))
+        loaded_scan_prefilter = {
+            'min_quote_volume_usdt': float(config.get("scan_min_quote_volume_usdt", 10_000_000)),
+            'max_price_change_percent': float(config.get("scan_max_price_change_percent", 30.0)),
+            'max_spread_percent': float(config.get("scan_max_spread_percent", 0.1)),
+            'top_k': int(config.get("scan_prefilter_top_k", 60)),
+        }
+        loaded_margin_type = config.get("margin_type") or None
+        if loaded_margin_type not in (None, 'ISOLATED', 'CROSSED'):
+            raise ValueError(f"margin_type deve ser 'ISOLATED' ou 'CROSSED', recebido {loaded_margin_type!r}")
 
     except KeyError as e:
-        logger.critical(f"[ERRO CRÍTICO] Chave essencial '{e}' faltando em settings.json.")
+        logger.critical("[ERRO CRÍTICO] Chave essencial '%s' faltando em settings.json.", e)
         logger.critical("Certifique-se de que seu arquivo settings.json contém todas as chaves obrigatórias e que os nomes estão corretos.")
         sys.exit(1)
     except (ValueError, TypeError) as e:
-        logger.critical(f"[ERRO CRÍTICO] Valor inválido para configuração em settings.json: {e}")
+        logger.critical("[ERRO CRÍTICO] Valor inválido para configuração em settings.json: %s", e)
         logger.critical("Verifique se os tipos de dados (int, float, lista de strings) estão corretos para cada configuração.")
         sys.exit(1)
 
     # Loga as configurações carregadas
-    logger.info(f"[INFO] Alavancagem : {loaded_leverage}x")
-    logger.info(f"[INFO] % De risco: {loaded_risk_per_trade_percent}% do saldo disponível (máx {loaded_max_risk_usdt_per_trade} USDT)")
-    logger.info(f"[INFO] MODO DE OPERAÇÃO: {'BOT FUNÇÃO(SIMULAÇÃO)' if loaded_test_mode else 'BOT FUNÇÃO(REAL!)'}") 
-    logger.info(f"[INFO] Intervalo de Reconexão: {RECONNECT_INTERVAL_SECONDS}s")
-    logger.info(f"[INFO] Intervalo de Monitoramento de Ordem: {ORDER_MONITOR_INTERVAL_SECONDS}s")
-    logger.info(f"[INFO] Tempo Limite para Preenchimento de Ordem: {ORDER_FILL_TIMEOUT_SECONDS}s")
+    logger.info("[INFO] Alavancagem : %sx", loaded_leverage)
+    logger.info("[INFO] Tipo de Margem: %s", loaded_margin_type or 'mantido da conta')
+    logger.info("[INFO] %% De risco: %s%% do saldo disponível (máx %s USDT)", loaded_risk_per_trade_percent, loaded_max_risk_usdt_per_trade)
+    logger.info("[INFO] MODO DE OPERAÇÃO: %s", 'BOT FUNÇÃO(SIMULAÇÃO)' if loaded_test_mode else 'BOT FUNÇÃO(REAL!)') 
+    logger.info("[INFO] Intervalo de Reconexão: %ss", RECONNECT_INTERVAL_SECONDS)
+    logger.info("[INFO] Intervalo de Monitoramento de Ordem: %ss", ORDER_MONITOR_INTERVAL_SECONDS)
+    logger.info("[INFO] Tempo Limite para Preenchimento de Ordem: %ss", ORDER_FILL_TIMEOUT_SECONDS)
+    logger.info("[INFO] Símbolos Processados em Paralelo: %s (máx. %s entradas simultâneas)", EXECUTION_MAX_WORKERS, MAX_CONCURRENT_ENTRIES)
     
-    logger.info(f"[INFO] Estratégia: Seguidor de Tendência com Pullback e Filtro de Volatilidade (APENAS LONG)") 
-    logger.info(f"[INFO] Timeframe de KLine para Análise: {loaded_kline_interval_minutes}m")
-    logger.info(f"[INFO] Período EMA Tendência: {loaded_kline_trend_period}")
-    logger.info(f"[INFO] Período EMA Pullback: {loaded_kline_pullback_period}")
-    logger.info(f"[INFO] Período ATR: {loaded_kline_atr_period}")
-    logger.info(f"[INFO] Multiplicador Mínimo ATR para Entrada: {loaded_min_atr_multiplier_for_entry}")
-    logger.info(f"[INFO] Máximo de Símbolos a Monitorar: {loaded_max_symbols_to_monitor}")
-    logger.info(f"[INFO] Relação Risco:Recompensa (TP): {loaded_risk_reward_ratio}")
+    logger.info("[INFO] Estratégia: Seguidor de Tendência com Pullback e Filtro de Volatilidade (APENAS LONG)") 
+    logger.info("[INFO] Timeframe de KLine para Análise: %sm", loaded_kline_interval_minutes)
+    logger.info("[INFO] Período EMA Tendência: %s", loaded_kline_trend_period)
+    logger.info("[INFO] Período EMA Pullback: %s", loaded_kline_pullback_period)
+    logger.info("[INFO] Período ATR: %s", loaded_kline_atr_period)
+    logger.info("[INFO] Multiplicador Mínimo ATR para Entrada: %s", loaded_min_atr_multiplier_for_entry)
+    logger.info("[INFO] Máximo de Símbolos a Monitorar: %s", loaded_max_symbols_to_monitor)
+    logger.info(f"[INFO] Pré-filtro da Varredura: volume 24h ≥ {loaded_scan_prefilter['min_quote_volume_usdt']:,.0f} USDT, "
+                f"variação 24h ≤ {loaded_scan_prefilter['max_price_change_percent']}%, spread ≤ {loaded_scan_prefilter['max_spread_percent']}%, "
+                f"top {loaded_scan_prefilter['top_k']} por volume")
+    logger.info("[INFO] Nova Varredura de Símbolos: %s", f'a cada {loaded_watchlist_rescan_minutes} min' if loaded_watchlist_rescan_minutes > 0 else 'desativada')
+    logger.info("[INFO] Relação Risco:Recompensa (TP): %s", loaded_risk_reward_ratio)
 
 
     logger.info("\n--- Bot Iniciado ---")
+    STATE_STORE.open('test' if loaded_test_mode else 'live')
+    INDICATOR_ENGINE.load()
+    SYMBOL_INFO.start_background_refresh()
+    METRICS_REGISTRY.start_snapshot_writer(METRICS_SNAPSHOT_PATH)
+    if not loaded_test_mode:
+        start_user_stream()
     
     # Seleciona os melhores símbolos para monitoramento
-    selected_symbols_for_monitoring = scan_and_select_best_symbols(
-        loaded_kline_interval_minutes, loaded_kline_trend_period, 
-        loaded_kline_pullback_period, loaded_kline_atr_period, 
-        loaded_min_atr_multiplier_for_entry, 
-        loaded_max_symbols_to_monitor
-    )
+    with SCAN_DURATION.time():
+        selected_symbols_for_monitoring = scan_and_select_best_symbols(
+            loaded_kline_interval_minutes, loaded_kline_trend_period, 
+            loaded_kline_pullback_period, loaded_kline_atr_period, 
+            loaded_min_atr_multiplier_for_entry, 
+            loaded_max_symbols_to_monitor,
+            loaded_scan_prefilter
+        )
 
     if not selected_symbols_for_monitoring:
         logger.critical("[ERRO CRÍTICO] Nenhum símbolo adequado foi selecionado para monitoramento. O bot não pode operar. Ajuste seus critérios de varredura ou verifique a conexão.")
         sys.exit(1)
 
-    logger.info("⏳ Verificando e fechando posições não rastreadas ao iniciar...")
-    for symbol_item in selected_symbols_for_monitoring: 
-        check_and_close_untracked_positions(symbol_item, loaded_test_mode)
-        time.sleep(1)
+    # Posições restauradas continuam monitoradas mesmo que o símbolo não tenha sido selecionado agora
+    WATCHLIST.replace(selected_symbols_for_monitoring, keep=list(OPEN_POSITIONS))
+    if WATCHLIST.kept_symbols:
+        logger.info("[ESTADO] Mantendo no monitoramento os símbolos com posição restaurada: %s", list(WATCHLIST.kept_symbols))
+    selected_symbols_for_monitoring = list(WATCHLIST.symbols)
+
+    kline_interval_str = KLINE_INTERVAL_MAP.get(loaded_kline_interval_minutes)
+    stream_klines_count = max(loaded_kline_trend_period, loaded_kline_pullback_period, loaded_kline_atr_period) + 3 # Janela da análise + candle em formação
+    start_market_stream(selected_symbols_for_monitoring, kline_interval_str, stream_klines_count)
+
+    # Uma única consulta de position risk serve à recuperação das posições e ao preflight de alavancagem/margem
+    position_risk = fetch_position_risk()
+    logger.info("⏳ Reconciliando posições restauradas e fechando posições não rastreadas ao iniciar...")
+    recover_positions_on_startup(selected_symbols_for_monitoring, loaded_test_mode, position_risk)
     logger.info("✅ Verificação de posições não rastreadas concluída no início.")
+    preflight_leverage_and_margin(selected_symbols_for_monitoring, loaded_leverage, loaded_margin_type, position_risk)
+
+    # A análise de sinal roda no fechamento de cada candle (a primeira, imediatamente)
+    kline_interval_ms = INTERVAL_MS[kline_interval_str]
+    next_signal_check_ms = 0
+
+    # Novas varreduras em segundo plano; o resultado é aplicado no loop, entre dois ciclos
+    rescan_interval_ms = loaded_watchlist_rescan_minutes * 60_000
+    next_rescan_ms = get_server_time_ms() + rescan_interval_ms if rescan_interval_ms > 0 else None
+    WATCHLIST.record_scan(get_server_time_ms() / 1000, LAST_SCAN_DURATION_SECONDS, next_rescan_ms / 1000 if next_rescan_ms else None)
+    WATCHLIST.write_snapshot()
 
     while True:
         try:
             if internet_down:
-                logger.info(f"[CONEXÃO] Tentando reconectar à Binance API...")
+                logger.info("[CONEXÃO] Tentando reconectar à Binance API...")
                 if client:
                     try:
                         client.futures_ping()
                         logger.info("[CONEXÃO] Conexão restabelecida! Continuando operação.")
                         internet_down = False
                     except Exception as e:
-                        logger.error(f"[ERRO] Falha ao pingar Binance durante reconexão: {e}")
+                        logger.error("[ERRO] Falha ao pingar Binance durante reconexão: %s", e)
                 else:
                     logger.warning("[AVISO] Cliente Binance não disponível para ping durante reconexão. Tentando re-inicializar...")
                     if not initialize_binance_client():
@@ -1048,23 +1330,49 @@ if __name__ == "__main__":
             if not client:
                 time.sleep(RECONNECT_INTERVAL_SECONDS)
                 continue
+
+            if next_rescan_ms is not None:
+                apply_watchlist_rescan(kline_interval_str, stream_klines_count, next_rescan_ms / 1000)
+                if get_server_time_ms() >= next_rescan_ms and WATCHLIST.start_scan(partial(
+                        rescan_watchlist, loaded_kline_interval_minutes, loaded_kline_trend_period,
+                        loaded_kline_pullback_period, loaded_kline_atr_period, loaded_min_atr_multiplier_for_entry,
+                        loaded_max_symbols_to_monitor, loaded_scan_prefilter, loaded_leverage, loaded_margin_type)):
+                    next_rescan_ms = get_server_time_ms() + rescan_interval_ms
+                    logger.info("[WATCHLIST] Nova varredura de símbolos iniciada em segundo plano.")
+            selected_symbols_for_monitoring = list(WATCHLIST.symbols)
             
-            # Executa o ciclo principal de análise e trading
-            executar(selected_symbols_for_monitoring, loaded_leverage, 
-                     loaded_risk_per_trade_percent, loaded_max_risk_usdt_per_trade, 
-                     loaded_test_mode, loaded_kline_interval_minutes, loaded_kline_trend_period, 
-                     loaded_kline_pullback_period, loaded_kline_atr_period, 
-                     loaded_min_atr_multiplier_for_entry, loaded_risk_reward_ratio) 
-            
-            time.sleep(CYCLE_SLEEP_SECONDS) 
+            if get_server_time_ms() >= next_signal_check_ms:
+                # Fechamento de candle: executa o ciclo principal de análise e trading
+                with CYCLE_DURATION.time():
+                    executar(selected_symbols_for_monitoring, loaded_leverage, 
+                             loaded_risk_per_trade_percent, loaded_max_risk_usdt_per_trade, 
+                             loaded_test_mode, loaded_kline_interval_minutes, loaded_kline_trend_period, 
+                             loaded_kline_pullback_period, loaded_kline_atr_period, 
+                             loaded_min_atr_multiplier_for_entry, loaded_risk_reward_ratio) 
+                
+                INDICATOR_ENGINE.save()
+                log_request_budget()
+                next_signal_check_ms = next_candle_close_ms(kline_interval_ms, get_server_time_ms()) + CANDLE_CLOSE_GRACE_MS
+                logger.info("[AGENDADOR] Próxima análise de sinal no fechamento do candle em %.0fs.", (next_signal_check_ms - get_server_time_ms()) / 1000)
+            else:
+                # Entre fechamentos: apenas a verificação de proteção das posições abertas
+                reconcile_all_positions_and_orders(selected_symbols_for_monitoring, loaded_test_mode)
+
+            seconds_to_next_check = (next_signal_check_ms - get_server_time_ms()) / 1000
+            time.sleep(max(0, min(PROTECTION_CHECK_INTERVAL_SECONDS, seconds_to_next_check)))
 
         except (ConnectionError, BinanceAPIException) as e:
-            logger.error(f"[ERRO DE CONEXÃO] Internet indisponível ou problema de API: {e}")
-            logger.info(f"O bot entrará em modo de reconexão. Tentando novamente em {RECONNECT_INTERVAL_SECONDS} segundos...")
+            logger.error("[ERRO DE CONEXÃO] Internet indisponível ou problema de API: %s", e)
+            logger.info("O bot entrará em modo de reconexão. Tentando novamente em %s segundos...", RECONNECT_INTERVAL_SECONDS)
             internet_down = True
             time.sleep(RECONNECT_INTERVAL_SECONDS) 
         except KeyboardInterrupt:
             logger.info("\n[ENCERRANDO] Interrupção detectada (Ctrl+C). Iniciando processo de limpeza...")
+            if MARKET_STREAM is not None:
+                MARKET_STREAM.stop()
+            if DEPTH_STREAM is not None:
+                DEPTH_STREAM.stop()
+            # O user data stream continua ativo para confirmar as ordens de fechamento abaixo
             final_config = load_config_from_json() 
             symbols_to_clean_on_exit = selected_symbols_for_monitoring
 
@@ -1078,7 +1386,7 @@ if __name__ == "__main__":
                 quantity_to_close = position_data['quantity']
                 close_side = Client.SIDE_SELL # Para fechar uma posição LONG
 
-                logger.info(f"⏳ Fechando posição rastreada para {symbol_to_close} ({quantity_to_close} unidades, lado: {close_side}) via ordem de mercado...")
+                logger.info("⏳ Fechando posição rastreada para %s (%s unidades, lado: %s) via ordem de mercado...", symbol_to_close, quantity_to_close, close_side)
                 close_order_response = enviar_ordem(
                     symbol=symbol_to_close,
                     quantity=quantity_to_close,
@@ -1091,17 +1399,25 @@ if __name__ == "__main__":
                     reduce_only=True 
                 )
                 if close_order_response and close_order_response.get('orderId'):
-                    logger.info(f"✅ Posição rastreada para {symbol_to_close} fechada com sucesso.")
+                    logger.info("✅ Posição rastreada para %s fechada com sucesso.", symbol_to_close)
                     del OPEN_POSITIONS[symbol_to_close]
                 else:
-                    logger.error(f"[ERRO] Falha ao fechar posição rastreada para {symbol_to_close}. Requer intervenção manual.")
+                    logger.error("[ERRO] Falha ao fechar posição rastreada para %s. Requer intervenção manual.", symbol_to_close)
 
             logger.info("⏳ Verificando e fechando quaisquer posições não rastreadas restantes...")
             for symbol_item in symbols_to_clean_on_exit: 
                 check_and_close_untracked_positions(symbol_item, loaded_test_mode) 
+            if USER_STREAM is not None:
+                USER_STREAM.stop()
+            METRICS_REGISTRY.write_snapshot(METRICS_SNAPSHOT_PATH)
+            STATE_STORE.close()
             logger.info("✅ Processo de limpeza concluído. Encerrando o bot.")
             sys.exit(0)
         except Exception as e:
-            logger.error(f"[ERRO INESPERADO] Ocorreu um erro não tratado: {e}")
+            logger.error("[ERRO INESPERADO] Ocorreu um erro não tratado: %s", e)
             logger.error("O bot continuará, mas este erro deve ser investigado.")
-            time.sleep(CYCLE_SLEEP_SECONDS) 
+            time.sleep(CYCLE_SLEEP_SECONDS)
+
+
+if __name__ == "__main__":
+    run_bot()
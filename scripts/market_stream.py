@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+FUTURES_STREAM_URL = 'wss://fstream.binance.com' # Endpoint de streams combinados da Binance Futures
+STREAM_STALE_SECONDS = 15 # Sem mensagens por mais que isso, o stream é considerado fora do ar
+STREAM_RECONNECT_MIN_SECONDS = 1 # Espera inicial entre tentativas de reconexão
+STREAM_RECONNECT_MAX_SECONDS = 30 # Espera máxima entre tentativas de reconexão
+MARK_PRICE_MAX_AGE_SECONDS = 5 # Idade máxima de um preço de marcação para ser usado no lugar do REST
+
+
+class MarketDataTable:
+    """Tabela em memória com o último candle e o último preço de marcação de cada símbolo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._klines = {} # símbolo -> (kline no formato REST, fechado?, instante da atualização)
+        self._mark_prices = {} # símbolo -> (preço, instante da atualização)
+
+    def update_kline(self, symbol, kline, is_closed):
+        with self._lock:
+            self._klines[symbol] = (kline, is_closed, time.time())
+
+    def update_mark_price(self, symbol, price):
+        with self._lock:
+            self._mark_prices[symbol] = (price, time.time())
+
+    def get_latest_kline(self, symbol, max_age_seconds=None):
+        with self._lock:
+            entry = self._klines.get(symbol)
+        if entry is None or (max_age_seconds is not None and time.time() - entry[2] > max_age_seconds):
+            return None
+        return entry[0]
+
+    def get_mark_price(self, symbol, max_age_seconds=MARK_PRICE_MAX_AGE_SECONDS):
+        with self._lock:
+            entry = self._mark_prices.get(symbol)
+        if entry is None or (max_age_seconds is not None and time.time() - entry[1] > max_age_seconds):
+            return None
+        return entry[0]
+
+    def get_price(self, symbol, max_age_seconds=MARK_PRICE_MAX_AGE_SECONDS):
+        """Preço de marcação recente ou, na falta dele, o fechamento do último candle recebido."""
+        price = self.get_mark_price(symbol, max_age_seconds)
+        if price is not None:
+            return price
+        kline = self.get_latest_kline(symbol, max_age_seconds)
+        return float(kline[4]) if kline else None
+
+
+class MarketStream:
+    """
+    Ingestão dos streams combinados de kline e markPrice da Binance Futures.
+
+    Roda um loop asyncio numa thread própria, alimenta a MarketDataTable (e o KlineStore,
+    quando informado) e reconecta automaticamente com espera exponencial. A cada conexão,
+    e sempre que um candle chega fora de sequência, chama `backfill(symbol)` numa thread
+    auxiliar para preencher via REST os candles perdidos enquanto o stream estava fora.
+    Até o preenchimento terminar com sucesso, `needs_backfill(symbol)` fica verdadeiro e o
+    KlineStore do símbolo não deve ser tratado como atualizado. `base_url` pode apontar para
+    um servidor websocket local nos testes.
+    """
+
+    def __init__(self, symbols, table, kline_interval=None, kline_store=None, backfill=None,
+                 base_url=FUTURES_STREAM_URL, mark_price=True):
+        self.symbols = list(symbols)
+        self.table = table
+        self.kline_interval = kline_interval
+        self.kline_store = kline_store
+        self.backfill = backfill
+        self.base_url = base_url.rstrip('/')
+        self.mark_price = mark_price
+        self.connected = False
+        self.last_message_time = 0.0
+        self.reconnect_count = 0
+        self._running = False
+        self._thread = None
+        self._loop = None
+        self._websocket = None
+        self._last_open_time = {}
+        self._backfill_lock = threading.Lock()
+        self._backfill_pending = {} # símbolo -> número do último preenchimento agendado (lacuna ainda aberta)
+        self._backfill_sequence = 0
+
+    # --- Controle ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='market-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._close_websocket()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def update_symbols(self, symbols):
+        """Troca os símbolos monitorados; a conexão atual é fechada e refeita com os novos streams."""
+        symbols = list(symbols)
+        if set(symbols) == set(self.symbols):
+            return
+        self.symbols = symbols
+        self._close_websocket()
+
+    def is_healthy(self):
+        return self.connected and time.time() - self.last_message_time <= STREAM_STALE_SECONDS
+
+    def covers(self, symbol, kline_interval=None):
+        if not self.is_healthy() or symbol not in self.symbols:
+            return False
+        return kline_interval is None or kline_interval == self.kline_interval
+
+    def needs_backfill(self, symbol):
+        with self._backfill_lock:
+            return symbol in self._backfill_pending
+
+    def stream_url(self):
+        streams = []
+        for symbol in self.symbols:
+            name = symbol.lower()
+            if self.kline_interval:
+                streams.append(f"{name}@kline_{self.kline_interval}")
+            if self.mark_price:
+                streams.append(f"{name}@markPrice@1s")
+        return f"{self.base_url}/stream?streams={'/'.join(streams)}"
+
+    def _close_websocket(self):
+        if self._loop and self._websocket is not None:
+            asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop)
+
+    # --- Loop de conexão ---
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._connect_forever())
+        finally:
+            self._loop.close()
+
+    async def _connect_forever(self):
+        delay = STREAM_RECONNECT_MIN_SECONDS
+        while self._running:
+            if not self.symbols:
+                await asyncio.sleep(1)
+                continue
+            try:
+                async with websockets.connect(self.stream_url(), ping_interval=20, max_size=None) as websocket:
+                    self._websocket = websocket
+                    self.connected = True
+                    self.last_message_time = time.time()
+                    delay = STREAM_RECONNECT_MIN_SECONDS
+                    logger.info("[STREAM] Conectado aos streams de mercado para %s símbolos.", len(self.symbols))
+                    self._schedule_backfill(self.symbols)
+                    async for message in websocket:
+                        self.last_message_time = time.time()
+                        self._handle_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._running:
+                    logger.warning("[STREAM] Conexão de mercado perdida: %s", e)
+            finally:
+                self.connected = False
+                self._websocket = None
+            if self._running:
+                self.reconnect_count += 1
+                logger.info("[STREAM] Reconectando em %ss...", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STREAM_RECONNECT_MAX_SECONDS)
+
+    def _schedule_backfill(self, symbols):
+        if self.backfill is None or not symbols:
+            return
+        for symbol in symbols:
+            with self._backfill_lock:
+                self._backfill_sequence += 1
+                self._backfill_pending[symbol] = self._backfill_sequence
+                sequence = self._backfill_sequence
+            self._loop.run_in_executor(None, self._run_backfill, symbol, sequence)
+
+    def _run_backfill(self, symbol, sequence):
+        try:
+            self.backfill(symbol)
+        except Exception as e:
+            # A lacuna continua pendente: o próximo candle fora de sequência agenda uma nova tentativa
+            logger.warning("[STREAM] Falha ao preencher lacuna de klines para %s: %s", symbol, e,
+                           extra={'symbol': symbol, 'event': 'kline_backfill_failed'})
+            return
+        with self._backfill_lock:
+            # Uma lacuna detectada durante este preenchimento mantém o símbolo pendente até o preenchimento seguinte
+            if self._backfill_pending.get(symbol) == sequence:
+                del self._backfill_pending[symbol]
+
+    # --- Mensagens ---
+    def _handle_message(self, message):
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        data = payload.get('data', payload)
+        event = data.get('e')
+        if event == 'kline':
+            self._handle_kline(data)
+        elif event == 'markPriceUpdate':
+            self.table.update_mark_price(data['s'], float(data['p']))
+
+    def _handle_kline(self, data):
+        symbol = data['s']
+        k = data['k']
+        kline = [int(k['t']), float(k['o']), float(k['h']), float(k['l']), float(k['c']), float(k['v']), int(k['T'])]
+        is_closed = bool(k['x'])
+        self.table.update_kline(symbol, kline, is_closed)
+
+        previous_open_time = self._last_open_time.get(symbol)
+        self._last_open_time[symbol] = kline[0]
+        if self.kline_store is None:
+            return
+        if self.kline_store.apply_live_kline(symbol, k['i'], kline, is_closed):
+            return
+        # Candle fora de sequência (lacuna no histórico local): preenche via REST
+        if previous_open_time != kline[0]:
+            self._schedule_backfill([symbol])
@@ -0,0 +1,182 @@
+"""
+Histogramas de latência no formato do Prometheus, sem dependências externas.
+
+Cada processo (bot e backend) registra suas medições no REGISTRY do módulo. O bot grava
+periodicamente um snapshot em METRICS_SNAPSHOT_PATH, e o backend o combina com as
+próprias métricas no endpoint /metrics (label process="bot" / process="backend").
+Registrar uma medição custa uma busca binária nos limites dos buckets e um lock.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+METRICS_SNAPSHOT_PATH = os.path.join('data', 'metrics', 'bot.json') # Snapshot do bot lido pelo backend
+METRICS_SNAPSHOT_INTERVAL_SECONDS = 5 # Intervalo de gravação do snapshot
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Histogram:
+    """Histograma com buckets fixos; os valores dos labels são passados na ordem de `labelnames`."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # valores dos labels -> [contagem por bucket (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *label_values):
+        """Context manager que registra a duração do bloco em segundos."""
+        return _Timer(self, label_values)
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(label_values), list(counts), total] for label_values, (counts, total) in self._series.items()]
+        return {'type': 'histogram', 'help': self.documentation, 'labelnames': list(self.labelnames),
+                'buckets': list(self.buckets), 'series': series}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._writer_thread = None
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Cria o histograma ou retorna o já registrado com o mesmo nome."""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+            return metric
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    # --- Snapshot em disco (bot -> backend) ---
+    def write_snapshot(self, path=METRICS_SNAPSHOT_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'written_at': time.time(), 'metrics': self.snapshot()}, f)
+        os.replace(tmp_path, path)
+
+    def start_snapshot_writer(self, path=METRICS_SNAPSHOT_PATH, interval_seconds=METRICS_SNAPSHOT_INTERVAL_SECONDS):
+        if self._writer_thread and self._writer_thread.is_alive():
+            return
+
+        def write_forever():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.write_snapshot(path)
+                except OSError as e:
+                    logger.warning("[MÉTRICAS] Falha ao gravar o snapshot de métricas: %s", e)
+
+        self._writer_thread = threading.Thread(target=write_forever, name='metrics-writer', daemon=True)
+        self._writer_thread.start()
+
+
+REGISTRY = MetricsRegistry()
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def gauge_snapshot(documentation, value):
+    """Gauge sem labels no formato de snapshot, para valores calculados na hora da coleta."""
+    return {'type': 'gauge', 'help': documentation, 'labelnames': [], 'series': [[[], value]]}
+
+
+def load_snapshot(path=METRICS_SNAPSHOT_PATH):
+    """Snapshot gravado por outro processo ({'written_at', 'metrics'}), ou None se não existir ou estiver ilegível."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("[MÉTRICAS] Snapshot de métricas ilegível: %s", e)
+        return None
+
+
+# --- Formato de exposição de texto do Prometheus ---
+def _format_value(value):
+    return '+Inf' if value == math.inf else repr(value)
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def render_prometheus(sources):
+    """
+    Texto do Prometheus para uma lista de (snapshot de métricas, labels extras). Métricas
+    com o mesmo nome em fontes diferentes saem juntas, distinguidas pelos labels extras.
+    """
+    merged = {}
+    for metrics, extra_labels in sources:
+        for name, metric in metrics.items():
+            merged.setdefault(name, []).append((metric, list(extra_labels.items())))
+
+    lines = []
+    for name in sorted(merged):
+        first = merged[name][0][0]
+        lines.append(f"# HELP {name} {first['help']}")
+        lines.append(f"# TYPE {name} {first['type']}")
+        for metric, extra_pairs in merged[name]:
+            if metric['type'] == 'gauge':
+                for label_values, value in metric['series']:
+                    pairs = extra_pairs + list(zip(metric['labelnames'], label_values))
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(float(value))}")
+                continue
+            bounds = metric['buckets'] + [math.inf]
+            for label_values, counts, total in metric['series']:
+                pairs = extra_pairs + list(zip(metric['labelnames'], label_values))
+                cumulative = 0
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(float(total))}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,202 @@
+"""
+Otimização dos parâmetros da estratégia por busca em grade ou aleatória sobre o backtest.
+
+Cada ponto (combinação de parâmetros) é simulado em todos os símbolos por um processo do
+pool. Os klines não são enviados aos processos: cada um abre os arquivos do histórico via
+memmap, compartilhando as mesmas páginas do cache do sistema. As séries de EMA/ATR
+de cada período são reaproveitadas entre pontos dentro do mesmo processo, e os resultados ficam
+gravados por hash da configuração, então uma nova execução pula os pontos já concluídos.
+
+Uso (a partir de scripts/):
+  python optimize.py --trend 30 50 100 --pullback 5 10 20 --atr-mult 0.5 1 1.5 --rr 1.5 2 3
+  python optimize.py --random 50 --seed 7 --metric profit_factor
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from backtest import (BACKTEST_KLINE_DIR, BACKTEST_WORKERS, SYMBOL_INFO, _init_worker, compute_indicator_series,
+                      load_klines, load_params, simulate_symbol, stored_symbols, summarize)
+from strategy import KLINE_INTERVAL_MAP
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZE_RESULTS_PATH = os.path.join('data', 'optimize', 'results.jsonl') # Um resultado (JSON) por linha, indexado pelo hash
+SERIES_CACHE_MAX_ENTRIES = 256 # Séries de indicadores mantidas em memória por processo
+
+# Parâmetros da estratégia que a busca pode variar (os mesmos do BotConfig)
+SWEEP_PARAMETERS = ('kline_trend_period', 'kline_pullback_period', 'kline_atr_period',
+                    'min_atr_multiplier_for_entry', 'risk_reward_ratio')
+
+_series_cache = {}
+
+
+# --- Espaço de busca ---
+def build_grid(ranges):
+    """Produto cartesiano de {parâmetro: [valores]} como lista de dicionários."""
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*(ranges[name] for name in names))]
+
+
+def sample_points(grid, count, seed):
+    if count >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, count)
+
+
+def data_fingerprint(symbols, interval, base_dir):
+    """Quantidade de candles e último open_time de cada símbolo: histórico novo invalida o cache."""
+    fingerprint = {}
+    for symbol in symbols:
+        klines = load_klines(symbol, interval, base_dir)
+        fingerprint[symbol] = [len(klines), int(klines['open_time'][-1]) if len(klines) else None]
+    return fingerprint
+
+
+def config_hash(params, fingerprint):
+    payload = json.dumps({'params': params, 'data': fingerprint}, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# --- Cache de resultados ---
+def load_results(path=OPTIMIZE_RESULTS_PATH):
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue # Linha truncada por uma execução interrompida
+            results[result['hash']] = result
+    return results
+
+
+def append_result(result, path=OPTIMIZE_RESULTS_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+# --- Avaliação de um ponto (roda nos processos do pool) ---
+def _cached_series(symbol, interval, base_dir, klines, trend_period, pullback_period, atr_period):
+    key = (symbol, interval, base_dir, trend_period, pullback_period, atr_period)
+    series = _series_cache.get(key)
+    if series is None:
+        if len(_series_cache) >= SERIES_CACHE_MAX_ENTRIES:
+            _series_cache.pop(next(iter(_series_cache)))
+        series = compute_indicator_series(klines, trend_period, pullback_period, atr_period)
+        _series_cache[key] = series
+    return series
+
+
+def evaluate_point(point_hash, params, symbols, base_dir):
+    interval = KLINE_INTERVAL_MAP[params['kline_interval_minutes']]
+    all_trades = []
+    simulated = 0
+    for symbol in symbols:
+        if symbol not in SYMBOL_INFO:
+            continue
+        klines = load_klines(symbol, interval, base_dir)
+        series = _cached_series(symbol, interval, base_dir, klines, params['kline_trend_period'],
+                                params['kline_pullback_period'], params['kline_atr_period'])
+        all_trades.extend(simulate_symbol(symbol, klines, params, series))
+        simulated += 1
+    all_trades.sort(key=lambda trade: trade['exit_time'])
+    summary = summarize(all_trades, params['initial_balance'] * max(simulated, 1))
+    return {'hash': point_hash, 'params': params, 'symbols': simulated, 'summary': summary}
+
+
+def run_sweep(points, base_params, symbols, base_dir=BACKTEST_KLINE_DIR, workers=BACKTEST_WORKERS,
+              results_path=OPTIMIZE_RESULTS_PATH, verbose=False):
+    """Avalia os pontos ainda não presentes no cache de resultados e retorna o resultado de todos eles."""
+    interval = KLINE_INTERVAL_MAP[base_params['kline_interval_minutes']]
+    fingerprint = data_fingerprint(symbols, interval, base_dir)
+    cached = load_results(results_path)
+
+    results = []
+    pending = []
+    for point in points:
+        params = dict(base_params, **point)
+        point_hash = config_hash(params, fingerprint)
+        if point_hash in cached:
+            results.append(cached[point_hash])
+        else:
+            pending.append((point_hash, params))
+    logger.info("%s pontos: %s já no cache, %s a simular em %s processos.", len(points), len(points) - len(pending), len(pending), workers)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(verbose,)) as executor:
+        futures = [executor.submit(evaluate_point, point_hash, params, symbols, base_dir) for point_hash, params in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            # Gravado assim que termina: uma execução interrompida não perde os pontos concluídos
+            append_result(result, results_path)
+            results.append(result)
+            summary = result['summary']
+            logger.info("[%s/%s] %s -> %s trades, PnL %.2f, PF %.2f", done, len(pending),
+                        [result['params'][name] for name in SWEEP_PARAMETERS], summary['trades'], summary['net_pnl'],
+                        summary['profit_factor'], extra={'event': 'sweep_point'})
+    return results
+
+
+def print_ranking(results, metric, top):
+    ranked = sorted(results, key=lambda result: result['summary'][metric], reverse=metric != 'max_drawdown_pct')
+    header = ''.join(f"{name.replace('kline_', ''):>18}" for name in SWEEP_PARAMETERS)
+    print(f"\nMelhores {min(top, len(ranked))} por {metric}:")
+    print(f"{header}{'Trades':>8}{'Acerto%':>9}{'PnL':>12}{'PF':>7}{'MaxDD%':>8}")
+    for result in ranked[:top]:
+        params, summary = result['params'], result['summary']
+        values = ''.join(f"{params[name]:>18}" for name in SWEEP_PARAMETERS)
+        print(f"{values}{summary['trades']:>8}{summary['win_rate']:>9.1f}{summary['net_pnl']:>12.2f}"
+              f"{summary['profit_factor']:>7.2f}{summary['max_drawdown_pct']:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Busca em grade/aleatória dos parâmetros da estratégia via backtest.")
+    parser.add_argument("--trend", type=int, nargs="+", help="Períodos da EMA de tendência")
+    parser.add_argument("--pullback", type=int, nargs="+", help="Períodos da EMA de pullback")
+    parser.add_argument("--atr", type=int, nargs="+", help="Períodos do ATR")
+    parser.add_argument("--atr-mult", type=float, nargs="+", help="Multiplicadores mínimos de ATR para entrada")
+    parser.add_argument("--rr", type=float, nargs="+", help="Relações risco:recompensa")
+    parser.add_argument("--random", type=int, help="Sorteia N pontos da grade em vez de avaliar todos")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--symbols", nargs="+", help="Símbolos (padrão: todos os armazenados)")
+    parser.add_argument("--config", default="config/settings.json", help="Parâmetros fixos (alavancagem, risco, intervalo...)")
+    parser.add_argument("--data-dir", default=BACKTEST_KLINE_DIR)
+    parser.add_argument("--results", default=OPTIMIZE_RESULTS_PATH)
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--metric", default="net_pnl", choices=["net_pnl", "return_pct", "profit_factor", "win_rate", "max_drawdown_pct"])
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    base_params = load_params(args.config)
+    ranges = {
+        'kline_trend_period': args.trend or [base_params['kline_trend_period']],
+        'kline_pullback_period': args.pullback or [base_params['kline_pullback_period']],
+        'kline_atr_period': args.atr or [base_params['kline_atr_period']],
+        'min_atr_multiplier_for_entry': args.atr_mult or [base_params['min_atr_multiplier_for_entry']],
+        'risk_reward_ratio': args.rr or [base_params['risk_reward_ratio']],
+    }
+    grid = build_grid(ranges)
+    points = sample_points(grid, args.random, args.seed) if args.random else grid
+
+    SYMBOL_INFO.load_snapshot()
+    interval = KLINE_INTERVAL_MAP[base_params['kline_interval_minutes']]
+    symbols = args.symbols or stored_symbols(interval, args.data_dir)
+    if not symbols:
+        parser.error("nenhum histórico encontrado: baixe com `python backtest.py --download`")
+
+    _init_worker(args.verbose)
+    logger.setLevel(logging.INFO) # O progresso da busca aparece mesmo sem --verbose (que só controla os logs do bot)
+    start = time.perf_counter()
+    results = run_sweep(points, base_params, symbols, args.data_dir, args.workers, args.results, args.verbose)
+    print_ranking(results, args.metric, args.top)
+    print(f"Tempo: {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,330 @@
+"""
+Livro de ofertas local por símbolo e estimativa do preço de execução de ordens a mercado.
+
+OrderBookStream mantém um OrderBook por símbolo monitorado a partir do stream de profundidade
+(diffs `depthUpdate`) e de um snapshot REST, seguindo a sincronização da Binance Futures: os
+eventos recebidos antes do snapshot ficam em buffer, os anteriores ao snapshot são descartados e
+cada evento seguinte precisa ter `pu` igual ao `u` do anterior; uma lacuna dispara novo snapshot.
+
+As estimativas percorrem só os níveis consumidos pela ordem (alguns microssegundos).
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+import websockets
+
+from market_stream import FUTURES_STREAM_URL, STREAM_RECONNECT_MAX_SECONDS, STREAM_RECONNECT_MIN_SECONDS, STREAM_STALE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEPTH_STREAM_SPEED = '100ms' # Frequência dos diffs de profundidade (100ms, 250ms ou 500ms)
+DEPTH_SNAPSHOT_LIMIT = 1000 # Níveis do snapshot REST usado para sincronizar o livro
+DEPTH_BUFFER_MAX_EVENTS = 1000 # Eventos guardados por símbolo enquanto o snapshot não chega
+ORDER_BOOK_MAX_AGE_SECONDS = 5 # Idade máxima do livro para ser usado no dimensionamento
+
+
+class OrderBook:
+    """Livro de um símbolo. Os preços de cada lado ficam em listas ordenadas do melhor para o pior."""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.last_update_id = None
+        self.updated_at = 0.0
+        self._levels = {'BUY': {}, 'SELL': {}} # lado da ordem -> {preço: quantidade} do lado consumido (asks/bids)
+        self._keys = {'BUY': [], 'SELL': []} # asks em ordem crescente; bids como -preço (melhor primeiro)
+        self._synced = False # Já aplicou o primeiro evento após o snapshot
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, symbol, snapshot):
+        book = cls(symbol)
+        book.load_snapshot(snapshot)
+        return book
+
+    def load_snapshot(self, snapshot):
+        """Snapshot no formato de futures_order_book: {'lastUpdateId', 'bids': [[preço, qtd]], 'asks': [...]}."""
+        with self._lock:
+            for side in ('BUY', 'SELL'):
+                self._levels[side].clear()
+                self._keys[side].clear()
+            self._update_levels(snapshot['bids'], snapshot['asks'])
+            self.last_update_id = int(snapshot['lastUpdateId'])
+            self.updated_at = time.time()
+            self._synced = False
+
+    def reset(self):
+        with self._lock:
+            self.last_update_id = None
+            self._synced = False
+
+    def apply_event(self, event):
+        """Aplica um evento depthUpdate. Retorna False se a sequência tiver lacuna (o livro precisa de novo snapshot)."""
+        with self._lock:
+            if self.last_update_id is None:
+                return False
+            if event['u'] < self.last_update_id:
+                return True # Já incluído no snapshot
+            if self._synced and event['pu'] != self.last_update_id:
+                return False
+            if not self._synced and event['U'] > self.last_update_id:
+                return False # Snapshot mais antigo que o primeiro evento em buffer
+            self._update_levels(event['b'], event['a'])
+            self.last_update_id = event['u']
+            self.updated_at = time.time()
+            self._synced = True
+            return True
+
+    def _update_levels(self, bids, asks):
+        for side, entries, sign in (('SELL', bids, -1), ('BUY', asks, 1)):
+            levels, keys = self._levels[side], self._keys[side]
+            for price, quantity in entries:
+                price, quantity = float(price), float(quantity)
+                key = sign * price
+                if quantity == 0:
+                    if levels.pop(price, None) is not None:
+                        del keys[bisect_left(keys, key)]
+                else:
+                    if price not in levels:
+                        insort(keys, key)
+                    levels[price] = quantity
+
+    # --- Consultas ---
+    def is_fresh(self, max_age_seconds=ORDER_BOOK_MAX_AGE_SECONDS):
+        return self.last_update_id is not None and time.time() - self.updated_at <= max_age_seconds
+
+    def best_price(self, side):
+        """Melhor preço do lado consumido por uma ordem `side` ('BUY' consome asks, 'SELL' consome bids)."""
+        with self._lock:
+            keys = self._keys[side]
+            return abs(keys[0]) if keys else None
+
+    def estimate_fill(self, side, quantity):
+        """(preço médio, slippage relativo ao melhor preço) de uma ordem a mercado; None se o livro não tiver profundidade."""
+        with self._lock:
+            levels, keys = self._levels[side], self._keys[side]
+            if not keys:
+                return None
+            remaining = quantity
+            cost = 0.0
+            for key in keys:
+                price = abs(key)
+                taken = min(remaining, levels[price])
+                cost += taken * price
+                remaining -= taken
+                if remaining <= 0:
+                    break
+            if remaining > 0:
+                return None
+            best = abs(keys[0])
+        average = cost / quantity
+        return average, abs(average - best) / best
+
+    def max_quantity(self, side, max_slippage):
+        """Maior quantidade cujo preço médio fica dentro de `max_slippage` do melhor preço (limitada à profundidade do livro)."""
+        with self._lock:
+            levels, keys = self._levels[side], self._keys[side]
+            if not keys:
+                return 0.0
+            best = abs(keys[0])
+            limit = best * (1 + max_slippage) if side == 'BUY' else best * (1 - max_slippage)
+            total = 0.0
+            cost = 0.0
+            for key in keys:
+                price = abs(key)
+                level_quantity = levels[price]
+                if (price - limit) * (1 if side == 'BUY' else -1) <= 0:
+                    total += level_quantity
+                    cost += level_quantity * price
+                    continue
+                # Nível além do limite: entra só a parte que leva o preço médio exatamente até ele
+                total += min(level_quantity, max(0.0, (limit * total - cost) / (price - limit)))
+                break
+            return total
+
+
+class OrderBookStream:
+    """
+    Ingestão do stream de profundidade da Binance Futures para os símbolos monitorados, no mesmo
+    modelo do MarketStream (loop asyncio em thread própria, reconexão com espera exponencial).
+    `fetch_snapshot(symbol)` devolve o snapshot REST e roda numa thread auxiliar.
+    """
+
+    def __init__(self, symbols, fetch_snapshot, base_url=FUTURES_STREAM_URL, speed=DEPTH_STREAM_SPEED):
+        self.symbols = list(symbols)
+        self.fetch_snapshot = fetch_snapshot
+        self.base_url = base_url.rstrip('/')
+        self.speed = speed
+        self.connected = False
+        self.last_message_time = 0.0
+        self.reconnect_count = 0
+        self.books = {} # símbolo -> OrderBook
+        self._buffers = {} # símbolo -> eventos recebidos enquanto o snapshot não chega
+        self._snapshot_pending = set()
+        self._snapshot_retry_delay = {} # símbolo -> espera da próxima tentativa após falha do snapshot
+        self._running = False
+        self._thread = None
+        self._loop = None
+        self._websocket = None
+
+    # --- Controle ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='depth-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._close_websocket()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def update_symbols(self, symbols):
+        """Troca os símbolos; a conexão é refeita e os livros dos novos símbolos são sincronizados do zero."""
+        symbols = list(symbols)
+        if set(symbols) == set(self.symbols):
+            return
+        self.symbols = symbols
+        self._close_websocket()
+
+    def is_healthy(self):
+        return self.connected and time.time() - self.last_message_time <= STREAM_STALE_SECONDS
+
+    def get_book(self, symbol, max_age_seconds=ORDER_BOOK_MAX_AGE_SECONDS):
+        """Livro sincronizado e recente do símbolo, ou None."""
+        book = self.books.get(symbol)
+        if book is None or not self.is_healthy() or not book.is_fresh(max_age_seconds):
+            return None
+        return book
+
+    def stream_url(self):
+        streams = '/'.join(f"{symbol.lower()}@depth@{self.speed}" for symbol in self.symbols)
+        return f"{self.base_url}/stream?streams={streams}"
+
+    def _close_websocket(self):
+        if self._loop and self._websocket is not None:
+            asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop)
+
+    # --- Loop de conexão ---
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._connect_forever())
+        finally:
+            self._loop.close()
+
+    async def _connect_forever(self):
+        delay = STREAM_RECONNECT_MIN_SECONDS
+        while self._running:
+            if not self.symbols:
+                await asyncio.sleep(1)
+                continue
+            try:
+                async with websockets.connect(self.stream_url(), ping_interval=20, max_size=None) as websocket:
+                    self._websocket = websocket
+                    self.connected = True
+                    self.last_message_time = time.time()
+                    delay = STREAM_RECONNECT_MIN_SECONDS
+                    # Nova conexão: todo livro precisa de um snapshot posterior aos eventos desta conexão
+                    self.books = {symbol: OrderBook(symbol) for symbol in self.symbols}
+                    self._buffers = {symbol: [] for symbol in self.symbols}
+                    logger.info("[PROFUNDIDADE] Conectado ao stream de profundidade para %s símbolos.", len(self.symbols))
+                    async for message in websocket:
+                        self.last_message_time = time.time()
+                        self._handle_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._running:
+                    logger.warning("[PROFUNDIDADE] Conexão do stream de profundidade perdida: %s", e)
+            finally:
+                self.connected = False
+                self._websocket = None
+            if self._running:
+                self.reconnect_count += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STREAM_RECONNECT_MAX_SECONDS)
+
+    # --- Sincronização ---
+    def _handle_message(self, message):
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        event = payload.get('data', payload)
+        if event.get('e') != 'depthUpdate':
+            return
+        symbol = event['s']
+        book = self.books.get(symbol)
+        if book is None:
+            return
+        if symbol in self._buffers:
+            self._buffer_event(symbol, event)
+        elif not book.apply_event(event):
+            logger.debug("[PROFUNDIDADE] %s: Lacuna na sequência do livro. Ressincronizando.", symbol, extra={'symbol': symbol, 'event': 'depth_resync'})
+            book.reset()
+            self._buffers[symbol] = [event]
+            self._request_snapshot(symbol)
+
+    def _buffer_event(self, symbol, event):
+        buffer = self._buffers[symbol]
+        buffer.append(event)
+        if len(buffer) > DEPTH_BUFFER_MAX_EVENTS:
+            del buffer[0]
+        self._request_snapshot(symbol)
+
+    def _request_snapshot(self, symbol):
+        if symbol in self._snapshot_pending:
+            return
+        self._snapshot_pending.add(symbol)
+        self._loop.run_in_executor(None, self._load_snapshot, symbol)
+
+    def _load_snapshot(self, symbol):
+        try:
+            snapshot, error = self.fetch_snapshot(symbol), None
+        except Exception as e:
+            snapshot, error = None, e
+        self._loop.call_soon_threadsafe(self._apply_snapshot, symbol, snapshot, error)
+
+    def _retry_snapshot_later(self, symbol, reason):
+        """
+        Agenda nova tentativa com espera exponencial, sem bloquear o loop. O símbolo continua em
+        `_snapshot_pending` durante a espera, então os eventos em buffer não disparam pedidos extras.
+        """
+        delay = self._snapshot_retry_delay.get(symbol, STREAM_RECONNECT_MIN_SECONDS)
+        self._snapshot_retry_delay[symbol] = min(delay * 2, STREAM_RECONNECT_MAX_SECONDS)
+        logger.warning("[PROFUNDIDADE] %s Nova tentativa para %s em %ss.", reason, symbol, delay,
+                       extra={'symbol': symbol, 'event': 'depth_snapshot_retry'})
+        self._snapshot_pending.add(symbol)
+        self._loop.call_later(delay, self._retry_snapshot, symbol)
+
+    def _retry_snapshot(self, symbol):
+        self._snapshot_pending.discard(symbol)
+        if self.connected and symbol in self._buffers:
+            self._request_snapshot(symbol)
+
+    def _apply_snapshot(self, symbol, snapshot, error=None):
+        """Roda no loop do stream: carrega o snapshot e reaplica os eventos em buffer."""
+        self._snapshot_pending.discard(symbol)
+        book = self.books.get(symbol)
+        if book is None or symbol not in self._buffers:
+            return
+        if snapshot is None:
+            # Os eventos continuam em buffer até a próxima tentativa
+            self._retry_snapshot_later(symbol, f"Falha ao obter o snapshot do livro de {symbol}: {error}.")
+            return
+        book.load_snapshot(snapshot)
+        events = self._buffers.pop(symbol)
+        for event in events:
+            if not book.apply_event(event):
+                # Snapshot mais antigo que os eventos: fica em buffer até um snapshot mais novo
+                book.reset()
+                self._buffers[symbol] = [e for e in events if e['u'] >= event['u']]
+                self._retry_snapshot_later(symbol, f"Snapshot do livro de {symbol} anterior aos eventos recebidos.")
+                return
+        self._snapshot_retry_delay.pop(symbol, None)
@@ -0,0 +1,139 @@
+"""
+Estado do bot persistido em SQLite (modo WAL): posições abertas com os IDs das ordens de
+entrada e SL/TP, e a alavancagem e o tipo de margem já definidos por símbolo.
+
+OPEN_POSITIONS, LEVERAGE_SET_FOR_SYMBOL e MARGIN_TYPE_SET_FOR_SYMBOL continuam sendo
+dicionários, mas cada atribuição ou remoção é gravada (e sincronizada em disco) antes de
+retornar. Na partida, `open()` carrega tudo com uma consulta, então um reinício não trata as
+próprias posições como "não rastreadas" nem redefine a alavancagem de cada símbolo.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_DB_PATH = os.path.join('data', 'state', 'bot.sqlite') # Banco do estado do bot
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, scope, key)
+)
+"""
+
+
+class PersistentDict(dict):
+    """
+    Dicionário cujas atribuições e remoções são gravadas na tabela `name` do StateStore (quando aberto).
+
+    Todo método que altera o dicionário passa por `__setitem__` ou `__delitem__`, então nenhuma
+    alteração fica só em memória. Para carregar o estado sem regravar, use os métodos de `dict`.
+    """
+
+    def __init__(self, store, name, scoped):
+        super().__init__()
+        self._store = store
+        self._name = name
+        self._scoped = scoped # Separado por modo (real/simulação) ou compartilhado pela conta
+
+    def __setitem__(self, key, value):
+        self._store.write(self._name, self._scoped, key, value)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._store.delete(self._name, self._scoped, key)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._store.delete(self._name, self._scoped, key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+
+class StateStore:
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self.scope = None
+        self._connection = None
+        self._lock = threading.Lock()
+        self.positions = PersistentDict(self, 'positions', scoped=True) # símbolo -> dados da posição e IDs das ordens
+        self.leverage = PersistentDict(self, 'leverage', scoped=False) # símbolo -> alavancagem definida na exchange
+        self.margin_types = PersistentDict(self, 'margin_types', scoped=False) # símbolo -> 'ISOLATED'/'CROSSED'
+
+    def open(self, scope):
+        """
+        Abre o banco e carrega o estado gravado. `scope` separa as posições do modo real das
+        do modo de simulação ('live'/'test'); alavancagem e margem são da conta e valem para os dois.
+        """
+        started_at = time.perf_counter()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=FULL") # Poucas gravações por trade: cada uma vai ao disco antes de seguir
+        connection.execute(_SCHEMA)
+        with self._lock:
+            self._connection = connection
+            self.scope = scope
+            for table in (self.positions, self.leverage, self.margin_types):
+                rows = connection.execute("SELECT key, value FROM entries WHERE name = ? AND scope = ?",
+                                          (table._name, self._scope_for(table._scoped))).fetchall()
+                dict.clear(table)
+                dict.update(table, ((key, json.loads(value)) for key, value in rows))
+        logger.info("[ESTADO] %s posições e %s alavancagens restauradas de %s em %.1fms.", len(self.positions),
+                    len(self.leverage), self.path, (time.perf_counter() - started_at) * 1000)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _scope_for(self, scoped):
+        return self.scope if scoped else ''
+
+    def write(self, name, scoped, key, value):
+        with self._lock:
+            if self._connection is None:
+                return # Não aberto (backtest, ferramentas): apenas em memória
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (name, scope, key, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (name, self._scope_for(scoped), key, json.dumps(value), time.time()))
+
+    def delete(self, name, scoped, key):
+        with self._lock:
+            if self._connection is None:
+                return
+            self._connection.execute("DELETE FROM entries WHERE name = ? AND scope = ? AND key = ?",
+                                     (name, self._scope_for(scoped), key))
@@ -0,0 +1,209 @@
+"""
+Núcleo da estratégia de pullback: sinal de entrada, SL/TP por ATR e dimensionamento da ordem.
+
+Funções puras, sem chamadas à API nem estado global: usadas pelo bot (main.py) e pelas
+ferramentas offline (backtest.py, optimize.py), que importam este módulo sem criar logs,
+banco de estado ou caches de klines.
+"""
+import logging
+import math
+
+from binance.client import Client
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE_PATH = "config/settings.json"
+MAX_ENTRY_SLIPPAGE_PERCENT = 0.1 # Slippage máximo estimado no livro para uma entrada a mercado (limita a quantidade)
+
+KLINE_INTERVAL_MAP = {
+    1: Client.KLINE_INTERVAL_1MINUTE,
+    5: Client.KLINE_INTERVAL_5MINUTE,
+    15: Client.KLINE_INTERVAL_15MINUTE,
+    30: Client.KLINE_INTERVAL_30MINUTE,
+    60: Client.KLINE_INTERVAL_1HOUR,
+    240: Client.KLINE_INTERVAL_4HOUR,
+    1440: Client.KLINE_INTERVAL_1DAY
+}
+
+# --- Função para calcular SL/TP baseado no ATR ---
+def calculate_atr_based_sl_tp(current_price, atr_value, side, risk_reward_ratio, price_precision):
+    sl_multiplier = 2.0 
+    tp_multiplier = sl_multiplier * risk_reward_ratio
+
+    sl_price = None
+    tp_price = None
+
+    if side == Client.SIDE_BUY: 
+        sl_price = current_price - (atr_value * sl_multiplier)
+        tp_price = current_price + (atr_value * tp_multiplier)
+    elif side == Client.SIDE_SELL: 
+        sl_price = current_price + (atr_value * sl_multiplier)
+        tp_price = current_price - (atr_value * tp_multiplier)
+    
+    if sl_price is not None:
+        sl_price = round(sl_price, price_precision)
+    if tp_price is not None:
+        tp_price = round(tp_price, price_precision)
+        
+    if side == Client.SIDE_BUY and sl_price >= current_price:
+        sl_price = current_price * 0.99 
+        logger.warning("[AVISO] SL para %s ajustado para %.*f (fallback).", side, price_precision, sl_price)
+    elif side == Client.SIDE_SELL and sl_price <= current_price:
+        sl_price = current_price * 1.01 
+        logger.warning("[AVISO] SL para %s ajustado para %.*f (fallback).", side, price_precision, sl_price)
+
+    if side == Client.SIDE_BUY and tp_price <= current_price:
+        tp_price = current_price * 1.01 
+        logger.warning("[AVISO] TP para %s ajustado para %.*f (fallback).", side, price_precision, tp_price)
+    elif side == Client.SIDE_SELL and tp_price >= current_price:
+        tp_price = current_price * 0.99 
+        logger.warning("[AVISO] TP para %s ajustado para %.*f (fallback).", side, price_precision, tp_price)
+
+    return sl_price, tp_price
+
+# --- Resultados de evaluate_long_signal ---
+SIGNAL_LONG = 'LONG'
+SIGNAL_NONE = 'NONE'
+SIGNAL_LOW_VOLATILITY = 'LOW_VOLATILITY'
+SIGNAL_INVALID_LEVELS = 'INVALID_LEVELS'
+
+def calculate_min_atr_threshold(step_size, min_atr_multiplier_for_entry):
+    return step_size * 5 * min_atr_multiplier_for_entry
+
+def evaluate_long_signal(current_price, current_low, prev_low, prev_close, ema_trend, ema_pullback, atr,
+                         min_atr_threshold, risk_reward_ratio, price_precision):
+    """
+    Aplica o filtro de volatilidade, as condições de tendência/pullback/retomada e o cálculo de SL/TP
+    ao candle atual. Retorna (resultado, sl_price, tp_price), com resultado entre os SIGNAL_*.
+    """
+    # --- Filtra por Volatilidade (ATR) ---
+    if atr < min_atr_threshold:
+        return SIGNAL_LOW_VOLATILITY, None, None
+
+    # --- Condições para Sinal de Compra (LONG) ---
+    is_uptrend = current_price > ema_trend
+
+    pulled_back = False
+    if current_price < ema_pullback and current_price > ema_trend:
+        pulled_back = True
+    elif current_low <= ema_trend and current_price > ema_trend:
+        pulled_back = True
+    elif prev_low is not None:
+        if prev_low <= ema_trend and prev_close < current_price:
+            pulled_back = True
+
+    confirmed_resumption = current_price > ema_pullback
+
+    if not (is_uptrend and pulled_back and confirmed_resumption):
+        return SIGNAL_NONE, None, None
+
+    sl_price, tp_price = calculate_atr_based_sl_tp(current_price, atr, Client.SIDE_BUY, risk_reward_ratio, price_precision)
+    if sl_price is None or tp_price is None or sl_price >= current_price or tp_price <= current_price:
+        return SIGNAL_INVALID_LEVELS, sl_price, tp_price
+    return SIGNAL_LONG, sl_price, tp_price
+
+# --- Função para calcular a quantidade da ordem a ser negociada (com gerenciamento de risco e min_notional) ---
+def calcular_quantidade_ordem(entrada_preco, available_balance, stop_loss_price,
+                              leverage_val, risk_per_trade_percent, max_risk_usdt_per_trade, symbol_name, info, order_book=None):
+    if info is None:
+        logger.error("[ERRO] Informações de símbolo para %s não encontradas. Não é possível calcular a quantidade.", symbol_name)
+        return None
+    
+    if entrada_preco <= 0:
+        logger.error("[ERRO] Preço de entrada inválido para cálculo de quantidade.")
+        return None
+
+    price_diff = abs(entrada_preco - stop_loss_price)
+    if stop_loss_price is None or price_diff < info['step_size'] * 2: 
+        logger.error("[ERRO] Preço de Stop Loss inválido ou muito próximo do preço de entrada para cálculo de quantidade.")
+        return None
+    
+    sl_value_per_unit = price_diff 
+    
+    risk_usdt_from_percent = available_balance * (risk_per_trade_percent / 100)
+    risk_usdt = min(risk_usdt_from_percent, max_risk_usdt_per_trade)
+    
+    if risk_usdt <= 0:
+        logger.warning("[AVISO] Risco calculado é zero ou negativo. Não é possível calcular a quantidade da ordem.")
+        return None
+
+    # 1. Calcula a quantidade baseada no risco
+    quantidade_base_risco = risk_usdt / sl_value_per_unit
+
+    # 1b. Com o livro de ofertas, o risco é medido a partir do preço médio esperado da execução a
+    # mercado, e a quantidade fica limitada à profundidade disponível dentro do slippage máximo
+    liquidity_cap = None
+    if order_book is not None:
+        book_side = 'BUY' if stop_loss_price < entrada_preco else 'SELL'
+        estimate = order_book.estimate_fill(book_side, quantidade_base_risco)
+        if estimate is not None:
+            expected_price, expected_slippage = estimate
+            expected_sl_value = abs(expected_price - stop_loss_price)
+            if expected_sl_value > sl_value_per_unit:
+                quantidade_base_risco = risk_usdt / expected_sl_value
+            logger.info("[LIQUIDEZ] %s: Preço médio esperado %.*f (slippage %.3f%% sobre o melhor preço).", symbol_name,
+                        info['price_precision'], expected_price, expected_slippage * 100,
+                        extra={'symbol': symbol_name, 'event': 'fill_estimate'})
+        liquidity_cap = order_book.max_quantity(book_side, MAX_ENTRY_SLIPPAGE_PERCENT / 100)
+    
+    step_size = info['step_size']
+    quantity_precision = info['quantity_precision']
+    min_qty = info['min_qty']
+    max_qty = info['max_qty']
+    min_notional = info.get('min_notional', 5.0) # Obtém o min_notional dos filtros do símbolo, com fallback
+    market_max_qty = info.get('market_max_qty', max_qty) 
+
+    # 2. Calcula a quantidade mínima para atender ao valor nocional
+    # Arredonda para cima para garantir que o mínimo nocional seja atendido
+    quantidade_min_notional_raw = min_notional / entrada_preco
+    quantidade_min_notional = math.ceil(quantidade_min_notional_raw / step_size) * step_size
+    quantidade_min_notional = round(quantidade_min_notional, quantity_precision)
+
+    # 3. A quantidade final deve ser a MAIOR entre a calculada pelo risco e a mínima pelo nocional
+    # Isso garante que o requisito de min_notional seja sempre atendido primeiro
+    quantidade_final = max(quantidade_base_risco, quantidade_min_notional)
+    
+    # Arredonda para baixo para o step_size mais próximo para garantir que não exceda o saldo
+    quantidade_final = math.floor(quantidade_final / step_size) * step_size 
+    quantidade_final = round(quantidade_final, quantity_precision)
+
+    # Log para informar ajuste de nocional
+    # Se a quantidade final calculada (que já atende ao min_notional) for maior que a base de risco
+    if quantidade_final > quantidade_base_risco and quantidade_base_risco > 0:
+        logger.warning("[AVISO] Quantidade ajustada de %.*f para %.*f para atender ao valor nocional mínimo (%.2f USDT).", quantity_precision, quantidade_base_risco, quantity_precision, quantidade_final, min_notional)
+    elif quantidade_final < min_notional / entrada_preco and quantidade_final > 0: # Se por algum arredondamento ficou abaixo do nocional
+        logger.warning("[AVISO] Quantidade calculada (%.*f) é menor que a necessária para o valor nocional mínimo (%.2f USDT). Forçando ajuste.", quantity_precision, quantidade_final, min_notional)
+        quantidade_final = quantidade_min_notional
+        logger.info("[INFO] Quantidade ajustada para %s para atender ao valor nocional mínimo.", quantidade_final)
+
+
+    # 4. Verifica limites de quantidade da exchange (min_qty, max_qty, market_max_qty)
+    if quantidade_final < min_qty:
+        logger.warning("[AVISO] Quantidade calculada (%s) menor que a mínima (%s) para %s. Não é possível abrir posição.", quantidade_final, min_qty, symbol_name)
+        return None 
+    elif quantidade_final > max_qty:
+        logger.warning("[AVISO] Quantidade calculada (%s) maior que a máxima (%s) para %s. Ajustando para max_qty.", quantidade_final, max_qty, symbol_name)
+        quantidade_final = max_qty
+    
+    if quantidade_final > market_max_qty:
+        logger.warning("[AVISO] Quantidade calculada (%s) maior que a máxima permitida para ordem de mercado (%s) para %s. Ajustando para market_max_qty.", quantidade_final, market_max_qty, symbol_name)
+        quantidade_final = market_max_qty
+
+    if liquidity_cap is not None and quantidade_final > liquidity_cap:
+        logger.warning("[AVISO] Quantidade calculada (%s) maior que a profundidade do livro dentro de %s%% de slippage (%.*f) para %s. Ajustando.", quantidade_final, MAX_ENTRY_SLIPPAGE_PERCENT, quantity_precision, liquidity_cap, symbol_name)
+        quantidade_final = math.floor(liquidity_cap / step_size) * step_size
+        if quantidade_final < min_qty or quantidade_final * entrada_preco < min_notional:
+            logger.warning("[AVISO] Liquidez insuficiente em %s para a quantidade mínima. Não é possível abrir posição.", symbol_name)
+            return None
+        
+    # Arredonda novamente após todos os ajustes de limites
+    quantidade_final = round(quantidade_final / step_size) * step_size
+    quantidade_final = round(quantidade_final, quantity_precision)
+    
+    # 5. Verifica se há margem suficiente para a quantidade final (que já atende ao min_notional e outros filtros)
+    initial_margin_needed = (entrada_preco * quantidade_final) / leverage_val
+    if initial_margin_needed > available_balance:
+        logger.error("[ERRO] Saldo insuficiente para a margem inicial calculada (%.2f USDT) para %s. Disponível: %.2f USDT. Não é possível abrir esta posição com o valor nocional mínimo exigido.", initial_margin_needed, symbol_name, available_balance)
+        return None 
+
+    return quantidade_final
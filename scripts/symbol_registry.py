@@ -0,0 +1,221 @@
+import decimal
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_REGISTRY_SNAPSHOT_PATH = os.path.join('data', 'exchange_info.json') # Snapshot em disco para partida rápida
+SYMBOL_REGISTRY_TTL_SECONDS = 3600 # Intervalo de atualização em segundo plano do exchange info
+SYMBOL_REGISTRY_MIN_REFRESH_SECONDS = 60 # Intervalo mínimo entre recargas disparadas por símbolos desconhecidos
+SYMBOL_NEGATIVE_CACHE_SECONDS = 900 # Tempo que um símbolo desconhecido fica no cache negativo
+
+
+def _precision(step):
+    precision = -decimal.Decimal(step).normalize().as_tuple().exponent
+    return precision if precision > 0 else 0
+
+
+class SymbolFilters:
+    """Filtros de negociação de um símbolo. Aceita acesso por chave (info['step_size']) como o antigo dicionário."""
+
+    __slots__ = ('symbol', 'quantity_precision', 'price_precision', 'min_qty', 'max_qty', 'min_price',
+                 'max_price', 'step_size', 'tick_size', 'min_notional', 'market_max_qty')
+
+    def __init__(self, symbol, quantity_precision, price_precision, min_qty, max_qty, min_price,
+                 max_price, step_size, tick_size, min_notional, market_max_qty):
+        self.symbol = symbol
+        self.quantity_precision = quantity_precision
+        self.price_precision = price_precision
+        self.min_qty = min_qty
+        self.max_qty = max_qty
+        self.min_price = min_price
+        self.max_price = max_price
+        self.step_size = step_size
+        self.tick_size = tick_size
+        self.min_notional = min_notional
+        self.market_max_qty = market_max_qty
+
+    @classmethod
+    def from_exchange_symbol(cls, s):
+        """Cria os filtros a partir de um item de futures_exchange_info()['symbols']; None se faltar algum filtro."""
+        filters = {f['filterType']: f for f in s['filters']}
+        lot_size_filter = filters.get('LOT_SIZE')
+        price_filter = filters.get('PRICE_FILTER')
+        min_notional_filter = filters.get('MIN_NOTIONAL')
+        market_lot_size_filter = filters.get('MARKET_LOT_SIZE')
+        if not (lot_size_filter and price_filter and min_notional_filter and market_lot_size_filter):
+            return None
+        return cls(
+            symbol=s['symbol'],
+            quantity_precision=_precision(lot_size_filter['stepSize']),
+            price_precision=_precision(price_filter['tickSize']),
+            min_qty=float(lot_size_filter['minQty']),
+            max_qty=float(lot_size_filter['maxQty']),
+            min_price=float(price_filter['minPrice']),
+            max_price=float(price_filter['maxPrice']),
+            step_size=float(lot_size_filter['stepSize']),
+            tick_size=float(price_filter['tickSize']),
+            min_notional=float(min_notional_filter['notional']),
+            market_max_qty=float(market_lot_size_filter['maxQty']),
+        )
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SymbolRegistry:
+    """
+    Registro dos símbolos negociáveis, montado a partir de uma única chamada a futures_exchange_info.
+
+    Funciona como um dicionário somente leitura símbolo -> SymbolFilters (perpétuos em TRADING
+    com todos os filtros). Símbolos desconhecidos entram num cache negativo para não
+    provocarem novos downloads a cada consulta; o registro é atualizado em segundo plano a
+    cada SYMBOL_REGISTRY_TTL_SECONDS e salvo em disco para a próxima partida.
+    """
+
+    def __init__(self, fetch_exchange_info, snapshot_path=SYMBOL_REGISTRY_SNAPSHOT_PATH,
+                 ttl_seconds=SYMBOL_REGISTRY_TTL_SECONDS):
+        self.fetch_exchange_info = fetch_exchange_info
+        self.snapshot_path = snapshot_path
+        self.ttl_seconds = ttl_seconds
+        self.loaded_at = 0.0 # Instante (epoch) em que os dados atuais foram obtidos da Binance
+        self._symbols = {}
+        self._usdt_perpetuals = []
+        self._negative_cache = {} # símbolo -> instante de expiração
+        self._last_refresh_attempt = 0.0
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self._stop_event = threading.Event()
+
+    # --- Interface de dicionário ---
+    def __contains__(self, symbol):
+        return symbol in self._symbols
+
+    def __getitem__(self, symbol):
+        return self._symbols[symbol]
+
+    def get(self, symbol, default=None):
+        return self._symbols.get(symbol, default)
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+    def usdt_perpetual_symbols(self):
+        return list(self._usdt_perpetuals)
+
+    # --- Carga ---
+    def _apply(self, symbols_payload, loaded_at):
+        symbols = {}
+        usdt_perpetuals = []
+        for s in symbols_payload:
+            if s['contractType'] != 'PERPETUAL' or s['status'] != 'TRADING':
+                continue
+            if s['symbol'].endswith('USDT'):
+                usdt_perpetuals.append(s['symbol'])
+            filters = SymbolFilters.from_exchange_symbol(s)
+            if filters is not None:
+                symbols[s['symbol']] = filters
+        # Troca as referências de uma vez: leitores nunca veem um registro pela metade
+        self._symbols = symbols
+        self._usdt_perpetuals = usdt_perpetuals
+        self._negative_cache = {symbol: expiry for symbol, expiry in self._negative_cache.items() if symbol not in symbols}
+        self.loaded_at = loaded_at
+
+    def refresh(self):
+        """Baixa o exchange info uma vez, reconstrói o registro e grava o snapshot."""
+        with self._refresh_lock:
+            self._last_refresh_attempt = time.time()
+            info = self.fetch_exchange_info()
+            self._apply(info['symbols'], time.time())
+            self._save_snapshot(info['symbols'])
+        logger.info("[INFO] Registro de símbolos atualizado: %s símbolos com filtros, %s pares USDT perpétuos.", len(self._symbols), len(self._usdt_perpetuals))
+
+    def ensure_loaded(self):
+        """Garante dados utilizáveis: snapshot em disco dentro do TTL ou, na falta dele, download."""
+        if self._symbols:
+            return
+        if self.load_snapshot() and time.time() - self.loaded_at < self.ttl_seconds:
+            return
+        self.refresh()
+
+    def resolve(self, symbol):
+        """
+        Filtros do símbolo, recarregando o registro no máximo uma vez por
+        SYMBOL_REGISTRY_MIN_REFRESH_SECONDS; símbolos ainda ausentes vão para o cache negativo.
+        """
+        filters = self._symbols.get(symbol)
+        if filters is not None:
+            return filters
+        now = time.time()
+        if self._negative_cache.get(symbol, 0) > now:
+            return None
+        if now - self._last_refresh_attempt >= SYMBOL_REGISTRY_MIN_REFRESH_SECONDS:
+            self.refresh()
+            filters = self._symbols.get(symbol)
+            if filters is not None:
+                return filters
+        self._negative_cache[symbol] = now + SYMBOL_NEGATIVE_CACHE_SECONDS
+        logger.info("[INFO] Símbolo %s não encontrado no registro. Ignorado pelos próximos %ss.", symbol, SYMBOL_NEGATIVE_CACHE_SECONDS,
+                    extra={'symbol': symbol, 'event': 'symbol_unknown'})
+        return None
+
+    # --- Snapshot em disco ---
+    def _save_snapshot(self, symbols_payload):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'loaded_at': self.loaded_at, 'symbols': symbols_payload}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning("[AVISO] Não foi possível salvar o snapshot do registro de símbolos: %s", e)
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            self._apply(snapshot['symbols'], snapshot['loaded_at'])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("[AVISO] Snapshot do registro de símbolos ilegível: %s", e)
+            return False
+        age_minutes = (time.time() - self.loaded_at) / 60
+        logger.info("[INFO] Registro de símbolos carregado do disco (%s símbolos, %.0f min de idade).", len(self._symbols), age_minutes)
+        return True
+
+    # --- Atualização em segundo plano ---
+    def start_background_refresh(self):
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='symbol-registry', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            wait_seconds = max(self.loaded_at + self.ttl_seconds - time.time(), SYMBOL_REGISTRY_MIN_REFRESH_SECONDS)
+            if self._stop_event.wait(wait_seconds):
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("[AVISO] Falha na atualização do registro de símbolos em segundo plano: %s", e)
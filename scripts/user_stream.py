@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import websockets
+
+from market_stream import FUTURES_STREAM_URL, STREAM_RECONNECT_MAX_SECONDS, STREAM_RECONNECT_MIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LISTEN_KEY_KEEPALIVE_SECONDS = 1800 # A Binance expira o listenKey após 60 min sem keepalive
+ORDER_TRACKER_MAX_ORDERS = 1000 # Quantidade de ordens recentes mantidas em memória
+ORDER_WAIT_HEALTH_CHECK_SECONDS = 1 # Intervalo para conferir a saúde do stream durante uma espera
+FINAL_ORDER_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
+
+def order_from_event(o):
+    """Converte o campo 'o' de um ORDER_TRADE_UPDATE para o formato de futures_get_order."""
+    return {
+        'symbol': o['s'],
+        'orderId': int(o['i']),
+        'clientOrderId': o.get('c'),
+        'side': o['S'],
+        'type': o['o'],
+        'origQty': o['q'],
+        'price': o.get('p', '0'),
+        'avgPrice': o.get('ap', '0'),
+        'stopPrice': o.get('sp', '0'),
+        'executedQty': o['z'],
+        'status': o['X'],
+        'reduceOnly': o.get('R', False),
+        'updateTime': int(o.get('T', 0)),
+    }
+
+
+class OrderTracker:
+    """
+    Último estado conhecido das ordens recentes, alimentado pelos eventos ORDER_TRADE_UPDATE.
+
+    Eventos que chegam antes de alguém aguardar a ordem (o preenchimento de uma MARKET
+    costuma chegar antes da resposta REST) ficam guardados; `wait_for_final` retorna assim
+    que a ordem atinge um status final e os ouvintes registrados são chamados a cada evento.
+    """
+
+    def __init__(self, max_orders=ORDER_TRACKER_MAX_ORDERS):
+        self.max_orders = max_orders
+        self._orders = OrderedDict()
+        self._condition = threading.Condition()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registra `callback(order)` para todas as atualizações de ordem."""
+        self._listeners.append(callback)
+
+    def apply_order_update(self, o):
+        order = order_from_event(o)
+        order_id = order['orderId']
+        with self._condition:
+            previous = self._orders.get(order_id)
+            if previous is not None and previous['updateTime'] > order['updateTime']:
+                return # Evento atrasado: já temos um estado mais novo
+            self._orders[order_id] = order
+            self._orders.move_to_end(order_id)
+            while len(self._orders) > self.max_orders:
+                self._orders.popitem(last=False)
+            self._condition.notify_all()
+        for listener in self._listeners:
+            try:
+                listener(order)
+            except Exception as e:
+                logger.warning("[USER STREAM] Falha em ouvinte de ordens: %s", e)
+
+    def get_order(self, order_id):
+        with self._condition:
+            order = self._orders.get(int(order_id))
+        return dict(order) if order else None
+
+    def wait_for_final(self, order_id, timeout_seconds, is_alive=None):
+        """
+        Aguarda um status final da ordem. Retorna a ordem ou None se o tempo acabar
+        ou se `is_alive()` indicar que os eventos deixaram de chegar.
+        """
+        order_id = int(order_id)
+        deadline = time.time() + timeout_seconds
+        with self._condition:
+            while True:
+                order = self._orders.get(order_id)
+                if order is not None and order['status'] in FINAL_ORDER_STATUSES:
+                    return dict(order)
+                remaining = deadline - time.time()
+                if remaining <= 0 or (is_alive is not None and not is_alive()):
+                    return None
+                self._condition.wait(min(remaining, ORDER_WAIT_HEALTH_CHECK_SECONDS))
+
+
+class UserDataStream:
+    """
+    User data stream da Binance Futures (listenKey + websocket) numa thread própria.
+
+    Repassa ORDER_TRADE_UPDATE ao OrderTracker e ACCOUNT_UPDATE a `on_account_update`,
+    mantém o listenKey vivo e reconecta com um listenKey novo quando a conexão cai ou a
+    Binance o expira. `client` só precisa de futures_stream_get_listen_key/keepalive/close,
+    e `base_url` pode apontar para um servidor websocket local nos testes.
+    """
+
+    def __init__(self, client, tracker=None, on_account_update=None, base_url=FUTURES_STREAM_URL):
+        self.client = client
+        self.tracker = tracker if tracker is not None else OrderTracker()
+        self.on_account_update = on_account_update
+        self.base_url = base_url.rstrip('/')
+        self.connected = False
+        self.connection_count = 0
+        self.last_message_time = 0.0
+        self._running = False
+        self._thread = None
+        self._loop = None
+        self._websocket = None
+        self._listen_key = None
+
+    # --- Controle ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='user-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._close_websocket()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def is_healthy(self):
+        return self.connected
+
+    def wait_for_order(self, order_id, timeout_seconds):
+        """
+        Status final da ordem recebido pelo stream, ou None se o tempo acabar ou se a conexão
+        cair durante a espera (eventos podem ter se perdido: o chamador deve consultar via REST).
+        """
+        connection = self.connection_count
+        return self.tracker.wait_for_final(
+            order_id, timeout_seconds,
+            is_alive=lambda: self.connected and self.connection_count == connection
+        )
+
+    def _close_websocket(self):
+        if self._loop and self._websocket is not None:
+            asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop)
+
+    # --- Loop de conexão ---
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._connect_forever())
+        finally:
+            self._loop.close()
+
+    async def _connect_forever(self):
+        delay = STREAM_RECONNECT_MIN_SECONDS
+        while self._running:
+            keepalive_task = None
+            try:
+                self._listen_key = await self._loop.run_in_executor(None, self.client.futures_stream_get_listen_key)
+                async with websockets.connect(f"{self.base_url}/ws/{self._listen_key}", ping_interval=20) as websocket:
+                    self._websocket = websocket
+                    self.connection_count += 1
+                    self.connected = True
+                    delay = STREAM_RECONNECT_MIN_SECONDS
+                    logger.info("[USER STREAM] Conectado ao user data stream.")
+                    keepalive_task = asyncio.ensure_future(self._keepalive(self._listen_key))
+                    async for message in websocket:
+                        self.last_message_time = time.time()
+                        self._handle_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._running:
+                    logger.warning("[USER STREAM] Conexão perdida: %s", e)
+            finally:
+                self.connected = False
+                self._websocket = None
+                if keepalive_task is not None:
+                    keepalive_task.cancel()
+            if self._running:
+                logger.info("[USER STREAM] Reconectando em %ss...", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STREAM_RECONNECT_MAX_SECONDS)
+        await self._loop.run_in_executor(None, self._close_listen_key)
+
+    async def _keepalive(self, listen_key):
+        while True:
+            await asyncio.sleep(LISTEN_KEY_KEEPALIVE_SECONDS)
+            try:
+                await self._loop.run_in_executor(None, lambda: self.client.futures_stream_keepalive(listen_key))
+            except Exception as e:
+                logger.warning("[USER STREAM] Falha no keepalive do listenKey (%s). Reconectando com um novo.", e)
+                await self._websocket.close()
+                return
+
+    def _close_listen_key(self):
+        if self._listen_key is None:
+            return
+        try:
+            self.client.futures_stream_close(self._listen_key)
+        except Exception as e:
+            logger.warning("[USER STREAM] Falha ao encerrar o listenKey: %s", e)
+
+    # --- Mensagens ---
+    def _handle_message(self, message):
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        event = data.get('e')
+        if event == 'ORDER_TRADE_UPDATE':
+            self.tracker.apply_order_update(data['o'])
+        elif event == 'ACCOUNT_UPDATE':
+            if self.on_account_update is not None:
+                try:
+                    self.on_account_update(data)
+                except Exception as e:
+                    logger.warning("[USER STREAM] Falha ao processar ACCOUNT_UPDATE: %s", e)
+        elif event == 'listenKeyExpired':
+            logger.info("[USER STREAM] listenKey expirado. Reconectando com um novo.")
+            asyncio.ensure_future(self._websocket.close())
@@ -0,0 +1,106 @@
+"""
+Lista de símbolos monitorados pelo bot, atualizada por novas varreduras em segundo plano.
+
+A varredura roda numa thread própria e deixa o resultado pendente; o loop principal aplica a
+troca entre dois ciclos, então um ciclo nunca vê a lista mudar no meio. Símbolos com posição
+aberta continuam na lista mesmo que a nova varredura não os selecione. A lista atual é gravada
+em WATCHLIST_SNAPSHOT_PATH, lido pelo endpoint /watchlist do backend.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WATCHLIST_SNAPSHOT_PATH = os.path.join('data', 'watchlist.json') # Lista atual e horários das varreduras
+
+
+class Watchlist:
+    def __init__(self, snapshot_path=WATCHLIST_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
+        self.symbols = () # Tupla trocada por inteiro: quem a lê nunca vê uma lista pela metade
+        self.kept_symbols = () # Mantidos por causa de posição aberta, fora da última seleção
+        self.last_scan_at = None # Horário (epoch, segundos) da última varredura concluída
+        self.last_scan_duration_seconds = None
+        self.next_scan_at = None
+        self._pending = None
+        self._scan_thread = None
+        self._lock = threading.Lock()
+
+    def replace(self, selected, keep=()):
+        """Aplica uma nova seleção; símbolos de `keep` fora dela continuam. Retorna (adicionados, removidos)."""
+        kept = tuple(symbol for symbol in keep if symbol not in selected)
+        symbols = tuple(selected) + kept
+        added = [symbol for symbol in symbols if symbol not in self.symbols]
+        removed = [symbol for symbol in self.symbols if symbol not in symbols]
+        self.symbols = symbols
+        self.kept_symbols = kept
+        return added, removed
+
+    def record_scan(self, scanned_at, duration_seconds, next_scan_at=None):
+        self.last_scan_at = scanned_at
+        self.last_scan_duration_seconds = duration_seconds
+        self.next_scan_at = next_scan_at
+
+    # --- Varredura em segundo plano ---
+    def is_scanning(self):
+        return self._scan_thread is not None and self._scan_thread.is_alive()
+
+    def start_scan(self, scan):
+        """Roda `scan()` numa thread; o resultado (lista de símbolos, ou None em caso de falha) fica pendente."""
+        if self.is_scanning():
+            return False
+
+        def run():
+            try:
+                result = scan()
+            except Exception as e:
+                logger.error("[WATCHLIST] Falha na varredura em segundo plano: %s", e)
+                result = None
+            with self._lock:
+                self._pending = result
+
+        self._scan_thread = threading.Thread(target=run, name='watchlist-rescan', daemon=True)
+        self._scan_thread.start()
+        return True
+
+    def take_pending(self):
+        """Resultado da última varredura em segundo plano ainda não aplicado (None se não houver)."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending
+
+    # --- Snapshot em disco (bot -> backend) ---
+    def snapshot(self):
+        return {
+            'symbols': list(self.symbols),
+            'kept_for_open_positions': list(self.kept_symbols),
+            'last_scan_at': self.last_scan_at,
+            'last_scan_duration_seconds': self.last_scan_duration_seconds,
+            'next_scan_at': self.next_scan_at,
+            'written_at': time.time(),
+        }
+
+    def write_snapshot(self):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning("[WATCHLIST] Falha ao gravar o snapshot da lista de símbolos: %s", e)
+
+
+def load_snapshot(path=WATCHLIST_SNAPSHOT_PATH):
+    """Snapshot gravado pelo bot, ou None se não existir ou estiver ilegível."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("[WATCHLIST] Snapshot da lista de símbolos ilegível: %s", e)
+        return None